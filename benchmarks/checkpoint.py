@@ -0,0 +1,42 @@
+import timeit
+
+from src.api import codec
+from src.api.codec import decode_checkpoint, encode_checkpoint
+from src.api.models import CheckPoint, Story, StoryManager
+
+TEXT = "You find a wallet on the street. It contains $500, a photo and a note with an address. " * 3
+
+
+def make_checkpoint() -> CheckPoint:
+    # same shape as TextGenerator.compile_stories output, active story points to first continuation
+    stories = [Story(tag="story", text=TEXT, option_1="Turn it into the police", option_2="Keep the money")]
+    for branch in ["1", "2"]:
+        stories.append(Story(tag=f"story-{branch}", text=TEXT, option_1="Accept", option_2="Refuse"))
+        for ending in ["1", "2"]:
+            stories.append(Story(tag=f"story-{branch}-{ending}", text=TEXT, end=True))
+    return CheckPoint(post_id=1667000000000000000, story_manager=StoryManager(stories=stories, active_story=stories[1]))
+
+
+def measure(func) -> float:
+    number, elapsed = timeit.Timer(func).autorange()
+    return elapsed / number
+
+
+def main():
+    checkpoint = make_checkpoint()
+    cases = {"legacy json": checkpoint.json(exclude={"etag"}).encode("utf-8")}
+    # without zstandard codec falls back to gzip, its rows would only repeat gzip ones
+    compressions = ["", "gzip"] + ([] if codec.zstandard is None else ["zstd"])
+    if codec.zstandard is None:
+        print("zstandard is not installed, zstd is skipped")
+    for format in ["json", "binary"]:
+        for compression in compressions:
+            cases[f"{format} {compression or 'raw'}"] = encode_checkpoint(checkpoint, format, compression)
+
+    print(f"{'format':<16}{'bytes':>8}{'decode us':>12}")
+    for name, data in cases.items():
+        print(f"{name:<16}{len(data):>8}{measure(lambda: decode_checkpoint(data)) * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
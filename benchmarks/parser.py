@@ -0,0 +1,97 @@
+import argparse
+import re
+import timeit
+
+from src.api.exceptions import StoryParseError
+from src.implementation.text_generator.parser import StoryParser
+
+# pattern used by TextGenerator.search_story_parts before single pass parser
+LEGACY_PATTERN = re.compile("\\s*.*{story-begin}:\\s*(?P<storybegin>\\s*.+)\\s*{option 1}:\\s*(?P<option1>\\s*.+)\\s*{option 2}:\\s*(?P<option2>\\s*.+)\\s*{story-option 1}:\\s*(?P<story1>\\s*.+)\\s*{option 1}:\\s*(?P<story1option1>\\s*.+)\\s*{option 2}:\\s*(?P<story1option2>\\s*.+)\\s*{end-option 1}:\\s*(?P<end11>\\s*.+)\\s*{end-option 2}:\\s*(?P<end12>\\s*.+)\\s*{story-option 2}:\\s*(?P<story2>\\s*.+)\\s*{option 1}:\\s*(?P<story2option1>\\s*.+)\\s*{option 2}:\\s*(?P<story2option2>\\s*.+)\\s*{end-option 1}:\\s*(?P<end21>\\s*.+)\\s*{end-option 2}:\\s*(?P<end22>\\s*.+)")
+
+REAL = """
+Here's an example:
+
+    {story-begin}:
+    You find a wallet on the street. It contains $500. Do you:
+
+    {option 1}: Turn it into the police
+
+    {option 2}: Keep the money
+
+    {story-option 1}:
+    You turn the wallet into the police station. Later, the owner calls and rewards you with $100. Do you:
+
+    {option 1}: Accept the reward
+
+    {option 2}: Refuse the reward
+
+    {end-option 1}:
+    You accept the reward and feel good about making an honest decision.
+
+    {end-option 2}:
+    You refuse the reward but feel satisfied knowing you did the right thing.
+
+    {story-option 2}:
+    You keep the money and feel guilty. Later, you see a homeless person and have an urge to help. Do you:
+
+    {option 1}: Give the homeless person some money
+
+    {option 2}: Ignore the homeless person and move on
+
+    {end-option 1}:
+    You give the homeless person some money and feel better about yourself.
+
+    {end-option 2}:
+    You ignore the homeless person and feel bad about your decision.
+"""
+
+
+def cases(include_slow: bool) -> dict:
+    # same transformation as TextGenerator.get_content
+    real = REAL.replace("\n ", "")
+    result = {
+        "real": real,
+        "real, long sections": real.replace(". ", ". " + "Lorem ipsum dolor sit amet. " * 50),
+        "truncated after opening": real[:real.index("{story-option 1}")],
+        "whitespace run, 200 lines": "{story-begin}: a\n{option 1}: b\n{option 2}: c\n{story-option 1}:" + " \n" * 200,
+        "whitespace run, 400 lines": "{story-begin}: a\n{option 1}: b\n{option 2}: c\n{story-option 1}:" + " \n" * 400,
+    }
+    if include_slow:
+        # each takes from seconds to minutes for legacy pattern
+        result["truncated after first branch"] = real[:real.index("{story-option 2}")]
+        result["real, last marker missing"] = real.replace("{end-option 2}", "")
+    return result
+
+
+def legacy(content: str):
+    return LEGACY_PATTERN.search(content)
+
+
+def single_pass(content: str):
+    try:
+        return StoryParser.parse(content)
+    except StoryParseError:
+        return None
+
+
+def measure(func, content: str) -> float:
+    timer = timeit.Timer(lambda: func(content))
+    number, elapsed = timer.autorange()
+    return elapsed / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare legacy story regex with single pass parser")
+    parser.add_argument("--include-slow", action="store_true", help="run cases where legacy regex takes minutes")
+    args = parser.parse_args()
+
+    print(f"{'case':<32}{'chars':>8}{'regex ms':>14}{'parser ms':>14}{'speedup':>10}")
+    for name, content in cases(args.include_slow).items():
+        regex_time = measure(legacy, content)
+        parser_time = measure(single_pass, content)
+        print(f"{name:<32}{len(content):>8}{regex_time * 1000:>14.4f}{parser_time * 1000:>14.4f}"
+              f"{regex_time / parser_time:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
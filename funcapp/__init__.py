@@ -1,11 +1,9 @@
 import logging
+import time
 
 import azure.functions as func
 
-from src.implementation.publisher.twitter import Publisher
-from src.implementation.text_generator.openai import TextGenerator
-from src.implementation.worker.azure import Worker
-from src.implementation.storage.azure import Storage
+from src.implementation.container import container
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.WARNING)
@@ -14,8 +12,9 @@ logging.basicConfig(level=logging.DEBUG)
 
 
 async def main(mytimer: func.TimerRequest) -> None:
-    worker = Worker(text_generator=TextGenerator(), publisher=Publisher(), storage=Storage())
+    started = time.perf_counter()
+    worker = container.create_worker()
 
     await worker.exec()
 
-    logging.info("Done")
+    logging.info(f"Done in {time.perf_counter() - started:.2f}s, {container.stats()}")
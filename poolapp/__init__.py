@@ -0,0 +1,17 @@
+import logging
+import time
+
+import azure.functions as func
+
+from src.implementation.container import container
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+async def main(mytimer: func.TimerRequest) -> None:
+    started = time.perf_counter()
+    worker = container.create_worker()
+
+    added = await worker.refill_story_pool()
+
+    logging.info(f"Done in {time.perf_counter() - started:.2f}s, added {added} stories to pool, {container.stats()}")
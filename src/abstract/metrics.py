@@ -0,0 +1,14 @@
+from abc import ABC, abstractmethod
+from typing import Dict
+
+from src.api.models import Span, SpanSummary
+
+
+class MetricsSink(ABC):
+    @abstractmethod
+    def record(self, span: Span) -> None:
+        pass
+
+    @abstractmethod
+    def summarise(self, name: str, summary: Dict[str, SpanSummary]) -> None:
+        pass
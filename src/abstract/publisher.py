@@ -1,14 +1,46 @@
+import asyncio
 from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Union
 
+from src.api.config import TWITTER_LOOKUP_CONCURRENCY, TWITTER_LOOKUP_TIMEOUT
 from src.api.models import PublisherPost
 
 
+async def gather_posts(get_post: Callable[[int], Awaitable[PublisherPost]], post_ids: List[int],
+                       concurrency: int = TWITTER_LOOKUP_CONCURRENCY,
+                       timeout: Optional[float] = TWITTER_LOOKUP_TIMEOUT) -> Dict[int, Union[PublisherPost, Exception]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(post_id: int) -> PublisherPost:
+        async with semaphore:
+            return await asyncio.wait_for(get_post(post_id), timeout)
+
+    # one failed lookup doesn't fail the rest, error is returned in place of the post
+    results = await asyncio.gather(*[bounded(post_id) for post_id in post_ids], return_exceptions=True)
+    return dict(zip(post_ids, results))
+
+
 class Publisher(ABC):
 
     @abstractmethod
     async def get_post(self, post_id: int) -> PublisherPost:
         pass
 
+    async def get_posts(self, post_ids: List[int]) -> Dict[int, Union[PublisherPost, Exception]]:
+        return await gather_posts(self.get_post, post_ids)
+
     @abstractmethod
     async def push_post(self, post: PublisherPost) -> int:
         pass
+
+    async def delete_post(self, post_id: int) -> None:
+        raise NotImplementedError(f"{type(self).__name__} can't delete posts")
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -1,12 +1,27 @@
+import asyncio
 import json
+import time
 from abc import ABC, abstractmethod
-from typing import Union
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
-from src.api.config import CHECKPOINT_NAME
-from src.api.models import CheckPoint
+from src.api.config import CHECKPOINT_NAME, STORY_POOL_NAME
+from src.api.codec import decode_checkpoint, encode_checkpoint
+from src.api.exceptions import StorageConflict
+from src.api.models import CheckPoint, StoryManager, StoryPool
+
+T = TypeVar("T")
 
 
 class Storage(ABC):
+    def __init__(self):
+        # last read checkpoint of every channel is kept in memory, warm host only asks storage whether it changed
+        self.checkpoint_cache: Dict[str, CheckPoint] = {}
+        self.checkpoint_reads = 0
+        self.checkpoint_not_modified = 0
+        self.round_trips_saved = 0
+        # pool changes of one process don't interleave, other processes are caught by etag check
+        self.pool_lock = asyncio.Lock()
+
     @abstractmethod
     async def file_exists(self, file_path: str) -> bool:
         pass
@@ -17,26 +32,178 @@ class Storage(ABC):
 
     @abstractmethod
     async def get_file(self, file_path: str) -> bytes:
+        # should raise FileNotFoundError when file is missing
         pass
 
     @abstractmethod
     async def upload_file(self, file_path: str, file: bytes, rewrite: bool = True) -> bool:
         pass
 
-    async def get_checkpoint(self) -> Union[CheckPoint, None]:
-        if not await self.file_exists(CHECKPOINT_NAME):
+    async def get_file_if_changed(self, file_path: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        # returns file and its etag, or None instead of file when it still has given etag.
+        # Storages without etags always download
+        return await self.get_file(file_path), None
+
+    async def upload_file_if_match(self, file_path: str, file: bytes, etag: Optional[str]) -> Optional[str]:
+        # writes file only if it still has given etag, or only if it doesn't exist when etag is None.
+        # Returns new etag and raises StorageConflict otherwise. Storages without etags can only check existence
+        if etag is None and await self.file_exists(file_path):
+            raise StorageConflict(file_path)
+        await self.upload_file(file_path, file)
+        return None
+
+    async def delete_file_if_match(self, file_path: str, etag: Optional[str]) -> bool:
+        return await self.delete_file(file_path)
+
+    async def append_file(self, file_path: str, file: bytes) -> int:
+        # returns offset the data was written at. Storages without native append rewrite whole file
+        while True:
+            try:
+                data, etag = await self.get_file_if_changed(file_path, None)
+            except FileNotFoundError:
+                data, etag = b"", None
+            try:
+                if etag is None and data:
+                    await self.upload_file(file_path, data + file)
+                else:
+                    await self.upload_file_if_match(file_path, data + file, etag)
+                return len(data)
+            except StorageConflict:
+                continue
+
+    async def get_file_range(self, file_path: str, offset: int, length: int) -> bytes:
+        return (await self.get_file(file_path))[offset:offset + length]
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def checkpoint_name(channel: str = "") -> str:
+        return CHECKPOINT_NAME if not channel else f"channels/{channel}/{CHECKPOINT_NAME}"
+
+    async def get_checkpoint(self, channel: str = "") -> Union[CheckPoint, None]:
+        self.checkpoint_reads += 1
+        # missing checkpoint is found out from download itself, exists call is not needed
+        self.round_trips_saved += 1
+        cached = self.checkpoint_cache.get(channel)
+        try:
+            data, etag = await self.get_file_if_changed(self.checkpoint_name(channel),
+                                                        None if cached is None else cached.etag)
+        except FileNotFoundError:
+            self.checkpoint_cache.pop(channel, None)
+            return None
+
+        if data is None:
+            # checkpoint body wasn't downloaded again
+            self.checkpoint_not_modified += 1
+            # worker changes checkpoint in place, cached one must stay untouched
+            return cached.copy(deep=True)
+
+        checkpoint = decode_checkpoint(data)
+        checkpoint.etag = etag
+
+        self.remember_checkpoint(checkpoint, channel)
+        return checkpoint
+
+    async def save_checkpoint(self, checkpoint: CheckPoint, channel: str = "") -> bool:
+        data_encoded = encode_checkpoint(checkpoint)
+
+        # checkpoint is written only over the version it was read from, new one only if there is none
+        self.checkpoint_cache.pop(channel, None)
+        checkpoint.etag = await self.upload_file_if_match(self.checkpoint_name(channel), data_encoded,
+                                                          checkpoint.etag)
+        self.remember_checkpoint(checkpoint, channel)
+        return True
+
+    async def remove_checkpoint(self, checkpoint: Optional[CheckPoint] = None, channel: str = "") -> bool:
+        self.checkpoint_cache.pop(channel, None)
+        if checkpoint is None or checkpoint.etag is None:
+            return await self.delete_file(self.checkpoint_name(channel))
+        return await self.delete_file_if_match(self.checkpoint_name(channel), checkpoint.etag)
+
+    def remember_checkpoint(self, checkpoint: CheckPoint, channel: str = "") -> None:
+        if checkpoint.etag is not None:
+            self.checkpoint_cache[channel] = checkpoint.copy(deep=True)
+
+    async def acquire_lease(self, file_path: str, seconds: float) -> Optional[str]:
+        # lease is separate lock file, so it works for files that don't exist yet. Returns lease etag
+        lease_path = f"{file_path}.lease"
+        now = time.time()
+        lease = json.dumps({"expires": now + seconds}).encode(encoding="utf-8")
+        try:
+            return await self.upload_file_if_match(lease_path, lease, None)
+        except StorageConflict:
+            pass
+
+        try:
+            held, etag = await self.get_file_if_changed(lease_path, None)
+        except FileNotFoundError:
+            # released just now, it is taken on next run
+            raise StorageConflict(lease_path)
+        if json.loads(held.decode(encoding="utf-8"))["expires"] > now:
+            raise StorageConflict(lease_path)
+
+        # lease of crashed worker is expired and can be taken over
+        if etag is None:
+            await self.upload_file(lease_path, lease)
             return None
-        data: bytes = await self.get_file(CHECKPOINT_NAME)
-        decoded = data.decode(encoding="utf-8")
-        data_dict = json.loads(decoded)
+        return await self.upload_file_if_match(lease_path, lease, etag)
 
-        return CheckPoint(**data_dict)
+    async def release_lease(self, file_path: str, etag: Optional[str]) -> bool:
+        lease_path = f"{file_path}.lease"
+        if etag is None:
+            return await self.delete_file(lease_path)
+        return await self.delete_file_if_match(lease_path, etag)
 
-    async def save_checkpoint(self, checkpoint: CheckPoint) -> bool:
-        data = checkpoint.json()
+    async def get_story_pool(self) -> StoryPool:
+        pool, _, _ = await self.read_story_pool()
+        return pool
+
+    async def read_story_pool(self) -> Tuple[StoryPool, Optional[bytes], Optional[str]]:
+        try:
+            data, etag = await self.get_file_if_changed(STORY_POOL_NAME, None)
+        except FileNotFoundError:
+            return StoryPool(), None, None
+        return StoryPool(**json.loads(data.decode(encoding="utf-8"))), data, etag
+
+    async def save_story_pool(self, pool: StoryPool) -> bool:
+        data = pool.json()
         data_encoded = data.encode(encoding="utf-8")
 
-        return await self.upload_file(CHECKPOINT_NAME, data_encoded)
+        return await self.upload_file(STORY_POOL_NAME, data_encoded)
+
+    async def update_story_pool(self, change: Callable[[StoryPool], T]) -> T:
+        # pool is shared by channels, hosts and pool refill, it is written only over the version change was made to.
+        # Lock only keeps channels of this process from conflicting with each other
+        async with self.pool_lock:
+            while True:
+                pool, data, etag = await self.read_story_pool()
+                result = change(pool)
+                if result is None:
+                    return result
+                try:
+                    if data is not None and etag is None:
+                        await self.save_story_pool(pool)
+                    else:
+                        await self.upload_file_if_match(STORY_POOL_NAME, pool.json().encode(encoding="utf-8"), etag)
+                    return result
+                except StorageConflict:
+                    continue
+
+    async def pop_pooled_story(self) -> Union[StoryManager, None]:
+        return await self.update_story_pool(lambda pool: pool.stories.pop(0) if pool.stories else None)
+
+    async def extend_story_pool(self, managers: List[StoryManager]) -> bool:
+        def extend(pool: StoryPool) -> bool:
+            pool.stories.extend(managers)
+            return True
+
+        return await self.update_story_pool(extend)
+
+    async def push_pooled_story(self, manager: StoryManager) -> bool:
+        # returned story is used first next time
+        def push(pool: StoryPool) -> bool:
+            pool.stories.insert(0, manager)
+            return True
 
-    async def remove_checkpoint(self) -> bool:
-        return await self.delete_file(CHECKPOINT_NAME)
+        return await self.update_story_pool(push)
@@ -1,11 +1,71 @@
+import asyncio
+import logging
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterator, List
 
-from src.api.models import StoryManager
+from src.api.config import OPENAI_BATCH_CONCURRENCY
+from src.api.models import GenerationResult, GenerationStats, Story, StoryManager
 
 
 class TextGenerator(ABC):
     promt: str = None
+    tokens_used: int = 0
 
     @abstractmethod
     async def generate_story(self, promt: str = None) -> StoryManager:
         pass
+
+    async def generate_story_streaming(self, on_active_story: Callable[[Story], None],
+                                       promt: str = None) -> StoryManager:
+        # generators that can't stream hand over active story once whole story is ready
+        manager = await self.generate_story(promt)
+        on_active_story(manager.active_story)
+        return manager
+
+    async def generate_stories(self, n: int = None, prompts: List[str] = None,
+                               concurrency: int = OPENAI_BATCH_CONCURRENCY,
+                               stats: GenerationStats = None) -> AsyncIterator[GenerationResult]:
+        prompts = list(prompts) if prompts is not None else [None] * n
+        stats = GenerationStats() if stats is None else stats
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.monotonic()
+        tokens_before = self.tokens_used
+
+        async def generate(index: int, promt: str) -> GenerationResult:
+            async with semaphore:
+                try:
+                    manager = await self.generate_story(promt)
+                except Exception as e:
+                    logging.warning(f"Failed to generate story {index}: {e}")
+                    return GenerationResult(index=index, promt=promt, error=str(e))
+                return GenerationResult(index=index, promt=promt, story_manager=manager)
+
+        tasks = [asyncio.ensure_future(generate(index, promt)) for index, promt in enumerate(prompts)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                if result.error is None:
+                    stats.stories += 1
+                else:
+                    stats.failed += 1
+                stats.tokens = self.tokens_used - tokens_before
+                stats.seconds = time.monotonic() - started
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        logging.info(f"Generated {stats.stories} stories, {stats.failed} failed, "
+                     f"{stats.stories_per_minute:.2f} stories/minute, {stats.tokens_per_second:.2f} tokens/second")
+
+    @contextmanager
+    def reservation(self) -> Iterator[object]:
+        # stories generated inside are committed by commit() called inside, and released on exit if it never was.
+        # Generations running concurrently outside of it are left alone
+        yield None
+
+    async def commit(self) -> None:
+        # called once stories generated so far are persisted
+        pass
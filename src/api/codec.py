@@ -0,0 +1,211 @@
+import gzip
+import json
+import logging
+import struct
+from typing import List, Optional, Tuple
+
+from src.api.config import CHECKPOINT_FORMAT, CHECKPOINT_COMPRESSION
+from src.api.models import CheckPoint, Story, StoryManager, StoryStep
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Versioned checkpoint is MAGIC, version byte, compression byte and payload. Checkpoints saved before versioning
+# are plain pydantic json and always start with "{"
+MAGIC = b"TSCK"
+# version 2 added story path, version 3 due time
+VERSION = 3
+COMPRESSIONS = {"": 0, "gzip": 1, "zstd": 2}
+
+END = 1
+HAS_OPTION_1 = 2
+HAS_OPTION_2 = 4
+
+POST_ID = struct.Struct(">q")
+DUE = struct.Struct(">d")
+
+
+def write_varint(buffer: bytearray, value: int) -> None:
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_string(buffer: bytearray, value: str) -> None:
+    encoded = value.encode(encoding="utf-8")
+    write_varint(buffer, len(encoded))
+    buffer.extend(encoded)
+
+
+def read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    length, offset = read_varint(data, offset)
+    return data[offset:offset + length].decode(encoding="utf-8"), offset + length
+
+
+def write_story(buffer: bytearray, story: Story) -> None:
+    flags = (END if story.end else 0) | (HAS_OPTION_1 if story.option_1 is not None else 0) | \
+            (HAS_OPTION_2 if story.option_2 is not None else 0)
+    buffer.append(flags)
+    write_string(buffer, story.tag)
+    write_string(buffer, story.text)
+    if story.option_1 is not None:
+        write_string(buffer, story.option_1)
+    if story.option_2 is not None:
+        write_string(buffer, story.option_2)
+
+
+def read_story(data: bytes, offset: int) -> Tuple[Story, int]:
+    flags = data[offset]
+    tag, offset = read_string(data, offset + 1)
+    text, offset = read_string(data, offset)
+    option_1 = option_2 = None
+    if flags & HAS_OPTION_1:
+        option_1, offset = read_string(data, offset)
+    if flags & HAS_OPTION_2:
+        option_2, offset = read_string(data, offset)
+    # payload is written by encode_binary, so validation is skipped to keep loading cheap
+    return Story.construct(tag=tag, text=text, option_1=option_1, option_2=option_2, end=bool(flags & END)), offset
+
+
+def active_index(manager: StoryManager) -> Optional[int]:
+    for index, story in enumerate(manager.stories):
+        if story == manager.active_story:
+            return index
+    return None
+
+
+def encode_binary(checkpoint: CheckPoint) -> bytes:
+    buffer = bytearray(POST_ID.pack(checkpoint.post_id))
+    manager = checkpoint.story_manager
+    write_varint(buffer, len(manager.stories))
+    for story in manager.stories:
+        write_story(buffer, story)
+
+    # active story is one of the stories, only its position is stored. 0 means it follows inline
+    index = active_index(manager)
+    write_varint(buffer, 0 if index is None else index + 1)
+    if index is None:
+        write_story(buffer, manager.active_story)
+
+    write_varint(buffer, len(checkpoint.path))
+    for step in checkpoint.path:
+        write_string(buffer, step.tag)
+        buffer.extend(POST_ID.pack(step.post_id))
+        write_varint(buffer, step.poll_option_1_votes)
+        write_varint(buffer, step.poll_option_2_votes)
+
+    buffer.append(0 if checkpoint.due is None else 1)
+    if checkpoint.due is not None:
+        buffer.extend(DUE.pack(checkpoint.due))
+    return bytes(buffer)
+
+
+def decode_binary(data: bytes, version: int = VERSION) -> CheckPoint:
+    (post_id,) = POST_ID.unpack_from(data, 0)
+    count, offset = read_varint(data, POST_ID.size)
+    stories: List[Story] = []
+    for _ in range(count):
+        story, offset = read_story(data, offset)
+        stories.append(story)
+
+    index, offset = read_varint(data, offset)
+    if index:
+        active_story = stories[index - 1]
+    else:
+        active_story, offset = read_story(data, offset)
+    manager = StoryManager.construct(stories=stories, active_story=active_story)
+
+    path: List[StoryStep] = []
+    count = 0
+    if version >= 2:
+        count, offset = read_varint(data, offset)
+    for _ in range(count):
+        tag, offset = read_string(data, offset)
+        (step_post_id,) = POST_ID.unpack_from(data, offset)
+        votes_1, offset = read_varint(data, offset + POST_ID.size)
+        votes_2, offset = read_varint(data, offset)
+        path.append(StoryStep.construct(tag=tag, post_id=step_post_id, poll_option_1_votes=votes_1,
+                                        poll_option_2_votes=votes_2))
+
+    due = None
+    if version >= 3 and data[offset]:
+        (due,) = DUE.unpack_from(data, offset + 1)
+    return CheckPoint.construct(post_id=post_id, story_manager=manager, path=path, due=due, etag=None)
+
+
+def encode_json(checkpoint: CheckPoint) -> bytes:
+    data = checkpoint.dict(exclude={"etag"})
+    index = active_index(checkpoint.story_manager)
+    if index is not None:
+        data["story_manager"]["active_story"] = index
+    return json.dumps(data, separators=(",", ":")).encode(encoding="utf-8")
+
+
+def decode_json(data: bytes, version: int = VERSION) -> CheckPoint:
+    data_dict = json.loads(data.decode(encoding="utf-8"))
+    manager = data_dict["story_manager"]
+    if isinstance(manager["active_story"], int):
+        manager["active_story"] = manager["stories"][manager["active_story"]]
+    return CheckPoint(**data_dict)
+
+
+FORMATS = {"json": (0, encode_json, decode_json), "binary": (1, encode_binary, decode_binary)}
+
+
+def compress(payload: bytes, compression: str) -> Tuple[str, bytes]:
+    if compression == "zstd" and zstandard is None:
+        logging.warning("zstandard is not installed, checkpoint is compressed with gzip")
+        compression = "gzip"
+    if compression == "gzip":
+        return compression, gzip.compress(payload, mtime=0)
+    if compression == "zstd":
+        return compression, zstandard.ZstdCompressor().compress(payload)
+    return "", payload
+
+
+def decompress(payload: bytes, compression: int) -> bytes:
+    if compression == COMPRESSIONS["gzip"]:
+        return gzip.decompress(payload)
+    if compression == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise ValueError("Checkpoint is compressed with zstd, but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return payload
+
+
+def encode_checkpoint(checkpoint: CheckPoint, format: str = CHECKPOINT_FORMAT,
+                      compression: str = CHECKPOINT_COMPRESSION) -> bytes:
+    if format not in FORMATS or compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown checkpoint format {format} with compression {compression}")
+    code, encode, _ = FORMATS[format]
+    compression, payload = compress(encode(checkpoint), compression)
+    return MAGIC + bytes([VERSION, code, COMPRESSIONS[compression]]) + payload
+
+
+def decode_checkpoint(data: bytes) -> CheckPoint:
+    if not data.startswith(MAGIC):
+        # checkpoint saved before versioning
+        return CheckPoint(**json.loads(data.decode(encoding="utf-8")))
+
+    version, code, compression = data[len(MAGIC):len(MAGIC) + 3]
+    if not 1 <= version <= VERSION:
+        raise ValueError(f"Unsupported checkpoint version {version}")
+    for format_code, _, decode in FORMATS.values():
+        if format_code == code:
+            return decode(decompress(data[len(MAGIC) + 3:], compression), version)
+    raise ValueError(f"Unknown checkpoint format {code}")
@@ -2,15 +2,103 @@ import os
 
 AZURE_ACCOUNT_URL = os.getenv("AZURE_ACCOUNT_URL")
 AZURE_CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME")
+# seconds before expiry cached AAD token is refreshed
+AZURE_TOKEN_REFRESH_MARGIN = float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN", 300))
+
+# "azure", "filesystem" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "azure")
+STORAGE_PATH = os.getenv("STORAGE_PATH", ".storage")
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "0") == "1"
 
 CHECKPOINT_NAME = os.getenv("CHECKPOINT_NAME", "checkpoint.json")
+# seconds worker claims due checkpoint for, has to outlast one invocation (function timeout is 5 minutes).
+# Claim is one checkpoint write, two more round trips are spent on lease file only when new story starts.
+# 0 disables claim and leaves only compare-and-swap on save
+CHECKPOINT_LEASE_SECONDS = float(os.getenv("CHECKPOINT_LEASE_SECONDS", 300))
+# "binary" or "json", both formats are always readable
+CHECKPOINT_FORMAT = os.getenv("CHECKPOINT_FORMAT", "binary")
+# empty to disable, "gzip" or "zstd" (needs zstandard package)
+CHECKPOINT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "gzip")
+
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive")
+
+TWEET_QUOTA_NAME = os.getenv("TWEET_QUOTA_NAME", "tweet_quota.json")
+
+# comma separated names of independent stories, empty runs single story with checkpoint at CHECKPOINT_NAME
+STORY_CHANNELS = [channel.strip() for channel in os.getenv("STORY_CHANNELS", "").split(",")]
+STORY_CHANNEL_CONCURRENCY = int(os.getenv("STORY_CHANNEL_CONCURRENCY", 4))
+# start next story in the same run the previous one ends
+STORY_PIPELINE = os.getenv("STORY_PIPELINE", "0") == "1"
+# seconds after poll closes before votes are read
+SCHEDULER_GRACE_SECONDS = float(os.getenv("SCHEDULER_GRACE_SECONDS", 60))
+# seconds before channel that failed or was busy is tried again
+SCHEDULER_RETRY_SECONDS = float(os.getenv("SCHEDULER_RETRY_SECONDS", 300))
+
+# seconds one run may take, kept below functionTimeout in host.json so the worker stops cleanly before host kills it
+WORKER_DEADLINE_SECONDS = float(os.getenv("WORKER_DEADLINE_SECONDS", 270))
+# seconds reserved for publishing a post and saving its checkpoint, publish is not started with less time left
+DEADLINE_CRITICAL_SECONDS = float(os.getenv("DEADLINE_CRITICAL_SECONDS", 30))
+
+# comma separated sinks for spans and per-invocation latency summary: "log", "memory", or empty to disable
+METRICS_SINKS = [sink.strip() for sink in os.getenv("METRICS_SINKS", "log").split(",") if sink.strip()]
+
+STORY_POOL_NAME = os.getenv("STORY_POOL_NAME", "story_pool.json")
+STORY_POOL_SIZE = int(os.getenv("STORY_POOL_SIZE", 5))
+STORY_POOL_LOW_WATER_MARK = int(os.getenv("STORY_POOL_LOW_WATER_MARK", 2))
+STORY_POOL_REFILL_CONCURRENCY = int(os.getenv("STORY_POOL_REFILL_CONCURRENCY", 2))
 
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+
+# historically openai key was passed with AZURE_OPENAI_KEY
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", AZURE_OPENAI_KEY)
+# comma separated "openai" and "azure", first one is primary, others get hedged requests
+OPENAI_ENDPOINTS = os.getenv("OPENAI_ENDPOINTS", "openai")
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", 0.95))
+# hedge delay in seconds used until enough latency is observed
+OPENAI_HEDGE_DELAY = float(os.getenv("OPENAI_HEDGE_DELAY", 10))
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_OUTPUT_FORMAT = os.getenv("OPENAI_OUTPUT_FORMAT", "text")
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", 120))
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", 10))
+OPENAI_BATCH_CONCURRENCY = int(os.getenv("OPENAI_BATCH_CONCURRENCY", 4))
+# 0 disables limit
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 0))
+# empty to disable, "disk" or "storage"
+OPENAI_CACHE = os.getenv("OPENAI_CACHE", "")
+OPENAI_CACHE_PATH = os.getenv("OPENAI_CACHE_PATH", ".cache/openai")
+OPENAI_CACHE_TTL = int(os.getenv("OPENAI_CACHE_TTL", 24 * 60 * 60))
+OPENAI_CACHE_MAX_SIZE = int(os.getenv("OPENAI_CACHE_MAX_SIZE", 10 * 1024 * 1024))
+# drop cached responses once story is saved, so only crashed invocations reuse them
+OPENAI_CACHE_CONSUME = os.getenv("OPENAI_CACHE_CONSUME", "1") == "1"
 
 TWITTER_CONSUMER_KEY = os.getenv("TWITTER_CONSUMER_KEY")
 TWITTER_CONSUMER_SECRET = os.getenv("TWITTER_CONSUMER_SECRET")
 TWITTER_TOKEN = os.getenv("TWITTER_TOKEN")
 TWITTER_TOKEN_SECRET = os.getenv("TWITTER_TOKEN_SECRET")
 
-POLL_DURATION_MINUTES = os.getenv("POLL_DURATION_MINUTES", 120)
+POLL_DURATION_MINUTES = int(os.getenv("POLL_DURATION_MINUTES", 120))
+# "scraper" or "api", twitter free tier allows only creating tweets, so api needs paid access
+TWITTER_POLL_BACKEND = os.getenv("TWITTER_POLL_BACKEND", "scraper")
+TWITTER_LOOKUP_CONCURRENCY = int(os.getenv("TWITTER_LOOKUP_CONCURRENCY", 4))
+TWITTER_SCRAPE_TIMEOUT = float(os.getenv("TWITTER_SCRAPE_TIMEOUT", 30))
+# upper bound for single post lookup in batch, slow lookup doesn't hold up the rest of the batch
+TWITTER_LOOKUP_TIMEOUT = float(os.getenv("TWITTER_LOOKUP_TIMEOUT", 45))
+TWITTER_POOL_SIZE = int(os.getenv("TWITTER_POOL_SIZE", 10))
+TWITTER_KEEPALIVE_TIMEOUT = float(os.getenv("TWITTER_KEEPALIVE_TIMEOUT", 120))
+TWITTER_DNS_CACHE_TTL = int(os.getenv("TWITTER_DNS_CACHE_TTL", 600))
+# seconds single request may take, tweet and its options reply both have to fit into DEADLINE_CRITICAL_SECONDS
+TWITTER_REQUEST_TIMEOUT = float(os.getenv("TWITTER_REQUEST_TIMEOUT", 10))
+TWITTER_RETRIES = int(os.getenv("TWITTER_RETRIES", 3))
+TWITTER_RETRY_BASE_DELAY = float(os.getenv("TWITTER_RETRY_BASE_DELAY", 0.5))
+TWITTER_RETRY_MAX_DELAY = float(os.getenv("TWITTER_RETRY_MAX_DELAY", 30))
+# total seconds single call may spend including waits between retries
+TWITTER_RETRY_DEADLINE = float(os.getenv("TWITTER_RETRY_DEADLINE", 120))
+# 0 disables quota tracking
+TWITTER_DAILY_TWEETS = int(os.getenv("TWITTER_DAILY_TWEETS", 50))
+# seconds post may wait for quota before it is deferred to next run
+TWITTER_QUOTA_MAX_WAIT = float(os.getenv("TWITTER_QUOTA_MAX_WAIT", 60))
@@ -0,0 +1,35 @@
+from typing import List, Optional
+
+
+class StoryParseError(ValueError):
+    def __init__(self, missing: List[str], found: dict):
+        super(StoryParseError, self).__init__(f"Missing story sections: {', '.join(missing)}")
+        self.missing = missing
+        self.found = found
+
+
+class PublisherError(ValueError):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super(PublisherError, self).__init__(message)
+        self.status = status
+
+
+class StorageConflict(ValueError):
+    def __init__(self, file_path: str):
+        super(StorageConflict, self).__init__(f"File {file_path} was changed by someone else")
+        self.file_path = file_path
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, action: str, remaining: float):
+        super(DeadlineExceeded, self).__init__(f"Not enough time left for {action}, {remaining:.1f}s left")
+        self.action = action
+        self.remaining = remaining
+
+
+class QuotaExceeded(PublisherError):
+    def __init__(self, tweets: int, remaining: float, retry_at: float):
+        super(QuotaExceeded, self).__init__(f"Not enough tweet quota for {tweets} tweets, {remaining:.2f} left")
+        self.tweets = tweets
+        self.remaining = remaining
+        self.retry_at = retry_at
@@ -1,4 +1,5 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Dict, Optional, List, Tuple
 
 from pydantic import BaseModel
 
@@ -22,9 +23,93 @@ class StoryManager(BaseModel):
         raise KeyError(f"No {key} in stories")
 
 
+class StoryPool(BaseModel):
+    stories: List[StoryManager] = []
+
+
+class GenerationResult(BaseModel):
+    index: int
+    promt: Optional[str]
+    story_manager: Optional[StoryManager]
+    error: Optional[str]
+
+
+class GenerationStats(BaseModel):
+    stories: int = 0
+    failed: int = 0
+    tokens: int = 0
+    seconds: float = 0
+
+    @property
+    def stories_per_minute(self) -> float:
+        return self.stories * 60 / self.seconds if self.seconds else 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0
+
+
+class OpenAIEndpoint(BaseModel):
+    name: str
+    api_type: str
+    api_base: Optional[str]
+    api_key: Optional[str]
+    api_version: Optional[str]
+    model: Optional[str]
+    deployment: Optional[str]
+
+
+class CallAttempt(BaseModel):
+    method: str
+    url: str
+    attempt: int
+    status: Optional[int]
+    seconds: float
+    outcome: str
+    wait: float = 0
+
+
+class ChannelResult(BaseModel):
+    channel: str
+    seconds: float
+    error: Optional[str]
+    # when channel should be processed next, None if unknown
+    due: Optional[float]
+
+
+class Span(BaseModel):
+    name: str
+    parent: Optional[str]
+    started: float
+    seconds: float
+    error: Optional[str]
+    tags: Dict[str, str] = {}
+
+
+class SpanSummary(BaseModel):
+    count: int
+    total: float
+    p50: float
+    p95: float
+    max: float
+
+
+class StoryStep(BaseModel):
+    tag: str
+    post_id: int
+    poll_option_1_votes: int = 0
+    poll_option_2_votes: int = 0
+
+
 class CheckPoint(BaseModel):
     post_id: int
     story_manager: StoryManager
+    # polls already published with their results, first one is beginning of the story
+    path: List[StoryStep] = []
+    # timestamp when poll of last post closes, checkpoint is not processed before
+    due: Optional[float] = None
+    # version of stored checkpoint it was read from, None for checkpoint that is not saved yet. Not serialized
+    etag: Optional[str] = None
 
 
 class PublisherPost(BaseModel):
@@ -36,3 +121,31 @@ class PublisherPost(BaseModel):
     poll_option_2_name: Optional[str]
     poll_option_2_votes: int = 0
     end: bool = False
+    # posts with higher priority get tweet quota first
+    priority: int = 0
+
+
+class QuotaState(BaseModel):
+    tokens: float
+    updated: float
+    # timestamps of tweets sent during last period
+    spent: List[float] = []
+
+
+class QuotaStatus(BaseModel):
+    capacity: int
+    remaining: float
+    projected_exhaustion: Optional[datetime]
+
+
+class ArchivedStory(BaseModel):
+    story_id: int
+    finished: datetime
+    story_manager: StoryManager
+    path: List[StoryStep]
+    ending: str
+
+
+class ArchiveIndex(BaseModel):
+    # story id -> shard, offset, length and finish timestamp of its record
+    stories: Dict[int, Tuple[str, int, int, float]] = {}
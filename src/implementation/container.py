@@ -0,0 +1,90 @@
+import asyncio
+import atexit
+import logging
+from typing import Optional
+
+from src.abstract.storage import Storage
+from src.api.config import TWITTER_DAILY_TWEETS
+from src.implementation.metrics.sinks import create_metrics_sinks
+from src.implementation.metrics.tracer import Tracer
+from src.implementation.publisher.quota import TweetQuota
+from src.implementation.publisher.twitter import Publisher
+from src.implementation.storage.archive import StoryArchive
+from src.implementation.storage.credential import CachedTokenCredential
+from src.implementation.storage.factory import create_storage
+from src.implementation.text_generator.cache import create_response_cache
+from src.implementation.text_generator.openai import TextGenerator
+from src.implementation.worker.azure import Worker
+
+
+# Components are built once per host on first use, so warm invocations reuse credentials, tokens, connection
+# pools and cached checkpoint. Worker itself is cheap and is created for every invocation
+class Container:
+    def __init__(self):
+        self.storage: Optional[Storage] = None
+        self.publisher: Optional[Publisher] = None
+        self.text_generator: Optional[TextGenerator] = None
+        self.archive: Optional[StoryArchive] = None
+        self.tracer = Tracer(create_metrics_sinks())
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.invocations = 0
+
+    def get_storage(self) -> Storage:
+        if self.storage is None:
+            # clients are bound to loop they are used in first, it is remembered for shutdown
+            self.loop = asyncio.get_running_loop()
+            self.storage = create_storage()
+        return self.storage
+
+    def get_publisher(self) -> Publisher:
+        if self.publisher is None:
+            self.publisher = Publisher(quota=TweetQuota(self.get_storage()) if TWITTER_DAILY_TWEETS else None)
+        return self.publisher
+
+    def get_text_generator(self) -> TextGenerator:
+        if self.text_generator is None:
+            self.text_generator = TextGenerator(cache=create_response_cache(self.get_storage()))
+        return self.text_generator
+
+    def get_archive(self) -> StoryArchive:
+        if self.archive is None:
+            self.archive = StoryArchive(self.get_storage())
+        return self.archive
+
+    def create_worker(self) -> Worker:
+        self.invocations += 1
+        return Worker(text_generator=self.get_text_generator(), publisher=self.get_publisher(),
+                      storage=self.get_storage(), archive=self.get_archive(), tracer=self.tracer)
+
+    def stats(self) -> dict:
+        storage = self.get_storage()
+        stats = {
+            "invocations": self.invocations,
+            "checkpoint_reads": storage.checkpoint_reads,
+            "checkpoint_not_modified": storage.checkpoint_not_modified,
+            "round_trips_saved": storage.round_trips_saved,
+        }
+        credential = getattr(storage, "credential", None)
+        if isinstance(credential, CachedTokenCredential):
+            stats.update(token_fetches=credential.fetches, token_hits=credential.hits,
+                         token_fetch_seconds=round(credential.fetch_seconds, 3))
+        return stats
+
+    async def close(self) -> None:
+        for component in [self.text_generator, self.publisher, self.storage]:
+            if component is not None:
+                try:
+                    await component.close()
+                except Exception as e:
+                    logging.warning(f"Failed to close {type(component).__name__}: {e!r}")
+        self.storage = self.publisher = self.text_generator = self.archive = None
+
+    def close_at_exit(self) -> None:
+        # host stops worker process, its loop is not running anymore but still can finish closing clients
+        if self.loop is None or self.loop.is_closed() or self.loop.is_running():
+            return
+        self.loop.run_until_complete(self.close())
+
+
+container = Container()
+atexit.register(container.close_at_exit)
@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator, Optional
+
+from src.api.exceptions import DeadlineExceeded
+
+current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("current_deadline", default=None)
+
+
+# Overall time limit of one run. It is visible to every call made inside activate(), so storage, publisher and
+# generator calls get whatever is left of it instead of their own fixed timeouts
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @contextmanager
+    def activate(self) -> Iterator["Deadline"]:
+        token = current_deadline.set(self)
+        try:
+            yield self
+        finally:
+            current_deadline.reset(token)
+
+    async def run(self, awaitable: Awaitable, action: str, reserve: float = 0):
+        # reserve is left for work that must follow, e.g. publishing after generation
+        timeout = self.remaining() - reserve
+        if timeout <= 0:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(action, self.remaining())
+
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            if self.remaining() - reserve > 0:
+                # call's own timeout, not ours
+                raise
+            raise DeadlineExceeded(action, self.remaining())
+
+
+def remaining() -> Optional[float]:
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+@contextmanager
+def no_deadline() -> Iterator[None]:
+    # for calls that must finish once started, e.g. saving checkpoint after post is published
+    token = current_deadline.set(None)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+async def run_bounded(awaitable: Awaitable, action: str):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, action)
+
+
+def bounded(action: str) -> Callable:
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_bounded(func(*args, **kwargs), action)
+        return wrapper
+    return decorate
@@ -0,0 +1,49 @@
+import logging
+from typing import Dict, List, Tuple
+
+from src.abstract.metrics import MetricsSink
+from src.api.config import METRICS_SINKS
+from src.api.models import Span, SpanSummary
+
+logger = logging.getLogger("metrics")
+
+
+class LogMetricsSink(MetricsSink):
+    def record(self, span: Span) -> None:
+        # whole span goes to structured fields, message stays readable in plain log stream
+        logger.debug(f"Span {span.name} {span.seconds * 1000:.1f}ms" + (f" failed: {span.error}" if span.error else ""),
+                     extra={"span": span.dict()})
+
+    def summarise(self, name: str, summary: Dict[str, SpanSummary]) -> None:
+        lines = [f"{span_name} n={item.count} total={item.total:.3f}s p50={item.p50 * 1000:.1f}ms "
+                 f"p95={item.p95 * 1000:.1f}ms max={item.max * 1000:.1f}ms"
+                 for span_name, item in sorted(summary.items(), key=lambda pair: -pair[1].total)]
+        logger.info(f"Latency of {name}:\n" + "\n".join(lines),
+                    extra={"summary": {span_name: item.dict() for span_name, item in summary.items()}})
+
+
+class MemoryMetricsSink(MetricsSink):
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.summaries: List[Tuple[str, Dict[str, SpanSummary]]] = []
+
+    def record(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def summarise(self, name: str, summary: Dict[str, SpanSummary]) -> None:
+        self.summaries.append((name, summary))
+
+    def names(self) -> List[str]:
+        return [span.name for span in self.spans]
+
+
+def create_metrics_sinks() -> List[MetricsSink]:
+    sinks = []
+    for name in METRICS_SINKS:
+        if name == "log":
+            sinks.append(LogMetricsSink())
+        elif name == "memory":
+            sinks.append(MemoryMetricsSink())
+        else:
+            raise ValueError(f"Unknown metrics sink {name}")
+    return sinks
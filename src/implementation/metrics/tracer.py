@@ -0,0 +1,126 @@
+import functools
+import inspect
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional
+
+from src.abstract.metrics import MetricsSink
+from src.api.models import Span, SpanSummary
+
+current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("current_tracer", default=None)
+# durations of the running invocation, shared with tasks it starts, so concurrent invocations summarise separately
+current_durations: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("current_durations", default=None)
+
+
+# Spans are only recorded inside invocation of some tracer. Storage, publisher and generator calls made outside
+# of it, e.g. in tests or at shutdown, are not timed and nothing piles up between invocations
+class Tracer:
+    def __init__(self, sinks: Optional[List[MetricsSink]] = None):
+        self.sinks = [] if sinks is None else sinks
+
+    @contextmanager
+    def span(self, name: str, **tags) -> Iterator[None]:
+        parent = current_span.get()
+        span_token = current_span.set(name)
+        tracer_token = current_tracer.set(self)
+        started = time.time()
+        perf_started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            current_span.reset(span_token)
+            current_tracer.reset(tracer_token)
+            self.record(Span(name=name, parent=parent, started=started, seconds=time.perf_counter() - perf_started,
+                             error=error, tags={key: str(value) for key, value in tags.items()}))
+
+    @contextmanager
+    def invocation(self, name: str, **tags) -> Iterator[None]:
+        durations = defaultdict(list)
+        token = current_durations.set(durations)
+        try:
+            with self.span(name, **tags):
+                yield
+        finally:
+            current_durations.reset(token)
+            self.flush(name, durations)
+
+    def record(self, span: Span) -> None:
+        durations = current_durations.get()
+        if durations is not None:
+            durations[span.name].append(span.seconds)
+        for sink in self.sinks:
+            try:
+                sink.record(span)
+            except Exception as e:
+                logging.warning(f"Metrics sink {type(sink).__name__} failed: {e!r}")
+
+    @staticmethod
+    def summary(durations: Dict[str, List[float]]) -> Dict[str, SpanSummary]:
+        summary = {}
+        for name, seconds in durations.items():
+            ordered = sorted(seconds)
+            summary[name] = SpanSummary(
+                count=len(ordered),
+                total=sum(ordered),
+                p50=ordered[(len(ordered) - 1) // 2],
+                p95=ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                max=ordered[-1],
+            )
+        return summary
+
+    def flush(self, name: str, durations: Dict[str, List[float]]) -> Dict[str, SpanSummary]:
+        summary = self.summary(durations)
+        for sink in self.sinks:
+            try:
+                sink.summarise(name, summary)
+            except Exception as e:
+                logging.warning(f"Metrics sink {type(sink).__name__} failed: {e!r}")
+        return summary
+
+
+def traced(name: str) -> Callable:
+    def decorate(func: Callable) -> Callable:
+        if inspect.isasyncgenfunction(func):
+            # generator steps run in consumer's context, so it is timed as a whole but can't be parent of spans
+            @functools.wraps(func)
+            async def generator(*args, **kwargs):
+                tracer = current_tracer.get()
+                if tracer is None:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    return
+
+                parent = current_span.get()
+                started = time.time()
+                perf_started = time.perf_counter()
+                error = None
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except GeneratorExit:
+                    raise
+                except BaseException as e:
+                    error = repr(e)
+                    raise
+                finally:
+                    tracer.record(Span(name=name, parent=parent, started=started,
+                                       seconds=time.perf_counter() - perf_started, error=error))
+            return generator
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            tracer = current_tracer.get()
+            if tracer is None:
+                return await func(*args, **kwargs)
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,115 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Union
+
+from snscrape.modules.twitter import Tweet
+
+from src.abstract.publisher import gather_posts
+from src.api.models import PublisherPost
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+
+
+class PollBackend(ABC):
+    @abstractmethod
+    async def get_post(self, post_id: int) -> PublisherPost:
+        pass
+
+    async def get_posts(self, post_ids: List[int]) -> Dict[int, Union[PublisherPost, Exception]]:
+        return await gather_posts(self.get_post, post_ids)
+
+
+class ScraperPollBackend(PollBackend):
+    def __init__(self, scraper_class: Callable, timeout: float):
+        self.scraper_class = scraper_class
+        self.timeout = timeout
+
+    def scrape(self, post_id: int) -> Optional[Tweet]:
+        items = self.scraper_class(tweetId=post_id).get_items()
+        # only first item is needed, rest of the conversation is never requested
+        try:
+            return next(items, None)
+        finally:
+            items.close()
+
+    @traced("scraper.get_post")
+    @bounded("scraper.get_post")
+    async def get_post(self, post_id: int) -> PublisherPost:
+        # scraper is synchronous, so it runs in thread. Thread can't be killed on timeout, but loop is not blocked
+        tweet = await asyncio.wait_for(asyncio.to_thread(self.scrape, post_id), self.timeout)
+        if tweet is None:
+            raise ValueError(f"No tweet with id {post_id} found !")
+
+        return PublisherPost(
+            post_id=post_id,
+            text=tweet.rawContent,
+            title="",
+            poll_option_1_name=tweet.card.options[0].label,
+            poll_option_1_votes=tweet.card.options[0].count,
+            poll_option_2_name=tweet.card.options[1].label,
+            poll_option_2_votes=tweet.card.options[1].count,
+        )
+
+
+class ApiPollBackend(PollBackend):
+    # tweets lookup accepts up to 100 ids per request
+    batch_size = 100
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    async def get_post(self, post_id: int) -> PublisherPost:
+        tweet = await self.publisher.make_call(f"tweets/{post_id}", "", "GET", params={
+            "expansions": "attachments.poll_ids",
+            "poll.fields": "options",
+        })
+        if "data" not in tweet:
+            raise ValueError(f"No tweet with id {post_id} found !")
+
+        return self.to_post(post_id, tweet["data"]["text"], tweet["includes"]["polls"][0]["options"])
+
+    async def get_posts(self, post_ids: List[int]) -> Dict[int, Union[PublisherPost, Exception]]:
+        batches = [post_ids[start:start + self.batch_size] for start in range(0, len(post_ids), self.batch_size)]
+        results = {}
+        for batch, found in zip(batches, await asyncio.gather(*[self.lookup(batch) for batch in batches],
+                                                             return_exceptions=True)):
+            for post_id in batch:
+                if isinstance(found, Exception):
+                    results[post_id] = found
+                else:
+                    results[post_id] = found.get(post_id, ValueError(f"No tweet with id {post_id} found !"))
+        return results
+
+    async def lookup(self, post_ids: List[int]) -> Dict[int, Union[PublisherPost, Exception]]:
+        response = await self.publisher.make_call("tweets", "", "GET", params={
+            "ids": ",".join(str(post_id) for post_id in post_ids),
+            "expansions": "attachments.poll_ids",
+            "tweet.fields": "attachments",
+            "poll.fields": "options",
+        })
+        polls = {poll["id"]: poll["options"] for poll in response.get("includes", {}).get("polls", [])}
+
+        results = {}
+        for tweet in response.get("data", []):
+            poll_ids = tweet.get("attachments", {}).get("poll_ids", [])
+            if not poll_ids or poll_ids[0] not in polls:
+                results[int(tweet["id"])] = ValueError(f"Tweet with id {tweet['id']} has no poll !")
+                continue
+            results[int(tweet["id"])] = self.to_post(int(tweet["id"]), tweet["text"], polls[poll_ids[0]])
+        for error in response.get("errors", []):
+            results[int(error["resource_id"])] = ValueError(error.get("detail", error.get("title")))
+        return results
+
+    @staticmethod
+    def to_post(post_id: int, text: str, options: List[dict]) -> PublisherPost:
+        options = sorted(options, key=lambda option: option["position"])
+
+        return PublisherPost(
+            post_id=post_id,
+            text=text,
+            title="",
+            poll_option_1_name=options[0]["label"],
+            poll_option_1_votes=options[0]["votes"],
+            poll_option_2_name=options[1]["label"],
+            poll_option_2_votes=options[1]["votes"],
+        )
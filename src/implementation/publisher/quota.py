@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from src.abstract.storage import Storage
+from src.api.config import TWEET_QUOTA_NAME, TWITTER_DAILY_TWEETS, TWITTER_QUOTA_MAX_WAIT
+from src.api.exceptions import QuotaExceeded, StorageConflict
+from src.api.models import QuotaState, QuotaStatus
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+
+
+# Token bucket refilled evenly over the period and persisted in storage, so all invocations share one budget.
+# Posts waiting for tokens are served by priority, lower priority posts wait until higher ones are sent or deferred.
+class TweetQuota:
+    poll_interval = 1.0
+
+    def __init__(self, storage: Storage, capacity: int = TWITTER_DAILY_TWEETS, period: float = 24 * 60 * 60,
+                 max_wait: float = TWITTER_QUOTA_MAX_WAIT):
+        self.storage = storage
+        self.capacity = capacity
+        self.period = period
+        self.max_wait = max_wait
+        self.lock = asyncio.Lock()
+        self.waiters: List[Tuple[int, int]] = []
+        self.counter = itertools.count()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    async def load(self) -> QuotaState:
+        state, _, _ = await self.read()
+        return state
+
+    async def read(self) -> Tuple[QuotaState, Optional[bytes], Optional[str]]:
+        now = time.time()
+        try:
+            data, etag = await self.storage.get_file_if_changed(TWEET_QUOTA_NAME, None)
+        except FileNotFoundError:
+            return QuotaState(tokens=self.capacity, updated=now), None, None
+
+        state = QuotaState(**json.loads(data.decode(encoding="utf-8")))
+        state.tokens = min(self.capacity, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        state.spent = [sent for sent in state.spent if now - sent < self.period]
+        return state, data, etag
+
+    async def save(self, state: QuotaState, data: Optional[bytes], etag: Optional[str]) -> None:
+        # spend is written only over the state it was made from, other hosts spend the same budget
+        encoded = state.json().encode(encoding="utf-8")
+        if data is not None and etag is None:
+            await self.storage.upload_file(TWEET_QUOTA_NAME, encoded)
+        else:
+            await self.storage.upload_file_if_match(TWEET_QUOTA_NAME, encoded, etag)
+
+    @traced("twitter.quota")
+    @bounded("twitter.quota")
+    async def acquire(self, tweets: int, priority: int = 0) -> None:
+        deadline = time.time() + self.max_wait
+        entry = (-priority, next(self.counter))
+        heapq.heappush(self.waiters, entry)
+        try:
+            while True:
+                async with self.lock:
+                    now = time.time()
+                    if self.waiters[0] == entry:
+                        state, data, etag = await self.read()
+                        if state.tokens >= tweets:
+                            state.tokens -= tweets
+                            state.spent.extend([now] * tweets)
+                            try:
+                                await self.save(state, data, etag)
+                            except StorageConflict:
+                                # another host spent meanwhile, tokens are counted again from its state
+                                continue
+                            return
+
+                        wait = (tweets - state.tokens) / self.rate
+                        if now + wait > deadline:
+                            raise QuotaExceeded(tweets, state.tokens, now + wait)
+                    else:
+                        wait = self.poll_interval
+                        if now + wait > deadline:
+                            raise QuotaExceeded(tweets, 0, now + wait)
+                await asyncio.sleep(min(wait, self.poll_interval))
+        finally:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+
+    async def status(self) -> QuotaStatus:
+        state = await self.load()
+        # spend rate is measured over observed span, at least an hour so single tweet doesn't look like a burst
+        window = max(state.updated - min(state.spent, default=state.updated), self.period / 24)
+        spend_rate = len(state.spent) / window
+
+        # bucket runs dry only if tweets are spent faster than they come back
+        projected_exhaustion = None
+        if spend_rate > self.rate:
+            exhausted_at = state.updated + state.tokens / (spend_rate - self.rate)
+            projected_exhaustion = datetime.fromtimestamp(exhausted_at, tz=timezone.utc)
+
+        return QuotaStatus(capacity=self.capacity, remaining=state.tokens, projected_exhaustion=projected_exhaustion)
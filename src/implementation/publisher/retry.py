@@ -0,0 +1,50 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from src.api.config import TWITTER_RETRIES, TWITTER_RETRY_BASE_DELAY, TWITTER_RETRY_MAX_DELAY, TWITTER_RETRY_DEADLINE
+
+
+class RetryPolicy:
+    # None stands for connection error or timeout, other 4xx will fail the same way on every attempt
+    retry_statuses = {None, 429, 500, 502, 503, 504}
+    # request of these could have been carried out before it failed, e.g. tweet posted and response lost.
+    # It is repeated only if server refused it or it never left
+    unsafe_retry_statuses = {429, 503}
+    idempotent_methods = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, retries: int = TWITTER_RETRIES, base_delay: float = TWITTER_RETRY_BASE_DELAY,
+                 max_delay: float = TWITTER_RETRY_MAX_DELAY, deadline: float = TWITTER_RETRY_DEADLINE):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def should_retry(self, status: Optional[int], method: str = "GET", sent: bool = True) -> bool:
+        if method.upper() in self.idempotent_methods or (status is None and not sent):
+            return status in self.retry_statuses
+        return status in self.unsafe_retry_statuses
+
+    @staticmethod
+    def retry_after(value: str) -> Optional[float]:
+        # either seconds or http date
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, headers: Mapping[str, str] = None) -> float:
+        headers = headers or {}
+        retry_after = self.retry_after(headers["retry-after"]) if "retry-after" in headers else None
+        if retry_after is not None:
+            return max(0.0, retry_after)
+        if "x-rate-limit-reset" in headers and headers.get("x-rate-limit-remaining", "0") == "0":
+            return max(0.0, float(headers["x-rate-limit-reset"]) - time.time())
+
+        # full jitter, so parallel callers don't retry in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
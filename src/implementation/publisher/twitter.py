@@ -1,76 +1,145 @@
 import asyncio
 import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Union
 
-from aiohttp import ClientSession
+from aiohttp import ClientConnectorError, ClientError, ClientSession, ClientTimeout, TCPConnector
 from oauthlib.oauth1 import Client as AuthClient
-from snscrape.modules.twitter import TwitterTweetScraper, Tweet
+from snscrape.modules.twitter import TwitterTweetScraper
 
-from src.api.models import PublisherPost
+from src.api.exceptions import PublisherError
+from src.api.models import CallAttempt, PublisherPost
 from src.abstract.publisher import Publisher as SPI
 from src.api.config import TWITTER_TOKEN, TWITTER_TOKEN_SECRET, TWITTER_CONSUMER_SECRET, TWITTER_CONSUMER_KEY, \
-    POLL_DURATION_MINUTES
+    POLL_DURATION_MINUTES, TWITTER_POLL_BACKEND, TWITTER_SCRAPE_TIMEOUT, TWITTER_POOL_SIZE, TWITTER_KEEPALIVE_TIMEOUT, \
+    TWITTER_DNS_CACHE_TTL, TWITTER_REQUEST_TIMEOUT
+from src.implementation.deadline import Deadline, current_deadline, no_deadline, run_bounded
+from src.implementation.metrics.tracer import traced
+from src.implementation.publisher.poll import PollBackend, ApiPollBackend, ScraperPollBackend
+from src.implementation.publisher.quota import TweetQuota
+from src.implementation.publisher.retry import RetryPolicy
 
 
 class Publisher(SPI):
     poll_duration: int = POLL_DURATION_MINUTES
+    request_timeout: float = TWITTER_REQUEST_TIMEOUT
 
-    def __init__(self):
+    def __init__(self, poll_backend: PollBackend = None, retry_policy: RetryPolicy = None,
+                 quota: Optional[TweetQuota] = None):
         self.auth_client = AuthClient(client_key=TWITTER_CONSUMER_KEY, client_secret=TWITTER_CONSUMER_SECRET,
                                       resource_owner_key=TWITTER_TOKEN, resource_owner_secret=TWITTER_TOKEN_SECRET)
-        self.session = ClientSession()
+        self.session: Optional[ClientSession] = None
         self.base_url = "https://api.twitter.com/2/"
         self.headers = {'Content-Type': 'application/json'}
-
-    def __del__(self):
-        if self.session:
-            asyncio.get_event_loop().run_until_complete(self.session.close())
+        if poll_backend is None:
+            poll_backend = ApiPollBackend(self) if TWITTER_POLL_BACKEND == "api" else \
+                ScraperPollBackend(TwitterTweetScraper, TWITTER_SCRAPE_TIMEOUT)
+        self.poll_backend = poll_backend
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.attempts: Deque[CallAttempt] = deque(maxlen=100)
+        self.quota = quota
+
+    def get_session(self) -> ClientSession:
+        # session must be created inside running loop. It lives as long as publisher, so warm host keeps
+        # connections and resolved dns between invocations
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(connector=TCPConnector(
+                limit=TWITTER_POOL_SIZE,
+                keepalive_timeout=TWITTER_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                ttl_dns_cache=TWITTER_DNS_CACHE_TTL
+            ), timeout=ClientTimeout(total=self.request_timeout))
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def __aenter__(self):
+        self.get_session()
+        return self
 
     async def get_post(self, post_id: int) -> PublisherPost:
-        # url = f"tweets/{post_id}"
-        #
-        # tweet = await self.make_call(url, "{}", "GET")
-        # because twitter free tire allow only create tweets - we will scrap
-
-        scrapper = TwitterTweetScraper(tweetId=post_id)
-        data = list(scrapper.get_items())
-        if len(data) == 0:
-            raise ValueError(f"No tweet with id {post_id} found !")
-
-        tweet: Tweet = data[0]
-
-        return PublisherPost(
-            post_id=post_id,
-            text=tweet.rawContent,
-            title="",
-            poll_option_1_name=tweet.card.options[0].label,
-            poll_option_1_votes=tweet.card.options[0].count,
-            poll_option_2_name=tweet.card.options[1].label,
-            poll_option_2_votes=tweet.card.options[1].count,
-        )
-
-    async def make_call(self, url: str, data: str, method: str, params: dict = None, retry: int = 3):
+        # because twitter free tire allow only create tweets - we scrap by default
+        return await self.poll_backend.get_post(post_id)
+
+    async def get_posts(self, post_ids: List[int]) -> Dict[int, Union[PublisherPost, Exception]]:
+        return await self.poll_backend.get_posts(post_ids)
+
+    @traced("twitter.request")
+    async def make_call(self, url: str, data: str, method: str, params: dict = None, retry: int = None):
+        deadline = current_deadline.get()
+        if method.upper() in self.retry_policy.idempotent_methods:
+            return await run_bounded(self.send(url, data, method, params, retry, deadline), "twitter.request")
+        # post cut off halfway could be published without anyone knowing its id, caller checks time before it.
+        # Started request is bounded by request timeout only, deadline just stops further retries
+        with no_deadline():
+            return await self.send(url, data, method, params, retry, deadline)
+
+    async def send(self, url: str, data: str, method: str, params: dict = None, retry: int = None,
+                   run_deadline: Optional[Deadline] = None):
         uri = self.base_url + url
         uri = uri if params is None else uri + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
-        headers = self.headers
-
-        uri, headers, body = self.auth_client.sign(
-            uri=uri,
-            http_method=method,
-            body=data,
-            headers=headers
-        )
-
-        async with self.session.request(method=method, url=uri, headers=headers, data=body) as response:
-            if response.status in [200, 201]:
-                return await response.json()
-            if response.status > 200 and retry > 0:
-                await asyncio.sleep(1)
-                return await self.make_call(url, data, method, params, retry - 1)
-            else:
-                text = await response.text()
-                raise ValueError(
-                    f"HTTP error {response.status} to url {uri} and body {body} \n{text} \n{response.reason}")
-
+        retry = self.retry_policy.retries if retry is None else retry
+        deadline = time.monotonic() + self.retry_policy.deadline
+
+        attempt = 0
+        while True:
+            # every attempt is signed again, oauth nonce and timestamp can't be reused
+            signed_uri, headers, body = self.auth_client.sign(
+                uri=uri,
+                http_method=method,
+                body=data,
+                headers=self.headers
+            )
+
+            started = time.monotonic()
+            sent = True
+            try:
+                async with self.get_session().request(method=method, url=signed_uri, headers=headers,
+                                                      data=body) as response:
+                    if response.status in [200, 201]:
+                        self.record_attempt(method, url, attempt, response.status, started, "success")
+                        return await response.json()
+                    status = response.status
+                    response_headers = response.headers
+                    error = f"HTTP error {status} to url {uri} and body {body} \n{await response.text()} " \
+                            f"\n{response.reason}"
+            except ClientConnectorError as e:
+                # connection was not established, request never left
+                status = None
+                sent = False
+                response_headers = {}
+                error = f"Connection error to url {uri}: {e!r}"
+            except (ClientError, asyncio.TimeoutError) as e:
+                status = None
+                response_headers = {}
+                error = f"Connection error to url {uri}: {e!r}"
+
+            wait = self.retry_policy.delay(attempt, response_headers)
+            # next attempt has to finish before the run ends, not only start
+            if attempt >= retry or not self.retry_policy.should_retry(status, method, sent) \
+                    or time.monotonic() + wait > deadline \
+                    or (run_deadline is not None and wait + self.request_timeout > run_deadline.remaining()):
+                self.record_attempt(method, url, attempt, status, started, "error")
+                raise PublisherError(error, status)
+
+            self.record_attempt(method, url, attempt, status, started, "retry", wait)
+            logging.warning(f"{error}\nRetrying in {wait:.2f}s")
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    def record_attempt(self, method: str, url: str, attempt: int, status: Optional[int], started: float,
+                       outcome: str, wait: float = 0) -> None:
+        call_attempt = CallAttempt(method=method, url=url, attempt=attempt, status=status,
+                                   seconds=time.monotonic() - started, outcome=outcome, wait=wait)
+        logging.debug(f"Twitter call {call_attempt.dict()}")
+        self.attempts.append(call_attempt)
+
+    @traced("twitter.push_post")
     async def push_post(self, post: PublisherPost) -> int:
         text = post.title + "\n" + post.text + ("\nFinal" if post.end else "\noptions in the comments")
         text = text[:279]
@@ -89,6 +158,10 @@ class Publisher(SPI):
 
         url = "tweets"
 
+        if self.quota is not None:
+            # poll is followed by options reply, so both tweets are reserved before anything is sent
+            await self.quota.acquire(1 if post.end else 2, post.priority)
+
         result = await self.make_call(url, body, "POST")
         poll_post_id = result["data"]["id"]
 
@@ -102,3 +175,6 @@ class Publisher(SPI):
             options_post = await self.make_call(url, options_body, "POST")
 
         return poll_post_id
+
+    async def delete_post(self, post_id: int) -> None:
+        await self.make_call(f"tweets/{post_id}", "", "DELETE")
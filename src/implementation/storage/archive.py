@@ -0,0 +1,110 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from src.abstract.storage import Storage
+from src.api.config import ARCHIVE_PREFIX
+from src.api.exceptions import StorageConflict
+from src.api.models import ArchivedStory, ArchiveIndex
+
+
+# Finished stories are appended as json lines to monthly shards. Index maps story id to shard and byte range,
+# so reading one story is one small index download plus one range request. Stories added while previous batch
+# is written go out together in next batch
+class StoryArchive:
+    def __init__(self, storage: Storage, prefix: str = ARCHIVE_PREFIX):
+        self.storage = storage
+        self.prefix = prefix
+        self.pending: List[Tuple[ArchivedStory, asyncio.Future]] = []
+        self.lock = asyncio.Lock()
+
+    @property
+    def index_path(self) -> str:
+        return f"{self.prefix}/index.json"
+
+    def shard_path(self, finished: datetime) -> str:
+        return f"{self.prefix}/{finished:%Y-%m}.jsonl"
+
+    async def add(self, story: ArchivedStory) -> None:
+        written = asyncio.get_running_loop().create_future()
+        self.pending.append((story, written))
+        async with self.lock:
+            if not written.done():
+                batch, self.pending = self.pending, []
+                try:
+                    await self.write([pending for pending, _ in batch])
+                except Exception as e:
+                    # every caller whose story was in the batch sees the failure
+                    for _, batch_written in batch:
+                        batch_written.set_exception(e)
+                except BaseException:
+                    # cancelled writer puts the rest of the batch back, next caller waiting for lock writes it
+                    self.pending[:0] = [(pending, batch_written) for pending, batch_written in batch
+                                        if batch_written is not written]
+                    raise
+                else:
+                    for _, batch_written in batch:
+                        batch_written.set_result(None)
+        await written
+
+    async def write(self, batch: List[ArchivedStory]) -> None:
+        shards: Dict[str, List[ArchivedStory]] = {}
+        for story in batch:
+            shards.setdefault(self.shard_path(story.finished), []).append(story)
+
+        async def append(shard: str, stories: List[ArchivedStory]) -> Dict[int, tuple]:
+            lines = [(story.json() + "\n").encode(encoding="utf-8") for story in stories]
+            offset = await self.storage.append_file(shard, b"".join(lines))
+            entries = {}
+            for story, line in zip(stories, lines):
+                entries[story.story_id] = (shard, offset, len(line), story.finished.timestamp())
+                offset += len(line)
+            return entries
+
+        entries = {}
+        for shard_entries in await asyncio.gather(*[append(shard, stories) for shard, stories in shards.items()]):
+            entries.update(shard_entries)
+
+        # records are appended before index is updated, crash in between leaves unreferenced record only
+        await self.update_index(entries)
+
+    async def read_index(self) -> ArchiveIndex:
+        try:
+            data = await self.storage.get_file(self.index_path)
+        except FileNotFoundError:
+            return ArchiveIndex()
+        return ArchiveIndex(**json.loads(data.decode(encoding="utf-8")))
+
+    async def update_index(self, entries: Dict[int, tuple]) -> None:
+        while True:
+            try:
+                data, etag = await self.storage.get_file_if_changed(self.index_path, None)
+                index = ArchiveIndex(**json.loads(data.decode(encoding="utf-8")))
+            except FileNotFoundError:
+                data, etag, index = None, None, ArchiveIndex()
+
+            # story archived again after failed publish replaces earlier record
+            index.stories.update(entries)
+            updated = json.dumps(index.dict(), separators=(",", ":")).encode(encoding="utf-8")
+            try:
+                if data is not None and etag is None:
+                    await self.storage.upload_file(self.index_path, updated)
+                else:
+                    await self.storage.upload_file_if_match(self.index_path, updated, etag)
+                return
+            except StorageConflict:
+                continue
+
+    async def get(self, story_id: int) -> Optional[ArchivedStory]:
+        index = await self.read_index()
+        if story_id not in index.stories:
+            return None
+        shard, offset, length, _ = index.stories[story_id]
+        data = await self.storage.get_file_range(shard, offset, length)
+        return ArchivedStory(**json.loads(data.decode(encoding="utf-8")))
+
+    async def find(self, since: datetime, until: datetime) -> List[int]:
+        index = await self.read_index()
+        return sorted(story_id for story_id, (_, _, _, finished) in index.stories.items()
+                      if since.timestamp() <= finished < until.timestamp())
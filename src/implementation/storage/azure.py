@@ -1,31 +1,115 @@
-from azure.identity import DefaultAzureCredential
+from typing import Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError, \
+    ResourceNotModifiedError
+from azure.core.credentials_async import AsyncTokenCredential
+from azure.identity.aio import DefaultAzureCredential
 from azure.storage.blob.aio import BlobServiceClient
 
 from src.api.config import AZURE_CONTAINER_NAME, AZURE_ACCOUNT_URL
 from src.abstract.storage import Storage as SPI
+from src.api.exceptions import StorageConflict
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+from src.implementation.storage.credential import CachedTokenCredential
 
 
 class Storage(SPI):
-    def __init__(self):
-        creds = DefaultAzureCredential()
-        self.client = BlobServiceClient(account_url=AZURE_ACCOUNT_URL, credential=creds)
+    def __init__(self, credential: AsyncTokenCredential = None):
+        super(Storage, self).__init__()
+        self.credential = CachedTokenCredential(DefaultAzureCredential()) if credential is None else credential
+        self.client = BlobServiceClient(account_url=AZURE_ACCOUNT_URL, credential=self.credential)
+        self.append_blobs = set()
+
+    async def close(self) -> None:
+        await self.client.close()
+        await self.credential.close()
 
     def get_blob_client(self, file_path: str):
         return self.client.get_blob_client(container=AZURE_CONTAINER_NAME, blob=file_path)
 
+    @traced("storage.file_exists")
+    @bounded("storage.file_exists")
     async def file_exists(self, file_path: str) -> bool:
         blob_client = self.get_blob_client(file_path)
         return await blob_client.exists()
 
+    @traced("storage.delete_file")
+    @bounded("storage.delete_file")
     async def delete_file(self, file_path: str) -> bool:
         blob_client = self.get_blob_client(file_path)
         return await blob_client.delete_blob()
 
+    @traced("storage.get_file")
+    @bounded("storage.get_file")
     async def get_file(self, file_path: str) -> bytes:
         blob_client = self.get_blob_client(file_path)
-        data = await blob_client.download_blob()
+        try:
+            data = await blob_client.download_blob()
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(file_path) from e
         return await data.readall()
 
+    @traced("storage.get_file_if_changed")
+    @bounded("storage.get_file_if_changed")
+    async def get_file_if_changed(self, file_path: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        blob_client = self.get_blob_client(file_path)
+        conditions = {} if etag is None else {"etag": etag, "match_condition": MatchConditions.IfModified}
+        try:
+            data = await blob_client.download_blob(**conditions)
+        except ResourceNotModifiedError:
+            return None, etag
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(file_path) from e
+        return await data.readall(), data.properties.etag
+
+    @traced("storage.upload_file")
+    @bounded("storage.upload_file")
     async def upload_file(self, file_path: str, file: bytes, rewrite: bool = True) -> bool:
         blob_client = self.get_blob_client(file_path)
         return await blob_client.upload_blob(data=file, overwrite=rewrite)
+
+    @traced("storage.upload_file_if_match")
+    @bounded("storage.upload_file_if_match")
+    async def upload_file_if_match(self, file_path: str, file: bytes, etag: Optional[str]) -> Optional[str]:
+        blob_client = self.get_blob_client(file_path)
+        conditions = {"overwrite": False} if etag is None else \
+            {"overwrite": True, "etag": etag, "match_condition": MatchConditions.IfNotModified}
+        try:
+            result = await blob_client.upload_blob(data=file, **conditions)
+        except (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError) as e:
+            raise StorageConflict(file_path) from e
+        return result["etag"]
+
+    @traced("storage.delete_file_if_match")
+    @bounded("storage.delete_file_if_match")
+    async def delete_file_if_match(self, file_path: str, etag: Optional[str]) -> bool:
+        blob_client = self.get_blob_client(file_path)
+        try:
+            return await blob_client.delete_blob(etag=etag, match_condition=MatchConditions.IfNotModified)
+        except (ResourceModifiedError, ResourceNotFoundError) as e:
+            raise StorageConflict(file_path) from e
+
+    @traced("storage.append_file")
+    @bounded("storage.append_file")
+    async def append_file(self, file_path: str, file: bytes) -> int:
+        blob_client = self.get_blob_client(file_path)
+        if file_path not in self.append_blobs:
+            try:
+                await blob_client.create_append_blob(etag="*", match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                pass
+            self.append_blobs.add(file_path)
+        result = await blob_client.append_block(file)
+        return int(result["blob_append_offset"])
+
+    @traced("storage.get_file_range")
+    @bounded("storage.get_file_range")
+    async def get_file_range(self, file_path: str, offset: int, length: int) -> bytes:
+        blob_client = self.get_blob_client(file_path)
+        try:
+            data = await blob_client.download_blob(offset=offset, length=length)
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(file_path) from e
+        return await data.readall()
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+
+from azure.core.credentials import AccessToken
+from azure.core.credentials_async import AsyncTokenCredential
+
+from src.api.config import AZURE_TOKEN_REFRESH_MARGIN
+
+
+# DefaultAzureCredential probes its whole chain and asks for new token more often than needed. Token is kept
+# until it is close to expiry, so warm invocations don't touch AAD at all
+class CachedTokenCredential(AsyncTokenCredential):
+    def __init__(self, credential: AsyncTokenCredential, refresh_margin: float = AZURE_TOKEN_REFRESH_MARGIN):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.tokens: Dict[Tuple, AccessToken] = {}
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.fetch_seconds = 0.0
+
+    def cached(self, key: Tuple):
+        token = self.tokens.get(key)
+        if token is not None and token.expires_on - self.refresh_margin > time.time():
+            return token
+        return None
+
+    async def get_token(self, *scopes: str, **kwargs) -> AccessToken:
+        key = scopes + tuple(sorted(kwargs.items()))
+        token = self.cached(key)
+        if token is not None:
+            self.hits += 1
+            return token
+
+        # concurrent requests wait for one fetch instead of running credential chain each
+        async with self.lock:
+            token = self.cached(key)
+            if token is not None:
+                self.hits += 1
+                return token
+
+            started = time.perf_counter()
+            token = await self.credential.get_token(*scopes, **kwargs)
+            self.fetch_seconds += time.perf_counter() - started
+            self.fetches += 1
+            self.tokens[key] = token
+            return token
+
+    async def close(self) -> None:
+        await self.credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -0,0 +1,16 @@
+from src.abstract.storage import Storage
+from src.api.config import STORAGE_BACKEND
+
+
+def create_storage() -> Storage:
+    # backends are imported lazily, local and memory storages work without azure credentials
+    if STORAGE_BACKEND == "filesystem":
+        from src.implementation.storage.filesystem import Storage as FileSystemStorage
+        return FileSystemStorage()
+    if STORAGE_BACKEND == "memory":
+        from src.implementation.storage.memory import Storage as MemoryStorage
+        return MemoryStorage()
+    if STORAGE_BACKEND == "azure":
+        from src.implementation.storage.azure import Storage as AzureStorage
+        return AzureStorage()
+    raise ValueError(f"Unknown storage backend {STORAGE_BACKEND}")
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+from src.abstract.storage import Storage as SPI
+from src.api.config import STORAGE_PATH, STORAGE_FSYNC
+from src.api.exceptions import StorageConflict
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+
+
+# Files are written to temporary file and renamed over the target, so readers never see half written file.
+# Compare-and-swap is atomic within one process, which is enough for local runs and benchmarks
+class Storage(SPI):
+    def __init__(self, path: str = STORAGE_PATH, fsync: bool = STORAGE_FSYNC):
+        super(Storage, self).__init__()
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+
+    def full_path(self, file_path: str) -> str:
+        return os.path.join(self.path, *file_path.split("/"))
+
+    @staticmethod
+    def etag(stat: os.stat_result) -> str:
+        # every write renames new file over the old one, so inode changes along with mtime and size
+        return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def read_sync(self, file_path: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], str]:
+        with open(self.full_path(file_path), "rb") as file:
+            current = self.etag(os.fstat(file.fileno()))
+            if current == etag:
+                return None, current
+            return file.read(), current
+
+    def write_sync(self, file_path: str, data: bytes) -> str:
+        target = self.full_path(file_path)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temporary, target)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+        if self.fsync and hasattr(os, "O_DIRECTORY"):
+            # rename itself is durable only after directory is synced
+            directory_descriptor = os.open(directory, os.O_DIRECTORY)
+            try:
+                os.fsync(directory_descriptor)
+            finally:
+                os.close(directory_descriptor)
+        return self.etag(os.stat(target))
+
+    def current_etag(self, file_path: str) -> Optional[str]:
+        try:
+            return self.etag(os.stat(self.full_path(file_path)))
+        except FileNotFoundError:
+            return None
+
+    def write_if_match_sync(self, file_path: str, data: bytes, etag: Optional[str]) -> str:
+        with self.lock:
+            if self.current_etag(file_path) != etag:
+                raise StorageConflict(file_path)
+            return self.write_sync(file_path, data)
+
+    def delete_sync(self, file_path: str, etag: Optional[str] = None) -> bool:
+        with self.lock:
+            if etag is not None and self.current_etag(file_path) != etag:
+                raise StorageConflict(file_path)
+            os.remove(self.full_path(file_path))
+            return True
+
+    def append_sync(self, file_path: str, data: bytes) -> int:
+        target = self.full_path(file_path)
+        with self.lock:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "ab") as file:
+                offset = file.tell()
+                file.write(data)
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            return offset
+
+    def read_range_sync(self, file_path: str, offset: int, length: int) -> bytes:
+        with open(self.full_path(file_path), "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
+    @traced("storage.file_exists")
+    @bounded("storage.file_exists")
+    async def file_exists(self, file_path: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self.full_path(file_path))
+
+    @traced("storage.delete_file")
+    @bounded("storage.delete_file")
+    async def delete_file(self, file_path: str) -> bool:
+        return await asyncio.to_thread(self.delete_sync, file_path)
+
+    @traced("storage.get_file")
+    @bounded("storage.get_file")
+    async def get_file(self, file_path: str) -> bytes:
+        data, _ = await asyncio.to_thread(self.read_sync, file_path)
+        return data
+
+    @traced("storage.upload_file")
+    @bounded("storage.upload_file")
+    async def upload_file(self, file_path: str, file: bytes, rewrite: bool = True) -> bool:
+        if rewrite:
+            await asyncio.to_thread(self.write_sync, file_path, file)
+        else:
+            await self.upload_file_if_match(file_path, file, None)
+        return True
+
+    @traced("storage.get_file_if_changed")
+    @bounded("storage.get_file_if_changed")
+    async def get_file_if_changed(self, file_path: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        return await asyncio.to_thread(self.read_sync, file_path, etag)
+
+    @traced("storage.upload_file_if_match")
+    @bounded("storage.upload_file_if_match")
+    async def upload_file_if_match(self, file_path: str, file: bytes, etag: Optional[str]) -> Optional[str]:
+        return await asyncio.to_thread(self.write_if_match_sync, file_path, file, etag)
+
+    @traced("storage.delete_file_if_match")
+    @bounded("storage.delete_file_if_match")
+    async def delete_file_if_match(self, file_path: str, etag: Optional[str]) -> bool:
+        try:
+            return await asyncio.to_thread(self.delete_sync, file_path, etag)
+        except FileNotFoundError as e:
+            raise StorageConflict(file_path) from e
+
+    @traced("storage.append_file")
+    @bounded("storage.append_file")
+    async def append_file(self, file_path: str, file: bytes) -> int:
+        return await asyncio.to_thread(self.append_sync, file_path, file)
+
+    @traced("storage.get_file_range")
+    @bounded("storage.get_file_range")
+    async def get_file_range(self, file_path: str, offset: int, length: int) -> bytes:
+        return await asyncio.to_thread(self.read_range_sync, file_path, offset, length)
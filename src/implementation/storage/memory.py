@@ -0,0 +1,71 @@
+import itertools
+from typing import Dict, Optional, Tuple
+
+from src.abstract.storage import Storage as SPI
+from src.api.exceptions import StorageConflict
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+
+
+# Keeps files in process memory, nothing is awaited between check and write, so compare-and-swap is atomic
+class Storage(SPI):
+    def __init__(self):
+        super(Storage, self).__init__()
+        self.files: Dict[str, Tuple[bytes, str]] = {}
+        self.versions = itertools.count(1)
+
+    def current_etag(self, file_path: str) -> Optional[str]:
+        return self.files[file_path][1] if file_path in self.files else None
+
+    @traced("storage.file_exists")
+    @bounded("storage.file_exists")
+    async def file_exists(self, file_path: str) -> bool:
+        return file_path in self.files
+
+    @traced("storage.delete_file")
+    @bounded("storage.delete_file")
+    async def delete_file(self, file_path: str) -> bool:
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        del self.files[file_path]
+        return True
+
+    @traced("storage.get_file")
+    @bounded("storage.get_file")
+    async def get_file(self, file_path: str) -> bytes:
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        return self.files[file_path][0]
+
+    @traced("storage.upload_file")
+    @bounded("storage.upload_file")
+    async def upload_file(self, file_path: str, file: bytes, rewrite: bool = True) -> bool:
+        if rewrite:
+            self.files[file_path] = (bytes(file), str(next(self.versions)))
+        else:
+            await self.upload_file_if_match(file_path, file, None)
+        return True
+
+    @traced("storage.get_file_if_changed")
+    @bounded("storage.get_file_if_changed")
+    async def get_file_if_changed(self, file_path: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        data, current = self.files[file_path]
+        return (None, current) if current == etag else (data, current)
+
+    @traced("storage.upload_file_if_match")
+    @bounded("storage.upload_file_if_match")
+    async def upload_file_if_match(self, file_path: str, file: bytes, etag: Optional[str]) -> Optional[str]:
+        if self.current_etag(file_path) != etag:
+            raise StorageConflict(file_path)
+        self.files[file_path] = (bytes(file), str(next(self.versions)))
+        return self.files[file_path][1]
+
+    @traced("storage.delete_file_if_match")
+    @bounded("storage.delete_file_if_match")
+    async def delete_file_if_match(self, file_path: str, etag: Optional[str]) -> bool:
+        if self.current_etag(file_path) != etag or etag is None:
+            raise StorageConflict(file_path)
+        del self.files[file_path]
+        return True
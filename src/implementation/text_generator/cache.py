@@ -0,0 +1,213 @@
+import asyncio
+import copy
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Collection, Dict, List, Optional, Tuple, TypeVar
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from src.abstract.storage import Storage
+from src.api.config import OPENAI_CACHE, OPENAI_CACHE_PATH, OPENAI_CACHE_TTL, OPENAI_CACHE_MAX_SIZE
+from src.api.exceptions import StorageConflict
+from src.implementation.storage.filesystem import Storage as FileSystemStorage
+
+T = TypeVar("T")
+
+
+# Responses are stored as list per key, so the same promt can have several cached stories. Callers pass ids of
+# responses they already took to get different stories for repeated promts.
+# Index with sizes and access times is shared by processes, so it is changed only with compare-and-swap. Reads don't
+# touch it, access times are kept in memory and written with the next index change.
+class ResponseCache(ABC):
+    index_name = "index.json"
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.index: dict = {}
+        self.index_etag: Optional[str] = None
+        self.accessed: Dict[str, float] = {}
+        self.lock = asyncio.Lock()
+
+    @abstractmethod
+    async def read(self, name: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def write(self, name: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, name: str) -> None:
+        pass
+
+    @abstractmethod
+    async def read_if_changed(self, name: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        # same contract as Storage.get_file_if_changed, raises FileNotFoundError when file is missing
+        pass
+
+    @abstractmethod
+    async def write_if_match(self, name: str, data: bytes, etag: Optional[str]) -> Optional[str]:
+        # same contract as Storage.upload_file_if_match, raises StorageConflict
+        pass
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode(encoding="utf-8")).hexdigest()
+
+    @staticmethod
+    def response_id(response: dict) -> str:
+        return ResponseCache.key(repr(response["created"]), response["content"])
+
+    async def get(self, key: str, exclude: Collection[str] = ()) -> Optional[Tuple[str, str]]:
+        # returns id and content of the oldest response not taken by caller yet
+        async with self.lock:
+            responses = [response for response in await self.read_responses(key)
+                         if self.response_id(response) not in exclude]
+            if not responses:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.accessed[key] = time.time()
+            return self.response_id(responses[0]), responses[0]["content"]
+
+    async def add(self, key: str, content: str) -> str:
+        async with self.lock:
+            responses = await self.read_responses(key)
+            response = {"created": time.time(), "content": content}
+            responses.append(response)
+            size = await self.write_responses(key, responses)
+            evicted = await self.update_index(lambda index: self.resize(index, key, size, evict=True))
+            for evicted_key in evicted:
+                self.evictions += 1
+                await self.delete(f"{evicted_key}.json")
+            return self.response_id(response)
+
+    async def discard(self, key: str, response_ids: Collection[str]) -> None:
+        async with self.lock:
+            responses = await self.read_responses(key)
+            size = await self.write_responses(key, [response for response in responses
+                                                    if self.response_id(response) not in response_ids])
+            await self.update_index(lambda index: self.resize(index, key, size))
+
+    async def flush(self) -> None:
+        # access times recorded by reads are written when nothing else changed the index
+        async with self.lock:
+            if self.accessed:
+                await self.update_index(lambda index: None)
+
+    async def update_index(self, change: Callable[[dict], T]) -> T:
+        while True:
+            try:
+                data, etag = await self.read_if_changed(self.index_name, self.index_etag)
+            except FileNotFoundError:
+                data, etag, self.index = None, None, {}
+            existed = data is not None or etag is not None
+            if data is not None:
+                self.index = json.loads(data.decode(encoding="utf-8"))
+
+            index = copy.deepcopy(self.index)
+            for key, accessed in self.accessed.items():
+                if key in index:
+                    index[key]["accessed"] = max(index[key]["accessed"], accessed)
+            result = change(index)
+
+            data = json.dumps(index).encode(encoding="utf-8")
+            try:
+                if existed and etag is None:
+                    # caches without etags can only overwrite
+                    await self.write(self.index_name, data)
+                else:
+                    etag = await self.write_if_match(self.index_name, data, etag)
+            except StorageConflict:
+                # another process changed index meanwhile, change is applied again over its version
+                continue
+
+            self.index, self.index_etag, self.accessed = index, etag, {}
+            return result
+
+    def resize(self, index: dict, key: str, size: Optional[int], evict: bool = False) -> List[str]:
+        if size is None:
+            index.pop(key, None)
+        else:
+            accessed = index.get(key, {}).get("accessed", time.time())
+            index[key] = {"accessed": accessed, "size": size}
+        return self.evict(index, keep=key) if evict else []
+
+    def evict(self, index: dict, keep: str) -> List[str]:
+        evicted = []
+        size = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda item: index[item]["accessed"]):
+            if size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            size -= index.pop(key)["size"]
+            evicted.append(key)
+        return evicted
+
+    async def read_responses(self, key: str) -> List[dict]:
+        # expired responses are dropped from the file with the next write
+        data = await self.read(f"{key}.json")
+        responses = [] if data is None else json.loads(data.decode(encoding="utf-8"))
+        return [response for response in responses if time.time() - response["created"] < self.ttl]
+
+    async def write_responses(self, key: str, responses: List[dict]) -> Optional[int]:
+        if not responses:
+            await self.delete(f"{key}.json")
+            return None
+
+        data = json.dumps(responses).encode(encoding="utf-8")
+        await self.write(f"{key}.json", data)
+        return len(data)
+
+
+class StorageResponseCache(ResponseCache):
+    def __init__(self, storage: Storage, prefix: str, ttl: int, max_size: int):
+        super(StorageResponseCache, self).__init__(ttl, max_size)
+        self.storage = storage
+        self.prefix = prefix
+
+    def file_path(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    async def read(self, name: str) -> Optional[bytes]:
+        try:
+            return await self.storage.get_file(self.file_path(name))
+        except FileNotFoundError:
+            return None
+
+    async def write(self, name: str, data: bytes) -> None:
+        await self.storage.upload_file(self.file_path(name), data)
+
+    async def delete(self, name: str) -> None:
+        try:
+            await self.storage.delete_file(self.file_path(name))
+        except (FileNotFoundError, ResourceNotFoundError):
+            pass
+
+    async def read_if_changed(self, name: str, etag: Optional[str]) -> Tuple[Optional[bytes], Optional[str]]:
+        return await self.storage.get_file_if_changed(self.file_path(name), etag)
+
+    async def write_if_match(self, name: str, data: bytes, etag: Optional[str]) -> Optional[str]:
+        return await self.storage.upload_file_if_match(self.file_path(name), data, etag)
+
+
+class DiskResponseCache(StorageResponseCache):
+    def __init__(self, path: str, ttl: int, max_size: int):
+        # files are replaced atomically and index is compared by etag like in local storage
+        super(DiskResponseCache, self).__init__(FileSystemStorage(path), "", ttl, max_size)
+
+
+def create_response_cache(storage: Storage = None) -> Optional[ResponseCache]:
+    if OPENAI_CACHE == "disk":
+        return DiskResponseCache(OPENAI_CACHE_PATH, OPENAI_CACHE_TTL, OPENAI_CACHE_MAX_SIZE)
+    if OPENAI_CACHE == "storage":
+        return StorageResponseCache(storage, OPENAI_CACHE_PATH, OPENAI_CACHE_TTL, OPENAI_CACHE_MAX_SIZE)
+    return None
@@ -0,0 +1,134 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.api.config import AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_KEY, AZURE_OPENAI_DEPLOYMENT, AZURE_OPENAI_API_VERSION, \
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_HEDGE_PERCENTILE, OPENAI_HEDGE_DELAY
+from src.api.models import OpenAIEndpoint
+
+
+def create_endpoint(name: str) -> OpenAIEndpoint:
+    if name == "openai":
+        return OpenAIEndpoint(name=name, api_type="open_ai", api_base="https://api.openai.com/v1",
+                              api_key=OPENAI_API_KEY, model=OPENAI_MODEL)
+    if name == "azure":
+        return OpenAIEndpoint(name=name, api_type="azure", api_base=AZURE_OPENAI_ENDPOINT, api_key=AZURE_OPENAI_KEY,
+                              api_version=AZURE_OPENAI_API_VERSION, model=OPENAI_MODEL,
+                              deployment=AZURE_OPENAI_DEPLOYMENT)
+    raise ValueError(f"Unknown openai endpoint {name}")
+
+
+class LatencyHistogram:
+    # bucket bounds in seconds growing by 25%, from 50ms to about 5 minutes
+    bounds = [0.05 * 1.25 ** power for power in range(40)]
+
+    def __init__(self, min_samples: int = 20):
+        self.min_samples = min_samples
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if self.count < self.min_samples:
+            return None
+
+        rank = percentile * self.count
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+# Sends request to the first endpoint. If it gives no first token within hedge threshold, the same request goes to
+# the next endpoint, and so on. First endpoint that streams a token wins, others are cancelled.
+class Hedger:
+    def __init__(self, endpoints: List[OpenAIEndpoint], percentile: float = OPENAI_HEDGE_PERCENTILE,
+                 default_delay: float = OPENAI_HEDGE_DELAY):
+        self.endpoints = endpoints
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.histograms: Dict[str, LatencyHistogram] = {endpoint.name: LatencyHistogram() for endpoint in endpoints}
+        self.hedged = 0
+        self.wins: Dict[str, int] = {endpoint.name: 0 for endpoint in endpoints}
+
+    def threshold(self, endpoint: OpenAIEndpoint) -> float:
+        threshold = self.histograms[endpoint.name].percentile(self.percentile)
+        return self.default_delay if threshold is None else threshold
+
+    async def first_chunk(self, endpoint: OpenAIEndpoint,
+                          open_stream: Callable[[OpenAIEndpoint], Awaitable[AsyncIterator[str]]]
+                          ) -> Tuple[AsyncIterator[str], str]:
+        started = time.monotonic()
+        stream = await open_stream(endpoint)
+        iterator = stream.__aiter__()
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            raise ValueError(f"Empty response from {endpoint.name}")
+        self.histograms[endpoint.name].observe(time.monotonic() - started)
+        return iterator, chunk
+
+    async def stream(self, open_stream: Callable[[OpenAIEndpoint], Awaitable[AsyncIterator[str]]],
+                     endpoints: List[OpenAIEndpoint] = None,
+                     on_winner: Callable[[OpenAIEndpoint], None] = None) -> AsyncIterator[str]:
+        pending: Dict[asyncio.Task, Tuple[OpenAIEndpoint, float]] = {}
+        waiting = list(self.endpoints if endpoints is None else endpoints)
+        winner = None
+        error = None
+
+        try:
+            while winner is None:
+                if waiting:
+                    endpoint = waiting.pop(0)
+                    if pending:
+                        self.hedged += 1
+                        logging.info(f"No first token in time, sending hedged request to {endpoint.name}")
+                    task = asyncio.ensure_future(self.first_chunk(endpoint, open_stream))
+                    pending[task] = endpoint, time.monotonic()
+                if not pending:
+                    raise error
+
+                timeout = self.threshold(endpoint) if waiting else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    finished, _ = pending.pop(task)
+                    if task.exception() is not None:
+                        logging.warning(f"Request to {finished.name} failed: {task.exception()}")
+                        error = task.exception()
+                    elif winner is None:
+                        winner = finished, task.result()
+                    else:
+                        await task.result()[0].aclose()
+        finally:
+            for task, (endpoint, started) in pending.items():
+                task.cancel()
+                # slow requests are the ones that set the tail, their latency is at least this long
+                self.histograms[endpoint.name].observe(max(time.monotonic() - started, self.threshold(endpoint)))
+
+        endpoint, (iterator, chunk) = winner
+        self.wins[endpoint.name] += 1
+        if on_winner is not None:
+            on_winner(endpoint)
+        yield chunk
+        async for chunk in iterator:
+            yield chunk
+
+    async def complete(self, open_stream: Callable[[OpenAIEndpoint], Awaitable[AsyncIterator[str]]]) -> str:
+        # whole response is needed, so stream that breaks after first token is hedged with the endpoints left
+        endpoints = list(self.endpoints)
+        while True:
+            winners: List[OpenAIEndpoint] = []
+            try:
+                return "".join([chunk async for chunk in self.stream(open_stream, endpoints, winners.append)])
+            except Exception as e:
+                if not winners or len(endpoints) == 1:
+                    raise
+                logging.warning(f"Response from {winners[0].name} broke off: {e!r}, hedging with other endpoints")
+                endpoints.remove(winners[0])
@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+
+# Token bucket refilled continuously up to tokens per minute. Requests reserve estimated amount before call and
+# settle the difference with actual usage afterwards, so bucket can go below zero and delay next requests.
+class TokenBudget:
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.tokens_per_minute, self.tokens + (now - self.updated) * self.tokens_per_minute / 60)
+        self.updated = now
+
+    async def acquire(self, tokens: int) -> None:
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self.lock:
+            self.refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) * 60 / self.tokens_per_minute)
+                self.refill()
+            self.tokens -= tokens
+
+    def settle(self, reserved: int, used: int) -> None:
+        self.refill()
+        self.tokens -= used - min(reserved, self.tokens_per_minute)
@@ -1,15 +1,32 @@
+import json
 import logging
-import re
-from typing import List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
 
 import openai
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 
 from src.abstract.text_generator import TextGenerator as SPI
-from src.api.config import AZURE_OPENAI_KEY
-from src.api.models import StoryManager, Story
+from src.api.config import OPENAI_MODEL, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_POOL_SIZE, \
+    OPENAI_OUTPUT_FORMAT, OPENAI_TOKENS_PER_MINUTE, OPENAI_CACHE_CONSUME, OPENAI_ENDPOINTS
+from src.api.exceptions import StoryParseError
+from src.api.models import OpenAIEndpoint, StoryManager, Story
+from src.implementation.deadline import bounded
+from src.implementation.metrics.tracer import traced
+from src.implementation.text_generator.cache import ResponseCache
+from src.implementation.text_generator.hedging import Hedger, create_endpoint
+from src.implementation.text_generator.limiter import TokenBudget
+from src.implementation.text_generator.parser import StoryParser, SECTIONS, SECTION_DESCRIPTIONS, \
+    parse_named_sections
+
+# cached responses taken by generation running in this context, by cache key
+current_reservation: ContextVar[Optional[Dict[str, List[str]]]] = ContextVar("current_reservation", default=None)
 
 
 class TextGenerator(SPI):
+    system_message = "You are a writer like a greek philosopher Aristotle"
+
     promt = """
     Your goal is to write short tricky situations. These stories are split into 3 parts, where at the end of the first
     two parts you present readers with two options on how to proceed. Only after a second response, you will finish the
@@ -56,24 +73,99 @@ class TextGenerator(SPI):
     \n
     """
 
-    pattern = "\s*.*{story-begin}:\s*(?P<storybegin>\s*.+)\s*{option 1}:\s*(?P<option1>\s*.+)\s*{option 2}:\s*(?P<option2>\s*.+)\s*{story-option 1}:\s*(?P<story1>\s*.+)\s*{option 1}:\s*(?P<story1option1>\s*.+)\s*{option 2}:\s*(?P<story1option2>\s*.+)\s*{end-option 1}:\s*(?P<end11>\s*.+)\s*{end-option 2}:\s*(?P<end12>\s*.+)\s*{story-option 2}:\s*(?P<story2>\s*.+)\s*{option 1}:\s*(?P<story2option1>\s*.+)\s*{option 2}:\s*(?P<story2option2>\s*.+)\s*{end-option 1}:\s*(?P<end21>\s*.+)\s*{end-option 2}:\s*(?P<end22>\s*.+)"
+    # every promt sent with json response format ends with it, model is asked for the same json it has to return
+    json_format = """
+    Answer with JSON object {"stories": [...]} where every item of the list matches JSON schema:
+    """ + Story.schema_json() + """
+
+    List must contain exactly 7 items with tags:
+    "story" - beginning of the story with option_1 and option_2,
+    "story-1" - continuation after option_1 of "story" with its own option_1 and option_2,
+    "story-2" - continuation after option_2 of "story" with its own option_1 and option_2,
+    "story-1-1", "story-1-2", "story-2-1", "story-2-2" - endings after option_1 and option_2 of "story-1" and
+    "story-2" with "end": true and without options.
+    """
+
+    json_promt = """
+    Your goal is to write short tricky situations. These stories are split into 3 parts, where at the end of the first
+    two parts you present readers with two options on how to proceed. Only after a second response, you will finish the
+    story. Options should be no longer that 25 characters. No conclusions in the end.
+    """ + json_format
+
+    story_tags = ["story", "story-1", "story-1-1", "story-1-2", "story-2", "story-2-1", "story-2-2"]
+
+    repair_promt = """
+    You wrote a story with options, but some parts of it got lost. Here are the parts that are left:
+    {found}
+
+    Write only the missing parts. Start each part with its key in curly brackets exactly as below, replacing
+    description with actual value. Options should be no longer that 25 characters:
+    {missing}
+    """
+
     retry = 3
+    # when more sections than this are missing the story is generated from scratch instead of repaired
+    repair_limit = 6
+    # tokens reserved from budget for request, replaced with average of actual usage once known
+    estimated_tokens = 1000
 
-    def __init__(self):
+    def __init__(self, connect_timeout: float = OPENAI_CONNECT_TIMEOUT, read_timeout: float = OPENAI_READ_TIMEOUT,
+                 pool_size: int = OPENAI_POOL_SIZE, output_format: str = OPENAI_OUTPUT_FORMAT,
+                 tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE, cache: ResponseCache = None,
+                 consume_cache: bool = OPENAI_CACHE_CONSUME, endpoints: List[OpenAIEndpoint] = None):
         super(TextGenerator, self).__init__()
-        # openai.api_type = "azure"
-        # openai.api_base = AZURE_OPENAI_ENDPOINT
-        # openai.api_version = "2023-05-15"
-        openai.api_key = AZURE_OPENAI_KEY
+        self.model = OPENAI_MODEL
+        if endpoints is None:
+            endpoints = [create_endpoint(name.strip()) for name in OPENAI_ENDPOINTS.split(",")]
+        self.endpoints = endpoints
+        self.hedger = Hedger(endpoints) if len(endpoints) > 1 else None
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        if output_format not in ("text", "json"):
+            raise ValueError(f"Unknown output format {output_format}")
+        self.output_format = output_format
+        self.token_budget = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+        self.requests = 0
+        self.tokens_used = 0
+        self.cache = cache
+        self.consume_cache = consume_cache
+        # ids of cached responses taken by generations that are neither committed nor released, by cache key
+        self.cache_reserved: Dict[str, Set[str]] = {}
+        # responses taken outside of reservation(), e.g. by pool refill
+        self.unscoped_reservation: Dict[str, List[str]] = {}
+        self.session: Optional[ClientSession] = None
+
+    def get_session(self) -> ClientSession:
+        # session must be created inside running loop, so it is built on first call and reused afterwards
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(
+                connector=TCPConnector(limit=self.pool_size),
+                timeout=ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
 
-    def get_content(self, promt: str = None) -> str:
-        content = self.get_gpt_story(promt)
+    async def get_content(self, promt: str = None) -> str:
+        content = await self.get_gpt_story(promt)
         content = content.replace("\n ", "")
         return content
 
+    @traced("openai.generate_story")
     async def generate_story(self, promt: str = None) -> StoryManager:
-        content = self.get_content(promt)
-        names = self.search_story_parts(content)
+        if self.output_format == "json":
+            try:
+                return await self.generate_json_story(promt)
+            except ValueError as e:
+                logging.warning(f"Failed to parse json story: {e}. Will try with text promt")
+            promt = None
+
+        content = await self.get_content(promt)
+        names = await self.search_story_parts(content)
 
         stories = self.compile_stories(names)
 
@@ -82,19 +174,88 @@ class TextGenerator(SPI):
             active_story=stories[0]
         )
 
+    @traced("openai.generate_story_streaming")
+    async def generate_story_streaming(self, on_active_story: Callable[[Story], None],
+                                       promt: str = None) -> StoryManager:
+        if self.output_format == "json":
+            return await super(TextGenerator, self).generate_story_streaming(on_active_story, promt)
+
+        parser = StoryParser()
+        active_story = None
+        try:
+            async for chunk in self.stream_gpt_story(promt):
+                parser.feed(chunk)
+                if active_story is None and parser.is_complete("storybegin", "option1", "option2"):
+                    active_story = self.compile_active_story(parser.names)
+                    on_active_story(active_story)
+        except Exception as e:
+            if active_story is None:
+                raise
+            # opening may be published already, so the rest of this story is repaired instead of thrown away
+            logging.warning(f"Story stream broke off after active story: {e!r}, repairing missing parts")
+        parser.close()
+
+        # once active story is handed over it can't change, so missing parts are only repaired
+        names = await self.complete_story_parts(parser.names, parser.missing(), regenerate=active_story is None)
+        stories = self.compile_stories(names)
+        if active_story is None:
+            on_active_story(stories[0])
+
+        return StoryManager(
+            stories=stories,
+            active_story=stories[0]
+        )
+
+    async def generate_json_story(self, promt: str = None) -> StoryManager:
+        # custom promt describes the story, output format is always json
+        content = await self.get_gpt_story(self.json_promt if promt is None else promt + self.json_format,
+                                           json_output=True)
+        return self.validate_json_story(content)
+
+    def validate_json_story(self, content: str) -> StoryManager:
+        data = json.loads(content)
+        if not isinstance(data, dict) or not isinstance(data.get("stories"), list):
+            raise ValueError("Response has no stories list")
+
+        stories = {}
+        for item in data["stories"]:
+            story = Story.parse_obj(item)
+            stories[story.tag] = story
+
+        missing = [tag for tag in self.story_tags if tag not in stories]
+        if missing:
+            raise ValueError(f"Missing stories: {', '.join(missing)}")
+
+        for tag in self.story_tags:
+            story = stories[tag]
+            story.end = tag.count("-") == 2
+            if story.end:
+                story.text = self.check_empty_text(story.text)
+                story.option_1 = story.option_2 = None
+            elif not story.option_1 or not story.option_2:
+                raise ValueError(f"Story {tag} has no options")
+
+        return StoryManager(
+            stories=[stories[tag] for tag in self.story_tags],
+            active_story=stories["story"]
+        )
+
     def check_empty_text(self, text: str) -> str:
         if text == "" or text == " ":
             return "No possible options - end of story"
         return text
 
+    def compile_active_story(self, names: dict) -> Story:
+        return Story(
+            tag="story",
+            text=names["storybegin"],
+            option_1=names["option1"],
+            option_2=names["option2"],
+        )
+
     def compile_stories(self, names: dict) -> List[Story]:
         return [
-            Story(
-                tag="story",
-                text=names["storybegin"],
-                option_1=names["option1"],
-                option_2=names["option2"],
-            ),
+            self.compile_active_story(names),
             Story(
                 tag="story-1",
                 text=names["story1"],
@@ -129,29 +290,220 @@ class TextGenerator(SPI):
             ),
         ]
 
-    def search_story_parts(self, content: str) -> dict:
-        groups = re.search(self.pattern, content)
-
-        if groups:
-            names: dict = groups.groupdict()
-            for item in names.values():
-                item = item.replace("\n\n", "").replace("\n", "")
-        elif not groups and self.retry > 0:
-            logging.warning("Failed to parse response. Will try with default promt")
-            self.retry -= 1
-            new_content = self.get_content(self.promt)
-            return self.search_story_parts(new_content)
-        else:
-            raise ValueError(f"Can't parse response : {content}")
+    async def search_story_parts(self, content: str, retry: int = None) -> dict:
+        try:
+            return StoryParser.parse(content)
+        except StoryParseError as e:
+            logging.debug(f"Failed to parse response : {content}")
+            return await self.complete_story_parts(e.found, e.missing, retry)
+
+    async def complete_story_parts(self, names: dict, missing: List[str], retry: int = None,
+                                   regenerate: bool = True) -> dict:
+        retry = self.retry if retry is None else retry
+        while missing:
+            if retry <= 0:
+                logging.error(f"Can't parse response, missing {missing}")
+                raise StoryParseError(missing, names)
+            retry -= 1
+
+            if len(missing) <= self.repair_limit or not regenerate:
+                logging.warning(f"Failed to parse response, missing {missing}. Will ask to repair missing parts")
+                names.update(await self.repair_story_parts(names, missing))
+                missing = [name for name in SECTIONS if name not in names]
+            else:
+                logging.warning(f"Failed to parse response, missing {missing}. Will try with default promt")
+                content = await self.get_content(self.promt)
+                try:
+                    return StoryParser.parse(content)
+                except StoryParseError as e:
+                    names = e.found
+                    missing = e.missing
 
         return names
 
-    def get_gpt_story(self, promt: str = None) -> str:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a writer like a greek philosopher Aristotle"},
-                {"role": "user", "content": self.promt if promt is None else promt}
-            ]
+    async def repair_story_parts(self, names: dict, missing: List[str]) -> dict:
+        promt = self.repair_promt.format(
+            found="\n".join(f"{{{name}}}: {names[name]}" for name in SECTIONS if name in names),
+            missing="\n".join(f"{{{name}}}: {SECTION_DESCRIPTIONS[name]}" for name in missing)
+        )
+        content = await self.get_gpt_story(promt)
+        repaired = parse_named_sections(content)
+
+        return {name: text for name, text in repaired.items() if name in missing}
+
+    def endpoint_params(self, endpoint: OpenAIEndpoint) -> dict:
+        params = {
+            "api_key": endpoint.api_key,
+            "api_base": endpoint.api_base,
+            "api_type": endpoint.api_type,
+            "model": endpoint.model or self.model,
+        }
+        if endpoint.api_version:
+            params["api_version"] = endpoint.api_version
+        if endpoint.deployment:
+            params["deployment_id"] = endpoint.deployment
+        return params
+
+    @traced("openai.completion")
+    @bounded("openai.completion")
+    async def create_completion(self, promt: str = None, endpoint: OpenAIEndpoint = None, **params):
+        reserved = self.estimated_tokens
+        if self.token_budget is not None:
+            await self.token_budget.acquire(reserved)
+
+        # openai reuses session from context instead of opening new connection for every request
+        openai.aiosession.set(self.get_session())
+        messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": self.promt if promt is None else promt}
+        ]
+        response = await openai.ChatCompletion.acreate(
+            **self.endpoint_params(self.endpoints[0] if endpoint is None else endpoint),
+            messages=messages,
+            request_timeout=(self.connect_timeout, self.read_timeout),
+            **params
         )
-        return response['choices'][0]['message']['content']
+
+        if params.get("stream"):
+            return self.count_stream(response, reserved, "".join(message["content"] for message in messages))
+        usage = response.get("usage")
+        if usage:
+            self.record_usage(reserved, usage["total_tokens"])
+        return response
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        # about 4 characters per token for english text
+        return len(text) // 4 + 1
+
+    async def count_stream(self, response: AsyncIterator[dict], reserved: int, promt: str) -> AsyncIterator[dict]:
+        # streamed responses don't report usage, it is estimated from text once stream ends or is dropped.
+        # Stream cancelled before it was read keeps whole reservation spent
+        contents = []
+        try:
+            async for chunk in response:
+                if chunk['choices']:
+                    contents.append(chunk['choices'][0]['delta'].get('content') or "")
+                yield chunk
+        finally:
+            self.record_usage(reserved, self.estimate_tokens(promt) + self.estimate_tokens("".join(contents)))
+
+    def record_usage(self, reserved: int, used: int) -> None:
+        self.requests += 1
+        self.tokens_used += used
+        self.estimated_tokens = self.tokens_used // self.requests
+        if self.token_budget is not None:
+            self.token_budget.settle(reserved, used)
+
+    @traced("openai.get_story")
+    async def get_gpt_story(self, promt: str = None, json_output: bool = False) -> str:
+        key = self.cache_key(promt, json_output)
+        content = await self.get_cached(key)
+        if content is not None:
+            return content
+
+        params = {"response_format": {"type": "json_object"}} if json_output else {}
+        if self.hedger is not None:
+            # hedging needs to see first token, so response is streamed even if whole text is needed
+            content = await self.hedger.complete(lambda endpoint: self.open_stream(promt, endpoint, **params))
+        else:
+            response = await self.create_completion(promt, **params)
+            content = response['choices'][0]['message']['content']
+
+        await self.add_cached(key, content)
+        return content
+
+    @traced("openai.stream_story")
+    async def stream_gpt_story(self, promt: str = None) -> AsyncIterator[str]:
+        key = self.cache_key(promt)
+        content = await self.get_cached(key)
+        if content is not None:
+            yield content
+            return
+
+        if self.hedger is not None:
+            stream = self.hedger.stream(lambda endpoint: self.open_stream(promt, endpoint))
+        else:
+            stream = await self.open_stream(promt)
+
+        chunks = []
+        async for content in stream:
+            chunks.append(content)
+            yield content
+
+        await self.add_cached(key, "".join(chunks))
+
+    async def open_stream(self, promt: str = None, endpoint: OpenAIEndpoint = None, **params) -> AsyncIterator[str]:
+        response = await self.create_completion(promt, endpoint, stream=True, **params)
+
+        async def contents() -> AsyncIterator[str]:
+            async for chunk in response:
+                if not chunk['choices']:
+                    continue
+                content = chunk['choices'][0]['delta'].get('content')
+                if content:
+                    yield content
+
+        return contents()
+
+    def cache_key(self, promt: str = None, json_output: bool = False) -> str:
+        return ResponseCache.key(self.model, self.system_message, self.promt if promt is None else promt,
+                                 "json" if json_output else "text")
+
+    @contextmanager
+    def reservation(self) -> Iterator[Dict[str, List[str]]]:
+        reservation = {}
+        token = current_reservation.set(reservation)
+        try:
+            yield reservation
+        finally:
+            current_reservation.reset(token)
+            # responses of failed generation stay cached for the next one
+            self.release(reservation)
+
+    def active_reservation(self) -> Dict[str, List[str]]:
+        reservation = current_reservation.get()
+        return self.unscoped_reservation if reservation is None else reservation
+
+    def reserve(self, key: str, response_id: str) -> None:
+        self.cache_reserved.setdefault(key, set()).add(response_id)
+        self.active_reservation().setdefault(key, []).append(response_id)
+
+    def release(self, reservation: Dict[str, List[str]]) -> None:
+        for key, response_ids in reservation.items():
+            self.cache_reserved.get(key, set()).difference_update(response_ids)
+        reservation.clear()
+
+    async def get_cached(self, key: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+
+        while True:
+            found = await self.cache.get(key, exclude=set(self.cache_reserved.get(key, ())))
+            if found is None:
+                return None
+            response_id, content = found
+            # concurrent generation could take the same response while this one was reading
+            if response_id not in self.cache_reserved.get(key, ()):
+                self.reserve(key, response_id)
+                return content
+
+    async def add_cached(self, key: str, content: str) -> None:
+        if self.cache is None:
+            return
+
+        self.reserve(key, await self.cache.add(key, content))
+
+    async def commit(self) -> None:
+        # only generation of current reservation is persisted, concurrent ones keep their responses
+        reservation = self.active_reservation()
+        if self.cache is None:
+            reservation.clear()
+            return
+
+        logging.debug(f"Response cache hits {self.cache.hits}, misses {self.cache.misses}")
+        if self.consume_cache:
+            for key, response_ids in reservation.items():
+                await self.cache.discard(key, response_ids)
+        self.release(reservation)
+        await self.cache.flush()
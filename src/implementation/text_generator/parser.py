@@ -0,0 +1,128 @@
+import re
+from typing import List, Optional
+
+from src.api.exceptions import StoryParseError
+
+MARKER = re.compile(r"\{(story-begin|story-option [12]|end-option [12]|option [12])\}")
+# longest marker is "{story-option 1}", scanning restarts this far back to catch markers split between chunks
+MARKER_MAX_LENGTH = len("{story-option 1}")
+
+SECTIONS = [
+    "storybegin", "option1", "option2",
+    "story1", "story1option1", "story1option2", "end11", "end12",
+    "story2", "story2option1", "story2option2", "end21", "end22",
+]
+
+SECTION_DESCRIPTIONS = {
+    "storybegin": "beginning of the story",
+    "option1": "first option after beginning of the story",
+    "option2": "second option after beginning of the story",
+    "story1": "continuation of the story after first option",
+    "story1option1": "first option after continuation of the story after first option",
+    "story1option2": "second option after continuation of the story after first option",
+    "end11": "ending after first option of continuation after first option",
+    "end12": "ending after second option of continuation after first option",
+    "story2": "continuation of the story after second option",
+    "story2option1": "first option after continuation of the story after second option",
+    "story2option2": "second option after continuation of the story after second option",
+    "end21": "ending after first option of continuation after second option",
+    "end22": "ending after second option of continuation after second option",
+}
+
+NAMED_MARKER = re.compile(r"\{(" + "|".join(SECTIONS) + r")\}")
+
+
+# Repair answers mark every section with its name, e.g. {end21}: text
+def parse_named_sections(content: str) -> dict:
+    names = {}
+    matches = list(NAMED_MARKER.finditer(content))
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = len(content) if following is None else following.start()
+        text = " ".join(content[match.end():end].lstrip(" \t\r\n:").split())
+        if match.group(1) not in names and (text or match.group(1).startswith("end")):
+            names[match.group(1)] = text
+    return names
+
+
+# Single pass parser, every character is scanned once. Text is consumed with feed, so it works with streamed
+# responses too. Section name is resolved from marker and branch the marker appears in.
+class StoryParser:
+    def __init__(self):
+        self.buffer = ""
+        self.scanned = 0
+        self.branch = ""
+        self.current: Optional[str] = None
+        self.start = 0
+        self.names: dict = {}
+        self.closed = False
+
+    @classmethod
+    def parse(cls, content: str) -> dict:
+        parser = cls()
+        parser.feed(content)
+        parser.close()
+        missing = parser.missing()
+        if missing:
+            raise StoryParseError(missing, parser.names)
+        return parser.names
+
+    def feed(self, chunk: str) -> List[str]:
+        previous_length = len(self.buffer)
+        self.buffer += chunk
+        scan_from = max(self.scanned, previous_length - MARKER_MAX_LENGTH + 1)
+
+        completed = []
+        for match in MARKER.finditer(self.buffer, scan_from):
+            name = self.finish_section(match.start())
+            if name:
+                completed.append(name)
+            self.current = self.section_name(match.group(1))
+            self.start = match.end()
+            self.scanned = match.end()
+
+        return completed
+
+    def close(self) -> List[str]:
+        if self.closed:
+            return []
+        self.closed = True
+        # model often adds comments after last section, they are separated by empty line
+        tail = self.buffer[self.start:].lstrip(" \t\r\n:")
+        cut = tail.find("\n\n")
+        end = len(self.buffer) if cut == -1 else len(self.buffer) - len(tail) + cut
+        name = self.finish_section(end)
+        return [name] if name else []
+
+    def missing(self) -> List[str]:
+        return [name for name in SECTIONS if name not in self.names]
+
+    def is_complete(self, *sections: str) -> bool:
+        return all(name in self.names for name in sections)
+
+    def section_name(self, marker: str) -> Optional[str]:
+        kind, _, number = marker.partition(" ")
+        if kind == "story-begin":
+            self.branch = ""
+            return "storybegin"
+        if kind == "story-option":
+            self.branch = number
+            return f"story{number}"
+        if kind == "option":
+            return f"story{self.branch}option{number}" if self.branch else f"option{number}"
+        if kind == "end-option" and self.branch:
+            return f"end{self.branch}{number}"
+        return None
+
+    def finish_section(self, end: int) -> Optional[str]:
+        name = self.current
+        self.current = None
+        if name is None or name in self.names:
+            return None
+
+        text = " ".join(self.buffer[self.start:end].lstrip(" \t\r\n:").split())
+        # empty ending is allowed, it is replaced with default text when stories are compiled
+        if text == "" and not name.startswith("end"):
+            return None
+
+        self.names[name] = text
+        return name
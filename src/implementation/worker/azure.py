@@ -1,23 +1,212 @@
+import asyncio
 import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Dict, List, Optional, Tuple, Union
 
+from src.abstract.publisher import Publisher
+from src.abstract.storage import Storage
+from src.abstract.text_generator import TextGenerator
 from src.abstract.worker import Worker as SPI
-from src.api.models import CheckPoint, PublisherPost, Story
+from src.api.config import STORY_POOL_SIZE, STORY_POOL_LOW_WATER_MARK, STORY_POOL_REFILL_CONCURRENCY, \
+    CHECKPOINT_LEASE_SECONDS, STORY_CHANNELS, STORY_CHANNEL_CONCURRENCY, \
+    STORY_PIPELINE, POLL_DURATION_MINUTES, SCHEDULER_GRACE_SECONDS, \
+    WORKER_DEADLINE_SECONDS, DEADLINE_CRITICAL_SECONDS
+from src.api.exceptions import DeadlineExceeded, QuotaExceeded, StorageConflict
+from src.api.models import ArchivedStory, ChannelResult, CheckPoint, PublisherPost, Story, StoryManager, StoryStep
+from src.implementation.deadline import Deadline, current_deadline, no_deadline
+from src.implementation.metrics.tracer import Tracer, traced
+from src.implementation.storage.archive import StoryArchive
 
 logger = logging.getLogger(__name__)
 
 
 class Worker(SPI):
-    async def exec(self):
-        logger.info("Getting checkpoint")
-        checkpoint = await self.storage.get_checkpoint()
+    pool_size: int = STORY_POOL_SIZE
+    pool_low_water_mark: int = STORY_POOL_LOW_WATER_MARK
+    pool_refill_concurrency: int = STORY_POOL_REFILL_CONCURRENCY
+    lease_seconds: float = CHECKPOINT_LEASE_SECONDS
+    channels: List[str] = STORY_CHANNELS
+    channel_concurrency: int = STORY_CHANNEL_CONCURRENCY
+    pipeline: bool = STORY_PIPELINE
+    poll_duration: int = POLL_DURATION_MINUTES
+    grace_seconds: float = SCHEDULER_GRACE_SECONDS
+    deadline_seconds: float = WORKER_DEADLINE_SECONDS
+    critical_seconds: float = DEADLINE_CRITICAL_SECONDS
 
-        if checkpoint:
-            logger.debug(f"Checkpoint: {checkpoint.dict()}")
-            return await self.continue_story(checkpoint)
-        else:
-            return await self.start_new_story()
+    def __init__(self, text_generator: TextGenerator, publisher: Publisher, storage: Storage,
+                 archive: Optional[StoryArchive] = None, tracer: Optional[Tracer] = None):
+        super(Worker, self).__init__(text_generator, publisher, storage)
+        self.archive = archive
+        self.tracer = Tracer() if tracer is None else tracer
 
+    async def exec(self) -> List[ChannelResult]:
+        results = await self.run_channels(self.channels)
+        if all(result.error for result in results):
+            # nothing went through, host should see failed invocation
+            raise RuntimeError(f"All channels failed: {'; '.join(result.error for result in results)}")
+        return results
+
+    async def run_channels(self, channels: List[str]) -> List[ChannelResult]:
+        # channels share one deadline, every call made by them gets what is left of it
+        with self.tracer.invocation("worker.exec", channels=len(channels)), \
+                Deadline(self.deadline_seconds).activate():
+            started = time.perf_counter()
+            semaphore = asyncio.Semaphore(self.channel_concurrency)
+            checkpoints, posts = await self.read_channels(channels)
+
+            async def run(channel: str, checkpoint: Union[CheckPoint, None, Exception]) -> ChannelResult:
+                async with semaphore:
+                    channel_started = time.perf_counter()
+                    error = due = None
+                    try:
+                        with self.tracer.span("worker.channel", channel=channel or "default"):
+                            if isinstance(checkpoint, Exception):
+                                raise checkpoint
+                            due = await self.process_channel(channel, checkpoint, posts)
+                    except Exception as e:
+                        # one broken channel doesn't stop the others
+                        logger.exception(f"Channel {channel or 'default'} failed")
+                        error = repr(e)
+                    return ChannelResult(channel=channel, seconds=time.perf_counter() - channel_started,
+                                         error=error, due=due)
+
+            results = await asyncio.gather(*[run(channel, checkpoint)
+                                             for channel, checkpoint in zip(channels, checkpoints)])
+            logger.info(f"Processed {len(results)} channels in {time.perf_counter() - started:.2f}s: "
+                        + ", ".join(f"{result.channel or 'default'} {result.seconds:.2f}s"
+                                    + (" failed" if result.error else "") for result in results))
+            return results
+
+    @traced("worker.read_channels")
+    async def read_channels(self, channels: List[str]) -> Tuple[List[Union[CheckPoint, None, Exception]],
+                                                                 Dict[int, Union[PublisherPost, Exception]]]:
+        # checkpoint reads are conditional and cheap on warm host, posts of all due channels are looked up in one batch
+        logger.info("Getting checkpoints")
+        checkpoints = await asyncio.gather(*[self.storage.get_checkpoint(channel) for channel in channels],
+                                           return_exceptions=True)
+        post_ids = list({checkpoint.post_id for checkpoint in checkpoints
+                         if isinstance(checkpoint, CheckPoint) and self.is_due(checkpoint)})
+        posts = {}
+        if post_ids:
+            try:
+                posts = await self.publisher.get_posts(post_ids)
+            except Exception as e:
+                # channels look their posts up one by one instead
+                logger.error(f"Batched lookup of posts {post_ids} failed: {e!r}")
+        return checkpoints, posts
+
+    def is_due(self, checkpoint: Optional[CheckPoint]) -> bool:
+        # checkpoints saved before scheduling have no due time and are processed right away
+        return checkpoint is None or checkpoint.due is None or checkpoint.due <= time.time()
+
+    async def process_channel(self, channel: str, checkpoint: Optional[CheckPoint],
+                              posts: Optional[Dict[int, Union[PublisherPost, Exception]]] = None) -> Optional[float]:
+        if not self.is_due(checkpoint):
+            logger.info(f"Channel {channel or 'default'} is not due yet")
+            return checkpoint.due
+
+        post = None if checkpoint is None else (posts or {}).get(checkpoint.post_id)
+        if isinstance(post, Exception):
+            # lookup failed, channel is retried later
+            raise post
+
+        try:
+            if checkpoint is None:
+                saved = await self.start_channel(channel)
+            else:
+                logger.debug(f"Checkpoint: {checkpoint.dict()}")
+                saved = await self.continue_channel(channel, checkpoint, post)
+            # channel without checkpoint starts new story on next run
+            return time.time() if saved is None else saved.due
+        except QuotaExceeded as e:
+            # nothing was posted, next run picks up where this one stopped
+            logger.warning(f"{e}, post deferred until {e.retry_at:.0f}")
+            return e.retry_at
+        except StorageConflict as e:
+            # overlapping run claimed or saved checkpoint first, this one has nothing to do
+            logger.warning(f"{e}, channel {channel or 'default'} is handled by another worker, backing off")
+            return None
+        except DeadlineExceeded as e:
+            # nothing was started that needs finishing, channel is due again right away
+            logger.warning(f"{e}, channel {channel or 'default'} is left for next run")
+            return time.time()
+
+    async def start_channel(self, channel: str) -> Optional[CheckPoint]:
+        if not self.lease_seconds:
+            return await self.start_new_story(channel)
+
+        # there is no checkpoint to claim yet, lease file costs three more round trips, once per story
+        lease = await self.storage.acquire_lease(Storage.checkpoint_name(channel), self.lease_seconds)
+        try:
+            # checkpoint could be created before lease was taken
+            created = await self.storage.get_checkpoint(channel)
+            if created is not None:
+                return created
+            return await self.start_new_story(channel)
+        finally:
+            await self.release_lease(lease, channel)
+
+    async def continue_channel(self, channel: str, checkpoint: CheckPoint,
+                               post: Optional[PublisherPost] = None) -> Optional[CheckPoint]:
+        released = await self.claim_checkpoint(checkpoint, channel) if self.lease_seconds else None
+        try:
+            return await self.continue_story(checkpoint, channel, post)
+        except BaseException as e:
+            if released is not None:
+                if isinstance(e, QuotaExceeded):
+                    released.due = e.retry_at
+                await self.release_checkpoint(released, channel)
+            raise
+
+    async def claim_checkpoint(self, checkpoint: CheckPoint, channel: str = "") -> CheckPoint:
+        # checkpoint is saved over the version that was read with due time pushed past the lease, so other workers
+        # see it as not due. Claim costs one write, conflict means another worker claimed or moved it on first.
+        # Returns the claimed version to put back if channel fails
+        released = checkpoint.copy(deep=True)
+        checkpoint.due = time.time() + self.lease_seconds
+        await self.storage.save_checkpoint(checkpoint, channel)
+        released.etag = checkpoint.etag
+        return released
+
+    async def release_checkpoint(self, released: CheckPoint, channel: str = "") -> None:
+        # claimed checkpoint is put back only if nothing was saved or removed since claim
+        try:
+            with no_deadline():
+                await self.storage.save_checkpoint(released, channel)
+        except StorageConflict:
+            pass
+        except Exception as e:
+            # claim expires by itself
+            logger.warning(f"Failed to release checkpoint of channel {channel or 'default'}: {e!r}")
+
+    async def release_lease(self, lease, channel: str = "") -> None:
+        try:
+            # lease left behind would block the channel until it expires
+            with no_deadline():
+                await self.storage.release_lease(Storage.checkpoint_name(channel), lease)
+        except StorageConflict:
+            logger.warning("Checkpoint lease expired and was taken by another worker")
+
+    def has_budget(self, seconds: float) -> bool:
+        deadline = current_deadline.get()
+        return deadline is None or deadline.remaining() >= seconds
+
+    def ensure_budget(self, seconds: float, action: str) -> None:
+        if not self.has_budget(seconds):
+            raise DeadlineExceeded(action, current_deadline.get().remaining())
+
+    async def run_bounded(self, awaitable: Awaitable, action: str):
+        # optional work must leave time for publishing and saving checkpoint after it
+        deadline = current_deadline.get()
+        if deadline is None:
+            return await awaitable
+        return await deadline.run(awaitable, action, reserve=self.critical_seconds)
+
+    @traced("worker.publish")
     async def publish_new_post(self, story: Story, previous_post: int = -1) -> int:
+        # published post without saved checkpoint is worse than post published on next run
+        self.ensure_budget(self.critical_seconds, "publishing post")
         logging.info(f"Publishing post {story.text}")
         title = "#ai #generated #story #CHOICEISYOURS"
 
@@ -27,36 +216,188 @@ class Worker(SPI):
             title=title,
             poll_option_1_name=story.option_1,
             poll_option_2_name=story.option_2,
-            end=story.end
+            end=story.end,
+            # running story goes first, readers are waiting for continuation
+            priority=0 if previous_post == -1 else 1
         )
         return await self.publisher.push_post(post)
 
-    async def start_new_story(self) -> None:
-        logging.info("Starting new story")
-        manager = await self.text_generator.generate_story()
+    async def publish_opening(self, story: Story, after: Optional[Awaitable] = None) -> int:
+        if after is not None:
+            # opening of the next story must not appear before ending of the previous one
+            await after
+        return await self.publish_new_post(story)
 
-        post_id = await self.publish_new_post(manager.active_story)
+    @traced("worker.start_new_story")
+    async def start_new_story(self, channel: str = "", after: Optional[Awaitable] = None,
+                              replaces: Optional[CheckPoint] = None) -> CheckPoint:
+        # cached responses of this story are consumed only with its own checkpoint, other channels keep theirs
+        with self.text_generator.reservation():
+            logging.info("Starting new story")
+            manager = await self.storage.pop_pooled_story()
+            if manager is None:
+                logging.info("Story pool is empty, generating story")
+                manager, post_id = await self.generate_and_publish_story(after)
+            else:
+                try:
+                    post_id = await self.publish_opening(manager.active_story, after)
+                except Exception:
+                    with no_deadline():
+                        await self.storage.push_pooled_story(manager)
+                    raise
 
-        checkpoint = CheckPoint(
-            post_id=post_id,
-            story_manager=manager
-        )
+            checkpoint = CheckPoint(
+                post_id=post_id,
+                story_manager=manager,
+                due=self.poll_due(),
+                # finished story checkpoint is overwritten in place
+                etag=None if replaces is None else replaces.etag
+            )
+
+            # post is out, checkpoint is saved even past deadline
+            with no_deadline():
+                await self.storage.save_checkpoint(checkpoint, channel)
+                await self.text_generator.commit()
+            return checkpoint
 
-        await self.storage.save_checkpoint(checkpoint)
+    def poll_due(self) -> float:
+        return time.time() + self.poll_duration * 60 + self.grace_seconds
 
-    async def continue_story(self, checkpoint: CheckPoint) -> None:
+    @traced("worker.generate_story")
+    async def generate_and_publish_story(self, after: Optional[Awaitable] = None) -> Tuple[StoryManager, int]:
+        publishing: List[asyncio.Future] = []
+
+        def on_active_story(story: Story) -> None:
+            # first post goes out while rest of the story is still generated
+            logging.info("Beginning of the story is ready, publishing")
+            publishing.append(asyncio.ensure_future(self.publish_opening(story, after)))
+
+        try:
+            manager = await self.run_bounded(self.text_generator.generate_story_streaming(on_active_story),
+                                             "story generation")
+        except Exception:
+            if publishing:
+                published = await asyncio.gather(*publishing, return_exceptions=True)
+                if not isinstance(published[0], BaseException):
+                    await self.delete_orphaned_post(published[0])
+            raise
+
+        try:
+            post_id = await publishing[0]
+        except Exception:
+            # generated story is kept in the pool instead of being thrown away
+            with no_deadline():
+                await self.storage.push_pooled_story(manager)
+                await self.text_generator.commit()
+            raise
+
+        return manager, post_id
+
+    async def delete_orphaned_post(self, post_id: int) -> None:
+        # opening without the rest of the story can't be continued, it is removed so readers don't vote on it
+        logging.error(f"Beginning of the story was published as post {post_id}, but story generation failed")
+        try:
+            with no_deadline():
+                await self.publisher.delete_post(post_id)
+            logging.info(f"Orphaned post {post_id} deleted")
+        except Exception as e:
+            logging.error(f"Failed to delete orphaned post {post_id}, it has to be removed by hand: {e!r}")
+
+    @traced("worker.continue_story")
+    async def continue_story(self, checkpoint: CheckPoint, channel: str = "",
+                             post: Optional[PublisherPost] = None) -> Optional[CheckPoint]:
         logging.info("Continue story")
-        post = await self.publisher.get_post(checkpoint.post_id)
+        if post is None:
+            post = await self.publisher.get_post(checkpoint.post_id)
+        checkpoint.path.append(StoryStep(
+            tag=checkpoint.story_manager.active_story.tag,
+            post_id=checkpoint.post_id,
+            poll_option_1_votes=post.poll_option_1_votes,
+            poll_option_2_votes=post.poll_option_2_votes
+        ))
 
         story_option = "1" if post.poll_option_1_votes > post.poll_option_2_votes else "2"
         next_story = checkpoint.story_manager[f"{checkpoint.story_manager.active_story.tag}-{story_option}"]
 
+        if next_story.end:
+            return await self.finish_story(checkpoint, next_story, post.post_id, channel)
+
         post_id = await self.publish_new_post(next_story, post.post_id)
 
         checkpoint.story_manager.active_story = next_story
         checkpoint.post_id = post_id
+        checkpoint.due = self.poll_due()
 
-        if next_story.end:
-            await self.storage.remove_checkpoint()
-        else:
-            await self.storage.save_checkpoint(checkpoint)
+        with no_deadline():
+            await self.storage.save_checkpoint(checkpoint, channel)
+        return checkpoint
+
+    @traced("worker.finish_story")
+    async def finish_story(self, checkpoint: CheckPoint, ending: Story, previous_post: int,
+                           channel: str = "") -> Optional[CheckPoint]:
+        # finished story is archived while ending is published
+        # next story needs its own publish and checkpoint save, it waits for next run when there is no time
+        pipeline = self.pipeline and self.has_budget(2 * self.critical_seconds)
+        if self.pipeline and not pipeline:
+            logging.info("Not enough time left to start next story with the ending")
+        publishing = asyncio.ensure_future(self.publish_new_post(ending, previous_post))
+        if not pipeline:
+            await asyncio.gather(publishing, self.archive_story(checkpoint, ending))
+            with no_deadline():
+                await self.storage.remove_checkpoint(checkpoint, channel)
+            return None
+
+        # next story is taken from pool or generated meanwhile, its opening goes out right after the ending
+        # and its checkpoint replaces finished one
+        results = await asyncio.gather(publishing, self.archive_story(checkpoint, ending),
+                                       self.start_new_story(channel, after=publishing, replaces=checkpoint),
+                                       return_exceptions=True)
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        if isinstance(results[2], BaseException):
+            # ending is out, finished story must not be continued again
+            logging.error(f"Ending was published, but next story could not start: {results[2]!r}")
+            with no_deadline():
+                await self.storage.remove_checkpoint(checkpoint, channel)
+            raise results[2]
+        return results[2]
+
+    @traced("worker.archive_story")
+    async def archive_story(self, checkpoint: CheckPoint, ending: Story) -> None:
+        if self.archive is None or not checkpoint.path:
+            return
+        story = ArchivedStory(
+            story_id=checkpoint.path[0].post_id,
+            finished=datetime.now(tz=timezone.utc),
+            story_manager=checkpoint.story_manager,
+            path=checkpoint.path,
+            ending=ending.tag
+        )
+        try:
+            await self.run_bounded(self.archive.add(story), "archiving story")
+        except Exception as e:
+            # lost archive record must not stop ending from being published and checkpoint removed
+            logging.error(f"Failed to archive story {story.story_id}: {e!r}")
+
+    async def refill_story_pool(self) -> int:
+        with self.tracer.invocation("worker.refill_story_pool"):
+            pool = await self.storage.get_story_pool()
+            if len(pool.stories) > self.pool_low_water_mark:
+                logging.info(f"Story pool has {len(pool.stories)} stories, no refill needed")
+                return 0
+
+            missing = self.pool_size - len(pool.stories)
+            logging.info(f"Refilling story pool with {missing} stories")
+
+            managers = []
+            async for result in self.text_generator.generate_stories(missing, concurrency=self.pool_refill_concurrency):
+                if result.story_manager is not None:
+                    managers.append(result.story_manager)
+
+            if not managers:
+                return 0
+
+            await self.storage.extend_story_pool(managers)
+            await self.text_generator.commit()
+
+            return len(managers)
@@ -0,0 +1,62 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from src.api.config import STORY_CHANNELS, SCHEDULER_RETRY_SECONDS
+from src.implementation.worker.azure import Worker
+
+logger = logging.getLogger()
+
+
+# Keeps channels in min-heap by time their poll closes, so daemon sleeps until the earliest one instead of polling
+# every channel on fixed interval. Due times come from checkpoints, channels without one are processed right away.
+class Scheduler:
+    def __init__(self, worker: Worker, channels: Optional[List[str]] = None,
+                 retry_seconds: float = SCHEDULER_RETRY_SECONDS):
+        self.worker = worker
+        self.retry_seconds = retry_seconds
+        now = time.time()
+        self.queue: List[Tuple[float, str]] = [(now, channel) for channel in (channels or STORY_CHANNELS)]
+        heapq.heapify(self.queue)
+        self.stopped = asyncio.Event()
+        self.runs = 0
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def pop_due(self) -> List[str]:
+        now = time.time()
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            due.append(heapq.heappop(self.queue)[1])
+        return due
+
+    async def wait(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self.stopped.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_once(self) -> None:
+        channels = self.pop_due()
+        if not channels:
+            return
+
+        results = await self.worker.run_channels(channels)
+        self.runs += 1
+        now = time.time()
+        for result in results:
+            # failed channel or channel leased by another worker is retried later
+            due = result.due if result.due is not None else now + self.retry_seconds
+            heapq.heappush(self.queue, (due, result.channel))
+            logger.info(f"Channel {result.channel or 'default'} is due in {due - now:.0f}s")
+
+    async def run(self) -> None:
+        while not self.stopped.is_set():
+            await self.run_once()
+            if self.queue:
+                await self.wait(self.queue[0][0] - time.time())
+            else:
+                await self.stopped.wait()
@@ -1,16 +1,36 @@
+import argparse
 import asyncio
 import logging
+import signal
 
-from implementation.publisher.twitter import Publisher
-from implementation.text_generator.openai import TextGenerator
-from implementation.worker.azure import Worker
-from src.implementation.storage.azure import Storage
+from src.implementation.container import Container
+from src.implementation.worker.scheduler import Scheduler
 
 logging.basicConfig(level=logging.DEBUG)
 
+
+async def main(daemon: bool = False):
+    container = Container()
+    try:
+        worker = container.create_worker()
+        if not daemon:
+            await worker.exec()
+            return
+
+        scheduler = Scheduler(worker)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, scheduler.stop)
+        await scheduler.run()
+    finally:
+        await container.close()
+
+
 if __name__ == "__main__":
-    worker = Worker(text_generator=TextGenerator(), publisher=Publisher(), storage=Storage())
+    parser = argparse.ArgumentParser(description="Run story worker locally")
+    parser.add_argument("--daemon", action="store_true", help="keep running and process channels when polls close")
+    args = parser.parse_args()
 
-    asyncio.get_event_loop().run_until_complete(worker.exec())
+    asyncio.get_event_loop().run_until_complete(main(args.daemon))
 
     print("Done")
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+from src.api.models import ArchivedStory, Story, StoryManager, StoryStep
+from src.implementation.storage.archive import StoryArchive
+from src.implementation.storage.filesystem import Storage as FileSystemStorage
+from src.implementation.storage.memory import Storage as MemoryStorage
+
+
+@pytest.fixture(params=["filesystem", "memory"])
+def storage(request, tmp_path):
+    if request.param == "filesystem":
+        return FileSystemStorage(str(tmp_path))
+    return MemoryStorage()
+
+
+def make_story(story_id: int, finished: datetime) -> ArchivedStory:
+    stories = [Story(tag="story", text=f"Story {story_id}", option_1="1", option_2="2"),
+               Story(tag="story-1", text="Ending", end=True)]
+    return ArchivedStory(
+        story_id=story_id,
+        finished=finished,
+        story_manager=StoryManager(stories=stories, active_story=stories[1]),
+        path=[StoryStep(tag="story", post_id=story_id, poll_option_1_votes=3, poll_option_2_votes=1)],
+        ending="story-1"
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_and_get(storage):
+    archive = StoryArchive(storage)
+    october = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    november = datetime(2026, 11, 1, tzinfo=timezone.utc)
+
+    await archive.add(make_story(1, october))
+    await archive.add(make_story(2, october))
+    await archive.add(make_story(3, november))
+
+    assert await archive.get(2) == make_story(2, october)
+    assert await archive.get(3) == make_story(3, november)
+    assert await archive.get(4) is None
+    assert await archive.find(october, november) == [1, 2]
+    assert await storage.file_exists("archive/2026-10.jsonl")
+    assert await storage.file_exists("archive/2026-11.jsonl")
+
+
+@pytest.mark.asyncio
+async def test_get_reads_one_range(storage):
+    archive = StoryArchive(storage)
+    finished = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    for story_id in range(5):
+        await archive.add(make_story(story_id, finished))
+
+    storage.get_file_range = mock.AsyncMock(wraps=storage.get_file_range)
+    story = await archive.get(3)
+
+    assert story.story_id == 3
+    shard, offset, length = storage.get_file_range.await_args.args
+    assert shard == "archive/2026-10.jsonl" and offset > 0 and length < 1000
+
+
+@pytest.mark.asyncio
+async def test_concurrent_adds_are_batched(storage):
+    archive = StoryArchive(storage)
+    finished = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    storage.append_file = mock.AsyncMock(wraps=storage.append_file)
+
+    await asyncio.gather(*[archive.add(make_story(story_id, finished)) for story_id in range(5)])
+
+    assert storage.append_file.await_count == 2
+    assert await archive.find(finished, datetime(2026, 11, 1, tzinfo=timezone.utc)) == list(range(5))
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_add(storage):
+    archive = StoryArchive(storage)
+    finished = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    storage.append_file = mock.AsyncMock(side_effect=[0, OSError("append failed")])
+
+    results = await asyncio.gather(*[archive.add(make_story(story_id, finished)) for story_id in range(3)],
+                                   return_exceptions=True)
+
+    # first story goes alone, the other two are batched by one caller and both see the failure
+    assert results[0] is None
+    assert all(isinstance(result, OSError) for result in results[1:])
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_is_written_by_next_add(storage):
+    archive = StoryArchive(storage)
+    finished = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    append = storage.append_file
+    calls = []
+    blocked = asyncio.Event()
+
+    async def append_file(file_path, file):
+        calls.append(file_path)
+        if len(calls) == 2:
+            # second batch hangs until its writer is cancelled
+            blocked.set()
+            await asyncio.sleep(10)
+        return await append(file_path, file)
+
+    storage.append_file = append_file
+    adds = [asyncio.ensure_future(archive.add(make_story(story_id, finished))) for story_id in range(3)]
+    await blocked.wait()
+    adds[1].cancel()
+
+    results = await asyncio.gather(*adds, return_exceptions=True)
+
+    # story of the cancelled writer is dropped, story it batched is written by its own caller
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert await archive.find(finished, datetime(2026, 11, 1, tzinfo=timezone.utc)) == [0, 2]
+
+
+@pytest.mark.asyncio
+async def test_index_update_retries_on_conflict():
+    storage = MemoryStorage()
+    first = StoryArchive(storage)
+    second = StoryArchive(storage)
+    finished = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    await first.add(make_story(1, finished))
+
+    upload = storage.upload_file_if_match
+
+    async def upload_after_other_archive(file_path, file, etag):
+        # other worker updates index between read and write
+        storage.upload_file_if_match = upload
+        await second.add(make_story(2, finished))
+        return await upload(file_path, file, etag)
+
+    storage.upload_file_if_match = upload_after_other_archive
+    await first.add(make_story(3, finished))
+
+    assert await first.find(finished, datetime(2026, 11, 1, tzinfo=timezone.utc)) == [1, 2, 3]
@@ -0,0 +1,258 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from src.abstract.storage import Storage
+from src.implementation.text_generator.cache import DiskResponseCache, ResponseCache, StorageResponseCache
+from src.implementation.text_generator.openai import TextGenerator
+
+
+class DictStorage(Storage):
+    def __init__(self):
+        super(DictStorage, self).__init__()
+        self.files = {}
+
+    async def file_exists(self, file_path: str) -> bool:
+        return file_path in self.files
+
+    async def delete_file(self, file_path: str) -> bool:
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        del self.files[file_path]
+        return True
+
+    async def get_file(self, file_path: str) -> bytes:
+        if file_path not in self.files:
+            raise FileNotFoundError(file_path)
+        return self.files[file_path]
+
+    async def upload_file(self, file_path: str, file: bytes, rewrite: bool = True) -> bool:
+        self.files[file_path] = file
+        return True
+
+
+@pytest.fixture(params=["disk", "storage"])
+def cache(request, tmp_path):
+    if request.param == "disk":
+        return DiskResponseCache(str(tmp_path), ttl=60, max_size=1024)
+    return StorageResponseCache(DictStorage(), "cache", ttl=60, max_size=1024)
+
+
+@pytest.mark.asyncio
+async def test_get_and_add(cache):
+    key = ResponseCache.key("model", "system", "promt")
+
+    assert await cache.get(key) is None
+    first = await cache.add(key, "first")
+    second = await cache.add(key, "second")
+
+    assert await cache.get(key) == (first, "first")
+    assert await cache.get(key, exclude={first}) == (second, "second")
+    assert await cache.get(key, exclude={first, second}) is None
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_discard(cache):
+    key = ResponseCache.key("promt")
+    first = await cache.add(key, "first")
+    second = await cache.add(key, "second")
+
+    await cache.discard(key, [second])
+
+    assert await cache.get(key) == (first, "first")
+    await cache.discard(key, [first])
+    assert await cache.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_ttl(cache):
+    key = ResponseCache.key("promt")
+    await cache.add(key, "story")
+
+    with mock.patch("src.implementation.text_generator.cache.time.time", return_value=10 ** 12):
+        assert await cache.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction(cache):
+    keys = [ResponseCache.key(str(number)) for number in range(3)]
+    await cache.add(keys[0], "a" * 400)
+    await cache.add(keys[1], "b" * 400)
+    await cache.get(keys[0])
+
+    await cache.add(keys[2], "c" * 400)
+
+    assert await cache.get(keys[1]) is None
+    assert (await cache.get(keys[0]))[1] == "a" * 400
+    assert (await cache.get(keys[2]))[1] == "c" * 400
+    assert cache.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_index_is_persisted(tmp_path):
+    key = ResponseCache.key("promt")
+    await DiskResponseCache(str(tmp_path), ttl=60, max_size=1024).add(key, "story")
+
+    assert (await DiskResponseCache(str(tmp_path), ttl=60, max_size=1024).get(key))[1] == "story"
+
+
+@pytest.mark.asyncio
+async def test_get_does_not_write_index(cache):
+    key = ResponseCache.key("promt")
+    await cache.add(key, "story")
+    cache.write_if_match = mock.AsyncMock()
+    cache.write = mock.AsyncMock()
+
+    assert (await cache.get(key))[1] == "story"
+
+    cache.write_if_match.assert_not_called()
+    cache.write.assert_not_called()
+    assert key in cache.accessed
+
+
+@pytest.mark.asyncio
+async def test_access_times_are_flushed(tmp_path):
+    key = ResponseCache.key("promt")
+    cache = DiskResponseCache(str(tmp_path), ttl=10 ** 10, max_size=1024)
+    await cache.add(key, "story")
+    with mock.patch("src.implementation.text_generator.cache.time.time", return_value=10 ** 10):
+        await cache.get(key)
+
+    await cache.flush()
+
+    other = DiskResponseCache(str(tmp_path), ttl=10 ** 10, max_size=1024)
+    await other.update_index(lambda index: None)
+    assert other.index[key]["accessed"] == 10 ** 10
+    assert not cache.accessed
+
+
+@pytest.mark.asyncio
+async def test_index_is_shared_between_processes(tmp_path):
+    caches = [DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024) for _ in range(4)]
+    for cache in caches[1:]:
+        # filesystem compare-and-swap is atomic within one lock, separate processes are simulated by sharing it
+        cache.storage.lock = caches[0].storage.lock
+    keys = [ResponseCache.key(str(number)) for number in range(8)]
+
+    await asyncio.gather(*[caches[number % 4].add(key, "story") for number, key in enumerate(keys)])
+
+    await caches[0].update_index(lambda index: None)
+    assert sorted(caches[0].index) == sorted(keys)
+
+
+@pytest.mark.asyncio
+async def test_storage_cache_deletes_with_single_call():
+    storage = DictStorage()
+    storage.file_exists = mock.AsyncMock()
+    cache = StorageResponseCache(storage, "cache", ttl=60, max_size=1024)
+
+    await cache.delete("missing.json")
+
+    storage.file_exists.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_text_generator_reuses_cached_response(tmp_path):
+    cache = DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024)
+    response = {"choices": [{"message": {"content": "paid story"}}]}
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(return_value=response)
+
+        # crashed invocation, story was generated but never committed
+        crashed = TextGenerator(cache=cache)
+        assert await crashed.get_gpt_story() == "paid story"
+        await crashed.close()
+
+        text_generator = TextGenerator(cache=cache)
+        assert await text_generator.get_gpt_story() == "paid story"
+        assert chat_completion.acreate.await_count == 1
+
+        # next story of the same invocation must not repeat cached one
+        response["choices"][0]["message"]["content"] = "new story"
+        assert await text_generator.get_gpt_story() == "new story"
+        assert chat_completion.acreate.await_count == 2
+
+        await text_generator.commit()
+        assert await cache.get(text_generator.cache_key()) is None
+
+    await text_generator.close()
+
+
+@pytest.mark.asyncio
+async def test_text_generator_commits_only_its_own_generation(tmp_path):
+    cache = DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024)
+    text_generator = TextGenerator(cache=cache)
+    key = text_generator.cache_key()
+    await cache.add(key, "story a")
+    await cache.add(key, "story b")
+    saved = asyncio.Event()
+
+    async def channel(name):
+        with text_generator.reservation():
+            story = await text_generator.get_gpt_story()
+            if name == "a":
+                await text_generator.commit()
+                saved.set()
+            else:
+                # channel b is still publishing when channel a saves its checkpoint
+                await saved.wait()
+            return story
+
+    assert sorted(await asyncio.gather(channel("a"), channel("b"))) == ["story a", "story b"]
+
+    # response of channel b, which never committed, is left for reuse after crash
+    remaining = await cache.get(key)
+    assert remaining is not None and remaining[1] in ("story a", "story b")
+    assert await cache.get(key, exclude={remaining[0]}) is None
+
+
+@pytest.mark.asyncio
+async def test_text_generator_releases_failed_generation(tmp_path):
+    cache = DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024)
+    text_generator = TextGenerator(cache=cache)
+    await cache.add(text_generator.cache_key(), "cached story")
+
+    with pytest.raises(ValueError):
+        with text_generator.reservation():
+            assert await text_generator.get_gpt_story() == "cached story"
+            raise ValueError("publish failed")
+
+    # warm host reuses response of failed generation instead of paying for new one
+    with text_generator.reservation():
+        assert await text_generator.get_gpt_story() == "cached story"
+        await text_generator.commit()
+    assert await cache.get(text_generator.cache_key()) is None
+
+
+@pytest.mark.asyncio
+async def test_text_generator_keeps_cache_without_consume(tmp_path):
+    cache = DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024)
+    text_generator = TextGenerator(cache=cache, consume_cache=False)
+    await cache.add(text_generator.cache_key(), "cached story")
+
+    assert await text_generator.get_gpt_story() == "cached story"
+    await text_generator.commit()
+
+    assert await text_generator.get_gpt_story() == "cached story"
+
+
+@pytest.mark.asyncio
+async def test_text_generator_streams_cached_response(tmp_path):
+    cache = DiskResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024)
+    text_generator = TextGenerator(cache=cache)
+
+    async def response():
+        yield {"choices": [{"delta": {"content": "Once "}}]}
+        yield {"choices": [{"delta": {"content": "upon"}}]}
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(return_value=response())
+        assert [chunk async for chunk in text_generator.stream_gpt_story()] == ["Once ", "upon"]
+    await text_generator.close()
+
+    text_generator = TextGenerator(cache=cache)
+    assert [chunk async for chunk in text_generator.stream_gpt_story()] == ["Once upon"]
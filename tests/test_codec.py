@@ -0,0 +1,72 @@
+import pytest
+
+from src.api import codec
+from src.api.codec import decode_checkpoint, encode_checkpoint
+from src.api.models import CheckPoint, Story, StoryManager, StoryStep
+
+
+@pytest.fixture
+def checkpoint():
+    stories = [
+        Story(tag="story", text="Story begins", option_1="Left", option_2="Right"),
+        Story(tag="story-1", text="Ünïcode continuation", option_1="Up", option_2="Down"),
+        Story(tag="story-1-1", text="", end=True),
+        Story(tag="story-1-2", text="Second ending", end=True),
+    ]
+    path = [StoryStep(tag="story", post_id=1666000000000000000, poll_option_1_votes=300, poll_option_2_votes=2)]
+    return CheckPoint(post_id=1667000000000000000, story_manager=StoryManager(stories=stories, active_story=stories[1]),
+                      path=path, due=1760000000.5)
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+@pytest.mark.parametrize("compression", ["", "gzip"])
+def test_round_trip(checkpoint, format, compression):
+    data = encode_checkpoint(checkpoint, format, compression)
+
+    assert decode_checkpoint(data) == checkpoint
+
+
+def test_active_story_is_stored_once(checkpoint):
+    data = encode_checkpoint(checkpoint, "binary", "")
+
+    assert data.count("Ünïcode continuation".encode("utf-8")) == 1
+    assert len(data) < len(checkpoint.json()) / 2
+
+
+def test_active_story_outside_stories(checkpoint):
+    checkpoint.story_manager.active_story = Story(tag="other", text="Not in stories", option_1=None, option_2=None)
+
+    for format in ["json", "binary"]:
+        assert decode_checkpoint(encode_checkpoint(checkpoint, format, "gzip")) == checkpoint
+
+
+def test_reads_legacy_json(checkpoint):
+    assert decode_checkpoint(checkpoint.json().encode("utf-8")) == checkpoint
+
+
+def test_zstd_falls_back_to_gzip(checkpoint, monkeypatch):
+    monkeypatch.setattr(codec, "zstandard", None)
+
+    data = encode_checkpoint(checkpoint, "binary", "zstd")
+
+    assert data[len(codec.MAGIC) + 2] == codec.COMPRESSIONS["gzip"]
+    assert decode_checkpoint(data) == checkpoint
+
+
+def test_unknown_version(checkpoint):
+    data = bytearray(encode_checkpoint(checkpoint))
+    data[len(codec.MAGIC)] = 99
+
+    with pytest.raises(ValueError):
+        decode_checkpoint(bytes(data))
+
+
+def test_reads_version_1(checkpoint):
+    checkpoint.path = []
+    checkpoint.due = None
+    data = bytearray(encode_checkpoint(checkpoint, "binary", ""))
+    data[len(codec.MAGIC)] = 1
+    # version 1 payload has no path count and due flag at the end
+    data = bytes(data[:-2])
+
+    assert decode_checkpoint(data) == checkpoint
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+from azure.core.credentials import AccessToken
+
+from src.implementation.container import Container
+from src.implementation.storage.credential import CachedTokenCredential
+from src.implementation.storage.memory import Storage as MemoryStorage
+
+
+@pytest.fixture
+def container(monkeypatch):
+    monkeypatch.setattr("src.implementation.container.create_storage", MemoryStorage)
+    return Container()
+
+
+@pytest.mark.asyncio
+async def test_components_are_built_once(container):
+    first = container.create_worker()
+    second = container.create_worker()
+
+    assert first is not second
+    assert first.storage is second.storage
+    assert first.publisher is second.publisher
+    assert first.text_generator is second.text_generator
+    assert first.archive.storage is first.storage
+    assert first.tracer is second.tracer
+    assert container.stats()["invocations"] == 2
+
+    await container.close()
+
+
+@pytest.mark.asyncio
+async def test_close(container):
+    worker = container.create_worker()
+    worker.publisher.get_session()
+    worker.text_generator.get_session()
+
+    await container.close()
+
+    assert worker.publisher.session is None
+    assert worker.text_generator.session is None
+    assert container.storage is None
+
+
+def test_close_at_exit(container):
+    loop = asyncio.new_event_loop()
+
+    async def invocation():
+        container.create_worker().publisher.get_session()
+
+    loop.run_until_complete(invocation())
+    publisher = container.publisher
+
+    container.close_at_exit()
+
+    assert publisher.session is None
+    loop.close()
+
+
+@pytest.mark.asyncio
+async def test_token_is_cached_until_expiry():
+    credential = mock.MagicMock()
+    credential.get_token = mock.AsyncMock(side_effect=[
+        AccessToken("first", int(time.time()) + 3600),
+        AccessToken("second", int(time.time()) + 3600),
+    ])
+    cached = CachedTokenCredential(credential, refresh_margin=300)
+
+    tokens = await asyncio.gather(*[cached.get_token("https://storage.azure.com/.default") for _ in range(5)])
+
+    assert [token.token for token in tokens] == ["first"] * 5
+    assert (cached.fetches, cached.hits) == (1, 4)
+
+    cached.refresh_margin = 3600
+    assert (await cached.get_token("https://storage.azure.com/.default")).token == "second"
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from src.api.exceptions import DeadlineExceeded
+from src.implementation.deadline import Deadline, bounded, no_deadline, remaining
+
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.get_event_loop()
+    yield loop
+    loop.close()
+
+
+class Client:
+    def __init__(self):
+        self.cancelled = False
+
+    @bounded("client.call")
+    async def call(self, seconds: float = 0):
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return remaining()
+
+
+@pytest.mark.asyncio
+async def test_call_gets_remaining_budget():
+    with Deadline(10).activate():
+        left = await Client().call()
+
+    assert 9 < left <= 10
+    assert remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_hung_call_is_cancelled():
+    client = Client()
+
+    with Deadline(0.05).activate():
+        with pytest.raises(DeadlineExceeded):
+            await client.call(10)
+
+    assert client.cancelled
+
+
+@pytest.mark.asyncio
+async def test_call_is_refused_when_deadline_passed():
+    deadline = Deadline(0)
+
+    with deadline.activate():
+        with pytest.raises(DeadlineExceeded):
+            await Client().call()
+
+
+@pytest.mark.asyncio
+async def test_reserve_is_left_for_later_work():
+    deadline = Deadline(0.2)
+
+    with pytest.raises(DeadlineExceeded):
+        await deadline.run(asyncio.sleep(1), "generation", reserve=0.15)
+
+    assert deadline.remaining() > 0.1
+
+
+@pytest.mark.asyncio
+async def test_own_timeout_of_call_is_not_deadline():
+    async def call():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError) as e:
+        await Deadline(10).run(call(), "call")
+
+    assert not isinstance(e.value, DeadlineExceeded)
+
+
+@pytest.mark.asyncio
+async def test_no_deadline():
+    with Deadline(0).activate():
+        with no_deadline():
+            assert await Client().call() is None
@@ -0,0 +1,165 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from src.api.models import OpenAIEndpoint
+from src.implementation.text_generator.hedging import Hedger, LatencyHistogram
+from src.implementation.text_generator.openai import TextGenerator
+
+PRIMARY = OpenAIEndpoint(name="openai", api_type="open_ai", api_key="key", model="gpt-3.5-turbo")
+SECONDARY = OpenAIEndpoint(name="azure", api_type="azure", api_base="https://azure", api_key="azure-key",
+                           api_version="2023-05-15", deployment="stories")
+
+
+def stream_factory(delays: dict, errors: dict = None, cancelled: list = None):
+    async def open_stream(endpoint):
+        async def chunks():
+            try:
+                await asyncio.sleep(delays[endpoint.name])
+                if errors and endpoint.name in errors:
+                    raise errors[endpoint.name]
+                yield f"{endpoint.name} "
+                yield "story"
+            except asyncio.CancelledError:
+                cancelled.append(endpoint.name)
+                raise
+        return chunks()
+    return open_stream
+
+
+def test_latency_histogram_percentile():
+    histogram = LatencyHistogram(min_samples=10)
+    for _ in range(9):
+        histogram.observe(1)
+    assert histogram.percentile(0.95) is None
+
+    histogram.observe(30)
+    assert 1 <= histogram.percentile(0.5) < 1.3
+    assert 30 <= histogram.percentile(0.95) < 38
+
+
+@pytest.mark.asyncio
+async def test_primary_wins_without_hedge():
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=0.05)
+    open_stream = mock.AsyncMock(side_effect=stream_factory({"openai": 0, "azure": 0}))
+
+    chunks = [chunk async for chunk in hedger.stream(open_stream)]
+
+    assert chunks == ["openai ", "story"]
+    open_stream.assert_awaited_once_with(PRIMARY)
+    assert hedger.hedged == 0
+    assert hedger.histograms["openai"].count == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    cancelled = []
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=0.01)
+
+    chunks = [chunk async for chunk in hedger.stream(stream_factory({"openai": 1, "azure": 0}, cancelled=cancelled))]
+    await asyncio.sleep(0)
+
+    assert chunks == ["azure ", "story"]
+    assert cancelled == ["openai"]
+    assert hedger.hedged == 1
+    assert hedger.wins == {"openai": 0, "azure": 1}
+    # cancelled request still counts, at least as slow as the threshold it missed
+    assert hedger.histograms["openai"].count == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_primary_is_hedged_immediately():
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+    open_stream = stream_factory({"openai": 0, "azure": 0}, errors={"openai": ValueError("overloaded")})
+
+    chunks = [chunk async for chunk in hedger.stream(open_stream)]
+
+    assert chunks == ["azure ", "story"]
+
+
+@pytest.mark.asyncio
+async def test_all_endpoints_fail():
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+    open_stream = stream_factory({"openai": 0, "azure": 0},
+                                 errors={"openai": ValueError("overloaded"), "azure": ValueError("down")})
+
+    with pytest.raises(ValueError):
+        [chunk async for chunk in hedger.stream(open_stream)]
+
+
+@pytest.mark.asyncio
+async def test_complete_hedges_stream_broken_after_first_token():
+    async def open_stream(endpoint):
+        async def chunks():
+            yield f"{endpoint.name} "
+            if endpoint.name == "openai":
+                raise ValueError("connection reset")
+            yield "story"
+        return chunks()
+
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+
+    assert await hedger.complete(open_stream) == "azure story"
+    assert hedger.wins == {"openai": 1, "azure": 1}
+
+
+@pytest.mark.asyncio
+async def test_complete_fails_when_last_endpoint_breaks():
+    async def open_stream(endpoint):
+        async def chunks():
+            yield "story"
+            raise ValueError("connection reset")
+        return chunks()
+
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+
+    with pytest.raises(ValueError):
+        await hedger.complete(open_stream)
+
+
+def test_cancelled_requests_push_threshold_up():
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+    for _ in range(20):
+        hedger.histograms["openai"].observe(2)
+
+    # hedged requests that never answered are recorded at threshold, tail grows instead of staying put
+    for _ in range(5):
+        hedger.histograms["openai"].observe(max(0.5, hedger.threshold(PRIMARY)))
+
+    assert hedger.threshold(PRIMARY) >= 2
+
+
+def test_threshold_follows_observed_latency():
+    hedger = Hedger([PRIMARY, SECONDARY], default_delay=10)
+    assert hedger.threshold(PRIMARY) == 10
+
+    for _ in range(20):
+        hedger.histograms["openai"].observe(2)
+
+    assert 2 <= hedger.threshold(PRIMARY) < 2.5
+
+
+@pytest.mark.asyncio
+async def test_text_generator_hedges_between_endpoints():
+    text_generator = TextGenerator(endpoints=[PRIMARY, SECONDARY])
+    text_generator.hedger.default_delay = 0.01
+
+    async def acreate(**params):
+        async def chunks():
+            if params["api_type"] == "open_ai":
+                await asyncio.sleep(1)
+            yield {"choices": [{"delta": {"content": "hedged story"}}]}
+        return chunks()
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(side_effect=acreate)
+
+        content = await text_generator.get_gpt_story()
+
+    assert content == "hedged story"
+    azure_call = chat_completion.acreate.await_args_list[1].kwargs
+    assert azure_call["deployment_id"] == "stories"
+    assert azure_call["api_base"] == "https://azure"
+    assert azure_call["stream"] is True
+    await text_generator.close()
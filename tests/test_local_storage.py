@@ -0,0 +1,151 @@
+import asyncio
+import os
+
+import pytest
+
+from src.api.config import CHECKPOINT_NAME
+from src.api.exceptions import StorageConflict
+from src.api.models import CheckPoint, Story, StoryManager
+from src.implementation.storage.filesystem import Storage as FileSystemStorage
+from src.implementation.storage.memory import Storage as MemoryStorage
+
+
+@pytest.fixture(params=["filesystem", "memory"])
+def storage(request, tmp_path):
+    if request.param == "filesystem":
+        return FileSystemStorage(str(tmp_path), fsync=True)
+    return MemoryStorage()
+
+
+def make_checkpoint(post_id: int) -> CheckPoint:
+    return CheckPoint(post_id=post_id, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="Some text")))
+
+
+@pytest.mark.asyncio
+async def test_files(storage):
+    assert not await storage.file_exists("cache/index.json")
+    with pytest.raises(FileNotFoundError):
+        await storage.get_file("cache/index.json")
+
+    await storage.upload_file("cache/index.json", b"first")
+    await storage.upload_file("cache/index.json", b"second")
+
+    assert await storage.file_exists("cache/index.json")
+    assert await storage.get_file("cache/index.json") == b"second"
+
+    await storage.delete_file("cache/index.json")
+    assert not await storage.file_exists("cache/index.json")
+
+
+@pytest.mark.asyncio
+async def test_get_file_if_changed(storage):
+    await storage.upload_file("file.json", b"first")
+    data, etag = await storage.get_file_if_changed("file.json", None)
+    assert data == b"first"
+
+    assert await storage.get_file_if_changed("file.json", etag) == (None, etag)
+
+    await storage.upload_file("file.json", b"second")
+    data, new_etag = await storage.get_file_if_changed("file.json", etag)
+    assert data == b"second" and new_etag != etag
+
+
+@pytest.mark.asyncio
+async def test_compare_and_swap(storage):
+    etag = await storage.upload_file_if_match("file.json", b"first", None)
+    with pytest.raises(StorageConflict):
+        await storage.upload_file_if_match("file.json", b"other", None)
+
+    new_etag = await storage.upload_file_if_match("file.json", b"second", etag)
+    with pytest.raises(StorageConflict):
+        await storage.upload_file_if_match("file.json", b"other", etag)
+    with pytest.raises(StorageConflict):
+        await storage.delete_file_if_match("file.json", etag)
+
+    await storage.delete_file_if_match("file.json", new_etag)
+    assert not await storage.file_exists("file.json")
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_race(storage):
+    await storage.save_checkpoint(make_checkpoint(1))
+
+    first = await storage.get_checkpoint()
+    second = await storage.get_checkpoint()
+    first.post_id = 2
+    await storage.save_checkpoint(first)
+
+    second.post_id = 3
+    with pytest.raises(StorageConflict):
+        await storage.save_checkpoint(second)
+    with pytest.raises(StorageConflict):
+        await storage.save_checkpoint(make_checkpoint(4))
+
+    assert (await storage.get_checkpoint()).post_id == 2
+    assert storage.checkpoint_not_modified == 2
+
+
+@pytest.mark.asyncio
+async def test_lease(storage):
+    lease = await storage.acquire_lease(CHECKPOINT_NAME, 60)
+    with pytest.raises(StorageConflict):
+        await storage.acquire_lease(CHECKPOINT_NAME, 60)
+
+    await storage.release_lease(CHECKPOINT_NAME, lease)
+    await storage.acquire_lease(CHECKPOINT_NAME, 60)
+
+
+@pytest.mark.asyncio
+async def test_filesystem_leaves_no_temporary_files(tmp_path):
+    storage = FileSystemStorage(str(tmp_path))
+
+    await storage.upload_file("file.json", b"data")
+
+    assert os.listdir(tmp_path) == ["file.json"]
+
+
+@pytest.mark.asyncio
+async def test_append_and_range(storage):
+    assert await storage.append_file("archive/shard.jsonl", b"first\n") == 0
+    assert await storage.append_file("archive/shard.jsonl", b"second\n") == 6
+
+    assert await storage.get_file_range("archive/shard.jsonl", 6, 6) == b"second"
+
+
+@pytest.mark.asyncio
+async def test_channels_have_separate_checkpoints(storage):
+    await storage.save_checkpoint(make_checkpoint(1), "fantasy")
+    await storage.save_checkpoint(make_checkpoint(2), "horror")
+
+    assert (await storage.get_checkpoint("fantasy")).post_id == 1
+    assert (await storage.get_checkpoint("horror")).post_id == 2
+    assert await storage.get_checkpoint() is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pops_get_different_stories(storage):
+    managers = [StoryManager(stories=[], active_story=Story(tag="story", text=str(index))) for index in range(3)]
+    await storage.extend_story_pool(managers)
+
+    popped = await asyncio.gather(*[storage.pop_pooled_story() for _ in range(4)])
+
+    assert [manager.active_story.text if manager else None for manager in popped] == ["0", "1", "2", None]
+
+
+@pytest.mark.asyncio
+async def test_pool_is_shared_between_processes(tmp_path):
+    # every storage has its own pool lock like separate hosts, only etag check keeps them apart
+    storages = [FileSystemStorage(str(tmp_path)) for _ in range(4)]
+    for storage in storages:
+        # compare-and-swap of filesystem storage is atomic within one instance only
+        storage.lock = storages[0].lock
+    managers = [StoryManager(stories=[], active_story=Story(tag="story", text=str(index))) for index in range(6)]
+    await storages[0].extend_story_pool(managers[:3])
+
+    results = await asyncio.gather(*[storage.pop_pooled_story() for storage in storages],
+                                   storages[1].extend_story_pool(managers[3:]))
+
+    popped = [manager.active_story.text for manager in results[:4] if manager is not None]
+    left = [manager.active_story.text for manager in (await storages[0].get_story_pool()).stories]
+    assert len(popped) == len(set(popped)) >= 3
+    assert sorted(popped + left) == ["0", "1", "2", "3", "4", "5"]
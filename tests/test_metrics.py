@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from unittest import mock
+
+import pytest
+
+from src.abstract.publisher import Publisher
+from src.abstract.storage import Storage
+from src.abstract.text_generator import TextGenerator
+from src.api.models import Story
+from src.implementation.metrics.sinks import LogMetricsSink, MemoryMetricsSink
+from src.implementation.metrics.tracer import Tracer, current_durations, traced
+from src.implementation.storage.filesystem import Storage as FilesystemStorage
+from src.implementation.storage.memory import Storage as MemoryStorage
+from src.implementation.worker.azure import Worker
+
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.get_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def sink():
+    return MemoryMetricsSink()
+
+
+@pytest.fixture
+def tracer(sink):
+    return Tracer([sink])
+
+
+class Client:
+    @traced("client.call")
+    async def call(self, fail: bool = False):
+        await asyncio.sleep(0)
+        if fail:
+            raise ValueError("broken call")
+        return 1
+
+    @traced("client.stream")
+    async def stream(self):
+        for item in range(3):
+            await self.call()
+            yield item
+
+
+@pytest.mark.asyncio
+async def test_spans_are_nested(tracer, sink):
+    client = Client()
+
+    with tracer.invocation("exec"):
+        with tracer.span("phase", channel="fantasy"):
+            await asyncio.gather(client.call(), client.call())
+        with pytest.raises(ValueError):
+            await client.call(fail=True)
+
+    assert sink.names() == ["client.call", "client.call", "phase", "client.call", "exec"]
+    assert [span.parent for span in sink.spans] == ["phase", "phase", "exec", "exec", None]
+    assert sink.spans[2].tags == {"channel": "fantasy"}
+    assert sink.spans[3].error == "ValueError('broken call')"
+
+
+@pytest.mark.asyncio
+async def test_async_generator_is_timed_as_whole(tracer, sink):
+    client = Client()
+
+    with tracer.invocation("exec"):
+        assert [item async for item in client.stream()] == [0, 1, 2]
+
+    assert sink.names() == ["client.call"] * 3 + ["client.stream", "exec"]
+    assert sink.spans[3].parent == "exec"
+
+
+@pytest.mark.asyncio
+async def test_calls_outside_invocation_are_not_recorded(tracer, sink):
+    assert await Client().call() == 1
+
+    assert sink.spans == []
+    assert current_durations.get() is None
+
+
+@pytest.mark.asyncio
+async def test_invocation_summary(tracer, sink):
+    client = Client()
+
+    with tracer.invocation("exec"):
+        for _ in range(4):
+            await client.call()
+
+    name, summary = sink.summaries[0]
+    assert name == "exec"
+    assert summary["client.call"].count == 4
+    assert summary["client.call"].p50 <= summary["client.call"].p95 <= summary["client.call"].max
+    assert summary["exec"].total >= summary["client.call"].total
+    # next invocation starts with empty histograms
+    assert current_durations.get() is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_invocations_are_summarised_separately(tracer, sink):
+    client = Client()
+
+    async def invoke(name, calls):
+        with tracer.invocation(name):
+            for _ in range(calls):
+                await client.call()
+                await asyncio.sleep(0)
+
+    await asyncio.gather(invoke("exec", 3), invoke("refill", 1))
+
+    summaries = dict(sink.summaries)
+    assert summaries["exec"]["client.call"].count == 3
+    assert summaries["refill"]["client.call"].count == 1
+    assert "exec" not in summaries["refill"]
+
+
+@pytest.mark.asyncio
+async def test_broken_sink_does_not_fail_call(tracer):
+    broken = mock.MagicMock(spec=MemoryMetricsSink)
+    broken.record.side_effect = ValueError("broken sink")
+    broken.summarise.side_effect = ValueError("broken sink")
+    tracer.sinks.append(broken)
+
+    with tracer.invocation("exec"):
+        assert await Client().call() == 1
+
+
+@pytest.mark.asyncio
+async def test_log_sink(caplog):
+    tracer = Tracer([LogMetricsSink()])
+
+    with caplog.at_level(logging.DEBUG, logger="metrics"):
+        with tracer.invocation("exec"):
+            await Client().call()
+
+    spans = [record.span for record in caplog.records if hasattr(record, "span")]
+    assert [span["name"] for span in spans] == ["client.call", "exec"]
+    summary = [record.summary for record in caplog.records if hasattr(record, "summary")][0]
+    assert summary["client.call"]["count"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["filesystem", "memory"])
+async def test_storage_calls_are_traced(tracer, sink, tmp_path, backend):
+    storage = FilesystemStorage(str(tmp_path)) if backend == "filesystem" else MemoryStorage()
+
+    with tracer.invocation("exec"):
+        await storage.upload_file("file.txt", b"data")
+        await storage.get_file("file.txt")
+
+    assert sink.names() == ["storage.upload_file", "storage.get_file", "exec"]
+
+
+@pytest.mark.asyncio
+async def test_worker_exec_is_traced(tracer, sink):
+    worker = Worker(mock.MagicMock(spec=TextGenerator), mock.MagicMock(spec=Publisher), mock.MagicMock(spec=Storage),
+                    tracer=tracer)
+    worker.channels = ["a", "b"]
+
+    async def process_channel(channel, checkpoint, posts):
+        await worker.publish_new_post(Story(tag="story", text="Some text", option_1="1", option_2="2"), 1)
+
+    worker.storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.process_channel = mock.AsyncMock(side_effect=process_channel)
+    worker.publisher.push_post = mock.AsyncMock(return_value=2)
+
+    await worker.exec()
+
+    assert sorted(sink.names()) == ["worker.channel", "worker.channel", "worker.exec", "worker.publish",
+                                    "worker.publish", "worker.read_channels"]
+    assert {span.parent for span in sink.spans if span.name == "worker.publish"} == {"worker.channel"}
+    assert sink.summaries[0][1]["worker.channel"].count == 2
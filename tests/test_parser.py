@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from src.api.exceptions import StoryParseError
+from src.implementation.text_generator.parser import StoryParser, SECTIONS
+
+CONTENT = """
+Here's an example:
+
+    {story-begin}: 
+    You find a wallet on the street. It contains $500. Do you:
+    
+    {option 1}: Turn it into the police
+    
+    {option 2}: Keep the money
+    
+    {story-option 1}: 
+    You turn the wallet into the police station. Later, the owner calls and rewards you with $100. Do you:
+    
+    {option 1}: Accept the reward
+    
+    {option 2}: Refuse the reward
+    
+    {end-option 1}: 
+    You accept the reward and feel good about making an honest decision.
+    
+    {end-option 2}: 
+    You refuse the reward but feel satisfied knowing you did the right thing.
+    
+    {story-option 2}: 
+    You keep the money and feel guilty. Later, you see a homeless person and have an urge to help. Do you:
+    
+    {option 1}: Give the homeless person some money
+    
+    {option 2}: Ignore the homeless person and move on
+    
+    {end-option 1}: 
+    You give the homeless person some money and feel better about yourself.
+    
+    {end-option 2}: 
+    You ignore the homeless person and feel bad about your decision.
+
+I hope you enjoyed this story!
+"""
+
+
+def test_parse():
+    names = StoryParser.parse(CONTENT)
+
+    assert list(names.keys()) == SECTIONS
+    assert names["storybegin"] == "You find a wallet on the street. It contains $500. Do you:"
+    assert names["story1option2"] == "Refuse the reward"
+    assert names["end21"] == "You give the homeless person some money and feel better about yourself."
+    assert names["end22"] == "You ignore the homeless person and feel bad about your decision."
+
+
+def test_parse_reports_missing_sections():
+    content = CONTENT.replace("{end-option 1}: \n    You give", "You give").replace("{option 2}: Keep the money", "")
+
+    with pytest.raises(StoryParseError) as error:
+        StoryParser.parse(content)
+
+    assert error.value.missing == ["option2", "end21"]
+    assert error.value.found["story2"].startswith("You keep the money")
+
+
+def test_parse_allows_empty_ending():
+    content = CONTENT.replace("You accept the reward and feel good about making an honest decision.", "")
+
+    names = StoryParser.parse(content)
+
+    assert names["end11"] == ""
+
+
+def test_feed_chunks():
+    parser = StoryParser()
+    completed = []
+
+    for position in range(0, len(CONTENT), 7):
+        completed.extend(parser.feed(CONTENT[position:position + 7]))
+        if "option2" in completed:
+            assert parser.is_complete("storybegin", "option1", "option2")
+    completed.extend(parser.close())
+
+    assert completed == SECTIONS
+    assert parser.names == StoryParser.parse(CONTENT)
+
+
+def test_parse_adversarial_input_is_linear():
+    content = "{story-begin}:" + " \n" * 200_000 + "{option 1}" * 10_000
+
+    started = time.perf_counter()
+    with pytest.raises(StoryParseError):
+        StoryParser.parse(content)
+
+    assert time.perf_counter() - started < 1
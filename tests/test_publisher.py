@@ -1,8 +1,18 @@
+import asyncio
+import time
 from datetime import datetime
+from email.utils import formatdate
 from unittest import mock
 import pytest
+from aiohttp import ClientConnectorError
 from snscrape.modules.twitter import TwitterTweetScraper, Tweet
+from src.abstract.publisher import gather_posts
+from src.api.config import TWITTER_POOL_SIZE
+from src.api.exceptions import DeadlineExceeded, PublisherError, QuotaExceeded
 from src.api.models import PublisherPost
+from src.implementation.deadline import Deadline
+from src.implementation.publisher.poll import ApiPollBackend, ScraperPollBackend
+from src.implementation.publisher.retry import RetryPolicy
 from src.implementation.publisher.twitter import Publisher
 
 
@@ -38,13 +48,18 @@ class MockAuthClient:
 
 
 class MockResponse:
-    def __init__(self, status, data):
+    def __init__(self, status, data, headers=None):
         self.status = status
         self.data = data
+        self.headers = headers or {}
+        self.reason = "reason"
 
     async def json(self):
         return self.data
 
+    async def text(self):
+        return str(self.data)
+
     async def __aenter__(self):
         return self
 
@@ -57,6 +72,8 @@ class MockResponse:
 
 
 class MockClientSession:
+    closed = False
+
     def __init__(self):
         pass
 
@@ -145,3 +162,376 @@ async def test_push_post(mock_publisher):
     poll_post_id = await mock_publisher.push_post(post)
 
     assert poll_post_id == response_data["data"]["id"]
+
+
+@pytest.mark.asyncio
+async def test_push_post_acquires_quota(mock_publisher):
+    mock_publisher.quota = mock.MagicMock(acquire=mock.AsyncMock())
+    mock_publisher.make_call = mock.AsyncMock(return_value={"data": {"id": 987654321}})
+
+    await mock_publisher.push_post(PublisherPost(post_id=1, text="Continuation", title="", priority=1))
+    await mock_publisher.push_post(PublisherPost(post_id=1, text="Ending", title="", end=True))
+
+    assert mock_publisher.quota.acquire.await_args_list == [mock.call(2, 1), mock.call(1, 0)]
+
+
+@pytest.mark.asyncio
+async def test_push_post_quota_exceeded(mock_publisher):
+    mock_publisher.quota = mock.MagicMock(acquire=mock.AsyncMock(side_effect=QuotaExceeded(2, 0, 100)))
+    mock_publisher.make_call = mock.AsyncMock()
+
+    with pytest.raises(QuotaExceeded):
+        await mock_publisher.push_post(PublisherPost(post_id=1, text="Continuation", title=""))
+
+    mock_publisher.make_call.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_scraper_backend_stops_after_first_item():
+    consumed = []
+
+    class Scraper:
+        def __init__(self, tweetId):
+            pass
+
+        def get_items(self):
+            for tweet in MockTwitterTweetScraper(tweetId=1).get_items():
+                consumed.append(tweet)
+                yield tweet
+            consumed.append("reply")
+            yield "reply"
+
+    post = await ScraperPollBackend(Scraper, timeout=1).get_post(123456789)
+
+    assert post.poll_option_2_name == "Option 2"
+    assert len(consumed) == 1
+
+
+@pytest.mark.asyncio
+async def test_scraper_backend_timeout():
+    class Scraper:
+        def __init__(self, tweetId):
+            pass
+
+        def get_items(self):
+            time.sleep(0.5)
+            yield None
+
+    with pytest.raises(asyncio.TimeoutError):
+        await ScraperPollBackend(Scraper, timeout=0.01).get_post(1)
+
+
+@pytest.mark.asyncio
+async def test_scraper_backend_no_tweet():
+    class Scraper:
+        def __init__(self, tweetId):
+            pass
+
+        def get_items(self):
+            yield from []
+
+    with pytest.raises(ValueError):
+        await ScraperPollBackend(Scraper, timeout=1).get_post(1)
+
+
+@pytest.mark.asyncio
+async def test_api_backend(mock_publisher):
+    mock_publisher.make_call = mock.AsyncMock(return_value={
+        "data": {"id": "123456789", "text": "Raw tweet content"},
+        "includes": {"polls": [{"options": [
+            {"position": 2, "label": "2", "votes": 7},
+            {"position": 1, "label": "1", "votes": 3},
+        ]}]}
+    })
+    mock_publisher.poll_backend = ApiPollBackend(mock_publisher)
+
+    post = await mock_publisher.get_post(123456789)
+
+    assert post == PublisherPost(
+        post_id=123456789,
+        text="Raw tweet content",
+        title="",
+        poll_option_1_name="1",
+        poll_option_1_votes=3,
+        poll_option_2_name="2",
+        poll_option_2_votes=7,
+    )
+    assert mock_publisher.make_call.await_args.args[0] == "tweets/123456789"
+
+
+@pytest.mark.asyncio
+async def test_api_backend_get_posts_in_batches(mock_publisher):
+    async def make_call(url, data, method, params=None, retry=None):
+        ids = params["ids"].split(",")
+        return {
+            "data": [{"id": tweet_id, "text": f"Tweet {tweet_id}", "attachments": {"poll_ids": [f"poll{tweet_id}"]}}
+                     for tweet_id in ids if tweet_id != "3"],
+            "includes": {"polls": [{"id": f"poll{tweet_id}", "options": [
+                {"position": 1, "label": "1", "votes": 1},
+                {"position": 2, "label": "2", "votes": int(tweet_id)},
+            ]} for tweet_id in ids]},
+            "errors": [{"resource_id": "3", "detail": "Could not find tweet with ids: [3]."}] if "3" in ids else [],
+        }
+
+    mock_publisher.make_call = mock.AsyncMock(side_effect=make_call)
+    mock_publisher.poll_backend = ApiPollBackend(mock_publisher)
+    mock_publisher.poll_backend.batch_size = 2
+
+    posts = await mock_publisher.get_posts([1, 2, 3, 4, 5])
+
+    assert mock_publisher.make_call.await_count == 3
+    assert [posts[post_id].poll_option_2_votes for post_id in [1, 2, 4, 5]] == [1, 2, 4, 5]
+    assert isinstance(posts[3], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_api_backend_get_posts_failed_batch(mock_publisher):
+    mock_publisher.make_call = mock.AsyncMock(side_effect=PublisherError("HTTP error 503", 503))
+    mock_publisher.poll_backend = ApiPollBackend(mock_publisher)
+
+    posts = await mock_publisher.get_posts([1, 2])
+
+    assert all(isinstance(posts[post_id], PublisherError) for post_id in [1, 2])
+
+
+@pytest.mark.asyncio
+async def test_scraper_backend_get_posts():
+    class Scraper:
+        def __init__(self, tweetId):
+            self.tweet_id = tweetId
+
+        def get_items(self):
+            if self.tweet_id == 2:
+                time.sleep(0.5)
+            if self.tweet_id != 3:
+                yield from MockTwitterTweetScraper(self.tweet_id).get_items()
+
+    posts = await ScraperPollBackend(Scraper, timeout=0.2).get_posts([1, 2, 3, 4])
+
+    assert posts[1].post_id == 1 and posts[4].post_id == 4
+    assert isinstance(posts[2], asyncio.TimeoutError)
+    assert isinstance(posts[3], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_gather_posts_is_bounded():
+    running = []
+    peak = []
+
+    async def get_post(post_id):
+        running.append(post_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(post_id)
+        return PublisherPost(post_id=post_id, text="", title="")
+
+    posts = await gather_posts(get_post, list(range(10)), concurrency=3)
+
+    assert sorted(posts) == list(range(10))
+    assert max(peak) == 3
+
+
+@pytest.mark.asyncio
+async def test_session_lifecycle():
+    async with Publisher() as publisher:
+        session = publisher.get_session()
+        assert publisher.get_session() is session
+        assert session.connector.limit == TWITTER_POOL_SIZE
+        assert session.connector.use_dns_cache
+        assert session.timeout.total == publisher.request_timeout
+
+    assert session.closed
+    assert publisher.session is None
+
+    session = publisher.get_session()
+    assert not session.closed
+    await publisher.close()
+
+
+class ScriptedClientSession(MockClientSession):
+    def __init__(self, responses):
+        super(ScriptedClientSession, self).__init__()
+        self.responses = list(responses)
+        self.requests = 0
+
+    def request(self, method, url, headers, data):
+        self.requests += 1
+        return self.responses.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_make_call_waits_for_rate_limit(mock_publisher):
+    mock_publisher.session = ScriptedClientSession([
+        MockResponse(429, {}, {"retry-after": "0"}),
+        MockResponse(201, {"data": {"id": 1}}),
+    ])
+
+    response = await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert response == {"data": {"id": 1}}
+    assert [attempt.outcome for attempt in mock_publisher.attempts] == ["retry", "success"]
+    assert mock_publisher.attempts[0].status == 429
+
+
+@pytest.mark.asyncio
+async def test_make_call_does_not_retry_client_error(mock_publisher):
+    mock_publisher.session = ScriptedClientSession([MockResponse(400, {"error": "bad request"})])
+
+    with pytest.raises(PublisherError) as error:
+        await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert error.value.status == 400
+    assert mock_publisher.session.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_make_call_fails_fast_when_reset_is_past_deadline(mock_publisher):
+    mock_publisher.retry_policy = RetryPolicy(deadline=60)
+    mock_publisher.session = ScriptedClientSession([
+        MockResponse(429, {}, {"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(time.time() + 900)}),
+    ])
+
+    with pytest.raises(PublisherError) as error:
+        await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert error.value.status == 429
+    assert mock_publisher.session.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_make_call_gives_up_after_retries(mock_publisher):
+    mock_publisher.retry_policy = RetryPolicy(retries=2, base_delay=0)
+    mock_publisher.session = ScriptedClientSession([MockResponse(503, {}) for _ in range(3)])
+
+    with pytest.raises(PublisherError):
+        await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert mock_publisher.session.requests == 3
+    assert [attempt.outcome for attempt in mock_publisher.attempts] == ["retry", "retry", "error"]
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+
+    assert 0 <= policy.delay(1) <= 2
+    assert 0 <= policy.delay(10) <= 5
+    assert policy.delay(0, {"retry-after": "7"}) == 7
+    assert 59 <= policy.delay(0, {"retry-after": formatdate(time.time() + 60, usegmt=True)}) <= 60
+    assert 0 <= policy.delay(0, {"retry-after": "soon"}) <= 1
+    assert 29 <= policy.delay(0, {"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(time.time() + 30)}) <= 30
+    assert policy.should_retry(429)
+    assert policy.should_retry(None)
+    assert not policy.should_retry(403)
+    assert policy.should_retry(429, "POST")
+    assert policy.should_retry(None, "POST", sent=False)
+    assert not policy.should_retry(None, "POST")
+    assert not policy.should_retry(502, "POST")
+
+
+class FailingClientSession(MockClientSession):
+    def __init__(self, errors):
+        super(FailingClientSession, self).__init__()
+        self.errors = list(errors)
+        self.requests = 0
+
+    def request(self, method, url, headers, data):
+        self.requests += 1
+        error = self.errors.pop(0)
+        if isinstance(error, MockResponse):
+            return error
+        raise error
+
+
+@pytest.mark.asyncio
+async def test_make_call_does_not_repeat_post_after_timeout(mock_publisher):
+    mock_publisher.retry_policy = RetryPolicy(base_delay=0)
+    mock_publisher.session = FailingClientSession([asyncio.TimeoutError()])
+
+    with pytest.raises(PublisherError):
+        await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert mock_publisher.session.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_make_call_repeats_post_that_never_connected(mock_publisher):
+    mock_publisher.retry_policy = RetryPolicy(base_delay=0)
+    mock_publisher.session = FailingClientSession([
+        ClientConnectorError(mock.MagicMock(), OSError("refused")),
+        MockResponse(201, {"data": {"id": 1}}),
+    ])
+
+    assert await mock_publisher.make_call("tweets", "{}", "POST") == {"data": {"id": 1}}
+    assert mock_publisher.session.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_make_call_repeats_get_after_timeout(mock_publisher):
+    mock_publisher.retry_policy = RetryPolicy(base_delay=0)
+    mock_publisher.session = FailingClientSession([asyncio.TimeoutError(), MockResponse(200, {"data": {}})])
+
+    assert await mock_publisher.make_call("tweets/1", "", "GET") == {"data": {}}
+
+
+class SlowClientSession(ScriptedClientSession):
+    def request(self, method, url, headers, data):
+        self.requests += 1
+        return SlowResponse(self.responses.pop(0))
+
+
+class SlowResponse:
+    def __init__(self, response):
+        self.response = response
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.1)
+        return self.response
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_make_call_post_is_not_cut_off_by_deadline(mock_publisher):
+    mock_publisher.session = SlowClientSession([MockResponse(201, {"data": {"id": 1}})])
+
+    with Deadline(0.01).activate():
+        assert await mock_publisher.make_call("tweets", "{}", "POST") == {"data": {"id": 1}}
+
+
+@pytest.mark.asyncio
+async def test_make_call_post_does_not_wait_past_deadline(mock_publisher):
+    mock_publisher.session = ScriptedClientSession([
+        MockResponse(429, {}, {"retry-after": "2"}),
+        MockResponse(201, {"data": {"id": 1}}),
+    ])
+    started = time.monotonic()
+
+    with Deadline(0.5).activate():
+        with pytest.raises(PublisherError):
+            await mock_publisher.make_call("tweets", "{}", "POST")
+
+    assert time.monotonic() - started < 0.5
+    assert mock_publisher.session.requests == 1
+    assert [attempt.outcome for attempt in mock_publisher.attempts] == ["error"]
+
+
+@pytest.mark.asyncio
+async def test_make_call_post_retries_when_next_attempt_fits_deadline(mock_publisher):
+    mock_publisher.request_timeout = 0.1
+    mock_publisher.session = ScriptedClientSession([
+        MockResponse(429, {}, {"retry-after": "0"}),
+        MockResponse(201, {"data": {"id": 1}}),
+    ])
+
+    with Deadline(5).activate():
+        assert await mock_publisher.make_call("tweets", "{}", "POST") == {"data": {"id": 1}}
+
+
+@pytest.mark.asyncio
+async def test_make_call_get_is_cancelled_by_deadline(mock_publisher):
+    mock_publisher.session = SlowClientSession([MockResponse(200, {"data": {}})])
+
+    with Deadline(0.01).activate():
+        with pytest.raises(DeadlineExceeded):
+            await mock_publisher.make_call("tweets/1", "", "GET")
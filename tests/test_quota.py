@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from src.api.config import TWEET_QUOTA_NAME
+from src.api.exceptions import QuotaExceeded
+from src.implementation.publisher.quota import TweetQuota
+from src.implementation.storage.filesystem import Storage as FileSystemStorage
+from tests.test_cache import DictStorage
+
+
+@pytest.fixture
+def storage():
+    return DictStorage()
+
+
+def saved_state(storage) -> dict:
+    return json.loads(storage.files[TWEET_QUOTA_NAME].decode(encoding="utf-8"))
+
+
+@pytest.mark.asyncio
+async def test_acquire_spends_tokens(storage):
+    quota = TweetQuota(storage, capacity=10, period=86400, max_wait=0)
+
+    await quota.acquire(2)
+    await quota.acquire(1)
+
+    state = saved_state(storage)
+    assert 6.99 < state["tokens"] < 7.01
+    assert len(state["spent"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_state_is_shared_through_storage(storage):
+    await TweetQuota(storage, capacity=3, period=86400, max_wait=0).acquire(2)
+
+    with pytest.raises(QuotaExceeded) as error:
+        await TweetQuota(storage, capacity=3, period=86400, max_wait=0).acquire(2)
+
+    # one token comes back every 8 hours
+    assert error.value.retry_at - time.time() > 7 * 60 * 60
+    assert saved_state(storage)["tokens"] < 1.01
+
+
+@pytest.mark.asyncio
+async def test_tokens_refill(storage):
+    now = time.time()
+    storage.files[TWEET_QUOTA_NAME] = json.dumps({"tokens": 0, "updated": now - 30, "spent": [now - 30]}).encode()
+    quota = TweetQuota(storage, capacity=10, period=100, max_wait=0)
+
+    await quota.acquire(2)
+
+    assert 0.99 < saved_state(storage)["tokens"] < 1.1
+
+
+@pytest.mark.asyncio
+async def test_waits_for_refill(storage):
+    storage.files[TWEET_QUOTA_NAME] = json.dumps({"tokens": 0, "updated": time.time()}).encode()
+    quota = TweetQuota(storage, capacity=100, period=10, max_wait=1)
+    quota.poll_interval = 0.01
+
+    started = time.monotonic()
+    await quota.acquire(2)
+
+    assert 0.01 < time.monotonic() - started < 0.5
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_goes_first(storage):
+    storage.files[TWEET_QUOTA_NAME] = json.dumps({"tokens": 0, "updated": time.time()}).encode()
+    quota = TweetQuota(storage, capacity=100, period=10, max_wait=1)
+    quota.poll_interval = 0.01
+    order = []
+
+    async def publish(name, priority):
+        await quota.acquire(2, priority)
+        order.append(name)
+
+    await asyncio.gather(publish("new story", 0), publish("continuation", 1))
+
+    assert order == ["continuation", "new story"]
+    assert quota.waiters == []
+
+
+@pytest.mark.asyncio
+async def test_status(storage):
+    now = time.time()
+    # 6 tweets in last hour of 10 per day is far above refill rate
+    storage.files[TWEET_QUOTA_NAME] = json.dumps({"tokens": 4, "updated": now, "spent": [now - 60] * 6}).encode()
+    quota = TweetQuota(storage, capacity=10, period=86400)
+
+    status = await quota.status()
+
+    assert status.capacity == 10
+    assert 3.99 < status.remaining < 4.01
+    assert status.projected_exhaustion is not None
+    assert status.projected_exhaustion.timestamp() - now < 86400
+
+
+@pytest.mark.asyncio
+async def test_status_without_spending(storage):
+    status = await TweetQuota(storage, capacity=10).status()
+
+    assert status.remaining == 10
+    assert status.projected_exhaustion is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_hosts_share_quota(tmp_path):
+    storage = FileSystemStorage(str(tmp_path))
+    # every host has its own quota object and lock, only etag check keeps spends from overwriting each other
+    hosts = [TweetQuota(storage, capacity=3, period=86400, max_wait=0) for _ in range(5)]
+
+    results = await asyncio.gather(*[host.acquire(1) for host in hosts], return_exceptions=True)
+
+    assert sum(result is None for result in results) == 3
+    assert all(isinstance(result, QuotaExceeded) for result in results if result is not None)
+    assert len(json.loads((await storage.get_file(TWEET_QUOTA_NAME)).decode(encoding="utf-8"))["spent"]) == 3
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from src.api.models import ChannelResult
+from src.implementation.worker.azure import Worker
+from src.implementation.worker.scheduler import Scheduler
+
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.get_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def worker():
+    return mock.MagicMock(spec=Worker)
+
+
+@pytest.mark.asyncio
+async def test_run_once_processes_due_channels(worker):
+    worker.run_channels = mock.AsyncMock(return_value=[
+        ChannelResult(channel="a", seconds=0.1, due=time.time() + 100),
+        ChannelResult(channel="b", seconds=0.1, error="broken"),
+    ])
+    scheduler = Scheduler(worker, ["a", "b"], retry_seconds=10)
+    started = scheduler.queue[0][0]
+
+    await scheduler.run_once()
+
+    worker.run_channels.assert_awaited_once()
+    assert sorted(worker.run_channels.call_args.args[0]) == ["a", "b"]
+    assert [channel for _, channel in sorted(scheduler.queue)] == ["b", "a"]
+    assert sorted(scheduler.queue)[0][0] > started
+
+
+@pytest.mark.asyncio
+async def test_run_once_skips_channels_not_due(worker):
+    scheduler = Scheduler(worker, ["a"])
+    scheduler.queue = [(time.time() + 100, "a")]
+
+    await scheduler.run_once()
+
+    worker.run_channels.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_sleeps_until_earliest_channel(worker):
+    calls = []
+
+    async def run_channels(channels):
+        calls.append((time.time(), channels))
+        if len(calls) == 2:
+            scheduler.stop()
+        return [ChannelResult(channel=channel, seconds=0, due=time.time() + 0.05) for channel in channels]
+
+    worker.run_channels = mock.AsyncMock(side_effect=run_channels)
+    scheduler = Scheduler(worker, ["a"])
+
+    await asyncio.wait_for(scheduler.run(), timeout=1)
+
+    assert [channels for _, channels in calls] == [["a"], ["a"]]
+    assert calls[1][0] - calls[0][0] >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_stop_wakes_sleeping_scheduler(worker):
+    scheduler = Scheduler(worker, ["a"])
+    scheduler.queue = [(time.time() + 100, "a")]
+
+    running = asyncio.ensure_future(scheduler.run())
+    await asyncio.sleep(0.01)
+    scheduler.stop()
+
+    await asyncio.wait_for(running, timeout=1)
@@ -1,9 +1,15 @@
 import pytest
 from unittest import mock
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError, \
+    ResourceNotModifiedError
 from azure.storage.blob.aio import BlobServiceClient, BlobClient
-from src.api.config import AZURE_CONTAINER_NAME
+from src.api.config import AZURE_CONTAINER_NAME, STORY_POOL_NAME
+from src.api.codec import encode_checkpoint
+from src.api.exceptions import StorageConflict
+from src.api.models import CheckPoint, Story, StoryManager, StoryPool
 from src.implementation.storage.azure import Storage
+from tests.test_cache import DictStorage
 
 @pytest.fixture
 def mock_blob_service_client():
@@ -76,3 +82,166 @@ async def test_upload_file(storage, mock_blob_service_client):
     mock_blob_client.upload_blob.assert_awaited_once_with(
         file_data, overwrite=True
     )
+
+
+@pytest.mark.asyncio
+async def test_get_file_not_found(storage, mock_blob_service_client):
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.download_blob.side_effect = ResourceNotFoundError()
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+
+    with pytest.raises(FileNotFoundError):
+        await storage.get_file("test.txt")
+
+
+@pytest.mark.asyncio
+async def test_pop_pooled_story(storage):
+    pool = StoryPool(stories=[
+        StoryManager(stories=[], active_story=Story(tag="story", text="First")),
+        StoryManager(stories=[], active_story=Story(tag="story", text="Second")),
+    ])
+    storage.get_file_if_changed = mock.AsyncMock(return_value=(pool.json().encode("utf-8"), "etag1"))
+    storage.upload_file_if_match = mock.AsyncMock(return_value="etag2")
+
+    manager = await storage.pop_pooled_story()
+
+    assert manager.active_story.text == "First"
+    storage.get_file_if_changed.assert_awaited_once_with(STORY_POOL_NAME, None)
+    storage.upload_file_if_match.assert_awaited_once_with(
+        STORY_POOL_NAME, StoryPool(stories=pool.stories[1:]).json().encode("utf-8"), "etag1"
+    )
+
+
+@pytest.mark.asyncio
+async def test_pop_pooled_story_retries_on_conflict(storage):
+    first = StoryManager(stories=[], active_story=Story(tag="story", text="First"))
+    second = StoryManager(stories=[], active_story=Story(tag="story", text="Second"))
+    # another host popped first story between read and write
+    storage.get_file_if_changed = mock.AsyncMock(side_effect=[
+        (StoryPool(stories=[first, second]).json().encode("utf-8"), "etag1"),
+        (StoryPool(stories=[second]).json().encode("utf-8"), "etag2"),
+    ])
+    storage.upload_file_if_match = mock.AsyncMock(side_effect=[StorageConflict(STORY_POOL_NAME), "etag3"])
+
+    manager = await storage.pop_pooled_story()
+
+    assert manager.active_story.text == "Second"
+    storage.upload_file_if_match.assert_awaited_with(STORY_POOL_NAME, StoryPool().json().encode("utf-8"), "etag2")
+
+
+@pytest.mark.asyncio
+async def test_pop_pooled_story_empty(storage):
+    storage.get_file_if_changed = mock.AsyncMock(side_effect=FileNotFoundError(STORY_POOL_NAME))
+    storage.upload_file_if_match = mock.AsyncMock()
+
+    manager = await storage.pop_pooled_story()
+
+    assert manager is None
+    storage.upload_file_if_match.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_checkpoint_uses_etag(storage, mock_blob_service_client):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="First")))
+    downloader = mock.AsyncMock()
+    downloader.readall.return_value = checkpoint.json(exclude={"etag"}).encode("utf-8")
+    downloader.properties = mock.Mock(etag="etag1")
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.download_blob.side_effect = [downloader, ResourceNotModifiedError()]
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+
+    first = await storage.get_checkpoint()
+    first.post_id = 2
+    second = await storage.get_checkpoint()
+
+    assert second == CheckPoint(**checkpoint.dict(exclude={"etag"}), etag="etag1")
+    assert mock_blob_client.download_blob.await_args_list == [
+        mock.call(),
+        mock.call(etag="etag1", match_condition=MatchConditions.IfModified),
+    ]
+    mock_blob_client.exists.assert_not_called()
+    assert (storage.checkpoint_reads, storage.checkpoint_not_modified, storage.round_trips_saved) == (2, 1, 2)
+
+
+@pytest.mark.asyncio
+async def test_get_checkpoint_missing(storage, mock_blob_service_client):
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.download_blob.side_effect = ResourceNotFoundError()
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+    storage.checkpoint_cache[""] = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="First")), etag="etag1")
+
+    assert await storage.get_checkpoint() is None
+    assert storage.checkpoint_cache == {}
+
+
+@pytest.mark.asyncio
+async def test_save_checkpoint_compares_etag(storage, mock_blob_service_client):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="First")), etag="etag1")
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.upload_blob.return_value = {"etag": "etag2"}
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+
+    await storage.save_checkpoint(checkpoint)
+
+    mock_blob_client.upload_blob.assert_awaited_once_with(
+        data=encode_checkpoint(checkpoint), overwrite=True, etag="etag1",
+        match_condition=MatchConditions.IfNotModified
+    )
+    assert checkpoint.etag == "etag2"
+    assert storage.checkpoint_cache == {"": checkpoint}
+
+
+@pytest.mark.asyncio
+async def test_save_new_checkpoint_conflict(storage, mock_blob_service_client):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="First")))
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.upload_blob.side_effect = ResourceExistsError()
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+
+    with pytest.raises(StorageConflict):
+        await storage.save_checkpoint(checkpoint)
+
+    assert mock_blob_client.upload_blob.await_args.kwargs["overwrite"] is False
+    assert storage.checkpoint_cache == {}
+
+
+@pytest.mark.asyncio
+async def test_remove_checkpoint_compares_etag(storage, mock_blob_service_client):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="story", text="First")), etag="etag1")
+    mock_blob_client = mock.create_autospec(BlobClient)
+    mock_blob_client.delete_blob.side_effect = ResourceModifiedError()
+    mock_blob_service_client.get_blob_client.return_value = mock_blob_client
+    storage.client = mock_blob_service_client
+
+    with pytest.raises(StorageConflict):
+        await storage.remove_checkpoint(checkpoint)
+
+    mock_blob_client.delete_blob.assert_awaited_once_with(etag="etag1", match_condition=MatchConditions.IfNotModified)
+
+
+@pytest.mark.asyncio
+async def test_lease():
+    storage = DictStorage()
+
+    await storage.acquire_lease("checkpoint.json", 60)
+    with pytest.raises(StorageConflict):
+        await storage.acquire_lease("checkpoint.json", 60)
+
+    await storage.release_lease("checkpoint.json", None)
+    await storage.acquire_lease("checkpoint.json", 60)
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_taken_over():
+    storage = DictStorage()
+
+    await storage.acquire_lease("checkpoint.json", -1)
+    await storage.acquire_lease("checkpoint.json", 60)
+
+    with pytest.raises(StorageConflict):
+        await storage.acquire_lease("checkpoint.json", 60)
@@ -1,7 +1,12 @@
+import asyncio
+import time
+
 import pytest
 from unittest import mock
 
-from src.api.models import StoryManager
+from src.api.exceptions import StoryParseError
+from src.api.models import GenerationStats, Story, StoryManager
+from src.implementation.text_generator.limiter import TokenBudget
 from src.implementation.text_generator.openai import TextGenerator
 
 
@@ -58,14 +63,15 @@ Here's an example:
     
     example = StoryManager(**ready_dict)
     
-    text_generator.get_content = mock.MagicMock(return_value=mock_response)
+    text_generator.get_content = mock.AsyncMock(return_value=mock_response)
 
     story_manager = await text_generator.generate_story()
 
     assert story_manager == example
 
 
-def test_search_story_parts(text_generator):
+@pytest.mark.asyncio
+async def test_search_story_parts(text_generator):
     content = """
 Here's an example:
 
@@ -102,7 +108,7 @@ Here's an example:
     {end-option 2}: 
     You ignore the homeless person and feel bad about your decision.
     """
-    names = text_generator.search_story_parts(content)
+    names = await text_generator.search_story_parts(content)
 
     assert names["storybegin"] == 'You find a wallet on the street. It contains $500. Do you:'
     assert names["option1"] == 'Turn it into the police'
@@ -175,10 +181,338 @@ def test_check_empty_text(text_generator):
     assert text_generator.check_empty_text(non_empty_text) == non_empty_text
 
 
-def test_get_content(text_generator, mock_openai_chat_completion):
-    text_generator.get_gpt_story = mock.MagicMock(return_value="Generated story content")
+@pytest.mark.asyncio
+async def test_get_content(text_generator, mock_openai_chat_completion):
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="Generated story content")
 
-    content = text_generator.get_content()
+    content = await text_generator.get_content()
 
     assert content == "Generated story content"
 
+
+@pytest.mark.asyncio
+async def test_get_gpt_story_uses_pooled_session(text_generator):
+    response = {"choices": [{"message": {"content": "Generated story content"}}]}
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(return_value=response)
+
+        content = await text_generator.get_gpt_story("promt")
+        session = text_generator.session
+        await text_generator.get_gpt_story("promt")
+
+    assert content == "Generated story content"
+    assert text_generator.session is session
+    assert chat_completion.acreate.await_args.kwargs["request_timeout"] == (
+        text_generator.connect_timeout, text_generator.read_timeout
+    )
+
+    await text_generator.close()
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_search_story_parts_retries_without_blocking(text_generator):
+    text_generator.get_content = mock.AsyncMock(return_value="still not a story")
+    text_generator.retry = 2
+
+    with pytest.raises(ValueError):
+        await text_generator.search_story_parts("not a story")
+
+    assert text_generator.get_content.await_count == 2
+
+
+JSON_RESPONSE = """{"stories": [
+    {"tag": "story", "text": "You find a wallet.", "option_1": "Return it", "option_2": "Keep it"},
+    {"tag": "story-1", "text": "The owner rewards you.", "option_1": "Accept", "option_2": "Refuse"},
+    {"tag": "story-1-1", "text": "You accept the reward.", "end": true},
+    {"tag": "story-1-2", "text": "", "end": true},
+    {"tag": "story-2", "text": "You feel guilty.", "option_1": "Donate", "option_2": "Ignore"},
+    {"tag": "story-2-1", "text": "You donate the money.", "end": true},
+    {"tag": "story-2-2", "text": "You ignore the feeling.", "end": true}
+]}"""
+
+
+@pytest.mark.asyncio
+async def test_generate_story_json():
+    text_generator = TextGenerator(output_format="json")
+    text_generator.get_gpt_story = mock.AsyncMock(return_value=JSON_RESPONSE)
+    text_generator.get_content = mock.AsyncMock()
+
+    story_manager = await text_generator.generate_story()
+
+    text_generator.get_gpt_story.assert_awaited_once_with(TextGenerator.json_promt, json_output=True)
+    text_generator.get_content.assert_not_awaited()
+    assert [story.tag for story in story_manager.stories] == TextGenerator.story_tags
+    assert story_manager.active_story == story_manager["story"]
+    assert story_manager["story"].option_2 == "Keep it"
+    assert story_manager["story-1-2"].text == "No possible options - end of story"
+    assert story_manager["story-2-2"].end is True
+
+
+@pytest.mark.asyncio
+async def test_generate_story_json_asks_for_json_with_custom_promt():
+    text_generator = TextGenerator(output_format="json")
+    text_generator.get_gpt_story = mock.AsyncMock(return_value=JSON_RESPONSE)
+
+    await text_generator.generate_story("Write a story about a lost wallet.")
+
+    promt = text_generator.get_gpt_story.await_args.args[0]
+    assert promt.startswith("Write a story about a lost wallet.")
+    assert promt.endswith(TextGenerator.json_format)
+    assert "{story-begin}" not in promt
+    assert text_generator.get_gpt_story.await_args.kwargs == {"json_output": True}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("response", [
+    "not a json",
+    '{"story": "no list"}',
+    JSON_RESPONSE.replace('"tag": "story-2-2"', '"tag": "story-3"'),
+    JSON_RESPONSE.replace('"option_2": "Refuse"', '"option_2": ""'),
+])
+async def test_generate_story_json_falls_back_to_text(response):
+    text_generator = TextGenerator(output_format="json")
+    text_generator.get_gpt_story = mock.AsyncMock(return_value=response)
+    text_generator.get_content = mock.AsyncMock(return_value="text story")
+    text_generator.search_story_parts = mock.AsyncMock(return_value={
+        "storybegin": "Story", "option1": "1", "option2": "2",
+        "story1": "Story 1", "story1option1": "1", "story1option2": "2", "end11": "End", "end12": "End",
+        "story2": "Story 2", "story2option1": "1", "story2option2": "2", "end21": "End", "end22": "End",
+    })
+
+    story_manager = await text_generator.generate_story()
+
+    text_generator.get_content.assert_awaited_once_with(None)
+    assert story_manager.active_story.text == "Story"
+
+
+def test_unknown_output_format():
+    with pytest.raises(ValueError):
+        TextGenerator(output_format="xml")
+
+
+STORY = """
+    {story-begin}: You find a wallet on the street.
+    {option 1}: Turn it in
+    {option 2}: Keep the money
+    {story-option 1}: You turn the wallet into the police station.
+    {option 1}: Accept reward
+    {option 2}: Refuse reward
+    {end-option 1}: You accept the reward.
+    {end-option 2}: You refuse the reward.
+    {story-option 2}: You keep the money and feel guilty.
+    {option 1}: Give it away
+    {option 2}: Ignore it
+    {end-option 1}: You give the money away.
+    {end-option 2}: You ignore the guilt.
+"""
+
+
+@pytest.mark.asyncio
+async def test_search_story_parts_repairs_missing_parts(text_generator):
+    content = STORY.replace("{end-option 1}: You give the money away.", "").replace("{option 2}: Keep the money", "")
+    text_generator.get_content = mock.AsyncMock()
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="{option2}: Keep it\n{end21}: You donate it.")
+
+    names = await text_generator.search_story_parts(content)
+
+    text_generator.get_content.assert_not_awaited()
+    promt = text_generator.get_gpt_story.await_args.args[0]
+    assert "{storybegin}: You find a wallet on the street." in promt
+    assert "{end21}: ending after first option" in promt
+    assert "{end22}: ending" not in promt
+    assert names["option2"] == "Keep it"
+    assert names["end21"] == "You donate it."
+    assert names["end22"] == "You ignore the guilt."
+
+
+@pytest.mark.asyncio
+async def test_search_story_parts_retry_budget_is_per_call(text_generator):
+    content = STORY.replace("{end-option 2}: You ignore the guilt.", "")
+    text_generator.retry = 1
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="{end22}: You ignore the guilt.")
+
+    for _ in range(3):
+        names = await text_generator.search_story_parts(content)
+        assert names["end22"] == "You ignore the guilt."
+
+    assert text_generator.retry == 1
+    assert text_generator.get_gpt_story.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_search_story_parts_regenerates_when_too_much_is_missing(text_generator):
+    text_generator.get_content = mock.AsyncMock(return_value=STORY)
+    text_generator.get_gpt_story = mock.AsyncMock()
+
+    names = await text_generator.search_story_parts(STORY[:STORY.index("{story-option 1}")])
+
+    text_generator.get_content.assert_awaited_once_with(text_generator.promt)
+    text_generator.get_gpt_story.assert_not_awaited()
+    assert names["end22"] == "You ignore the guilt."
+
+
+@pytest.mark.asyncio
+async def test_search_story_parts_repair_exhausts_budget(text_generator):
+    content = STORY.replace("{end-option 2}: You ignore the guilt.", "")
+    text_generator.retry = 2
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="I can't help with that")
+
+    with pytest.raises(StoryParseError) as error:
+        await text_generator.search_story_parts(content)
+
+    assert error.value.missing == ["end22"]
+    assert text_generator.get_gpt_story.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_story_streaming_hands_over_active_story_early(text_generator):
+    chunks = [STORY[position:position + 5] for position in range(0, len(STORY), 5)]
+    streamed = []
+    handed_over = []
+
+    async def stream_gpt_story(promt=None):
+        for chunk in chunks:
+            streamed.append(chunk)
+            yield chunk
+
+    text_generator.stream_gpt_story = stream_gpt_story
+    text_generator.get_gpt_story = mock.AsyncMock()
+
+    story_manager = await text_generator.generate_story_streaming(
+        lambda story: handed_over.append((story, len(streamed)))
+    )
+
+    assert len(handed_over) == 1
+    story, streamed_at = handed_over[0]
+    assert story == story_manager.active_story
+    assert story.option_2 == "Keep the money"
+    assert streamed_at < len(chunks) / 2
+    assert story_manager["story-2-2"].text == "You ignore the guilt."
+    text_generator.get_gpt_story.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_generate_story_streaming_repairs_after_hand_over(text_generator):
+    async def stream_gpt_story(promt=None):
+        yield STORY[:STORY.index("{story-option 1}") + len("{story-option 1}:")]
+
+    text_generator.stream_gpt_story = stream_gpt_story
+    text_generator.get_content = mock.AsyncMock()
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="""
+    {story1}: You return it. {story1option1}: Smile {story1option2}: Leave {end11}: Smiled. {end12}: Left.
+    {story2}: You keep it. {story2option1}: Spend {story2option2}: Save {end21}: Spent. {end22}: Saved.
+    """)
+    on_active_story = mock.MagicMock()
+
+    story_manager = await text_generator.generate_story_streaming(on_active_story)
+
+    on_active_story.assert_called_once_with(story_manager.active_story)
+    text_generator.get_content.assert_not_awaited()
+    assert story_manager["story-2"].option_1 == "Spend"
+
+
+@pytest.mark.asyncio
+async def test_generate_story_streaming_repairs_broken_stream_after_hand_over(text_generator):
+    async def stream_gpt_story(promt=None):
+        yield STORY[:STORY.index("{story-option 1}") + len("{story-option 1}:")]
+        raise ConnectionResetError("stream broke off")
+
+    text_generator.stream_gpt_story = stream_gpt_story
+    text_generator.get_gpt_story = mock.AsyncMock(return_value="""
+    {story1}: You return it. {story1option1}: Smile {story1option2}: Leave {end11}: Smiled. {end12}: Left.
+    {story2}: You keep it. {story2option1}: Spend {story2option2}: Save {end21}: Spent. {end22}: Saved.
+    """)
+    on_active_story = mock.MagicMock()
+
+    story_manager = await text_generator.generate_story_streaming(on_active_story)
+
+    on_active_story.assert_called_once_with(story_manager.active_story)
+    assert story_manager["story-1"].text == "You return it."
+
+
+@pytest.mark.asyncio
+async def test_stream_gpt_story(text_generator):
+    async def response():
+        yield {"choices": []}
+        yield {"choices": [{"delta": {"role": "assistant"}}]}
+        yield {"choices": [{"delta": {"content": "Once "}}]}
+        yield {"choices": [{"delta": {"content": "upon"}}]}
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(return_value=response())
+
+        chunks = [chunk async for chunk in text_generator.stream_gpt_story()]
+
+    assert chunks == ["Once ", "upon"]
+    assert chat_completion.acreate.await_args.kwargs["stream"] is True
+    # usage of streamed response is estimated from its text
+    assert text_generator.requests == 1
+    expected = TextGenerator.estimate_tokens(text_generator.system_message + text_generator.promt) \
+        + TextGenerator.estimate_tokens("Once upon")
+    assert text_generator.tokens_used == expected
+    await text_generator.close()
+
+
+@pytest.mark.asyncio
+async def test_generate_stories(text_generator):
+    manager = StoryManager(stories=[], active_story=Story(tag="story", text="Story"))
+    running = 0
+    max_running = 0
+
+    async def generate_story(promt=None):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01 if promt == "slow" else 0)
+        running -= 1
+        if promt == "broken":
+            raise ValueError("broken story")
+        text_generator.tokens_used += 100
+        return manager
+
+    text_generator.generate_story = generate_story
+    stats = GenerationStats()
+
+    results = [result async for result in text_generator.generate_stories(
+        prompts=["slow", "broken", "fast", "fast"], concurrency=2, stats=stats
+    )]
+
+    assert max_running == 2
+    assert results[-1].promt == "slow"
+    assert sorted(result.index for result in results) == [0, 1, 2, 3]
+    assert [result.error for result in results if result.error] == ["broken story"]
+    assert stats.stories == 3
+    assert stats.failed == 1
+    assert stats.tokens == 300
+    assert stats.stories_per_minute > 0
+    assert stats.tokens_per_second > 0
+
+
+@pytest.mark.asyncio
+async def test_create_completion_records_usage_and_budget():
+    text_generator = TextGenerator(tokens_per_minute=6000)
+    response = {"choices": [{"message": {"content": "story"}}], "usage": {"total_tokens": 1500}}
+
+    with mock.patch("src.implementation.text_generator.openai.openai.ChatCompletion") as chat_completion:
+        chat_completion.acreate = mock.AsyncMock(return_value=response)
+
+        await text_generator.get_gpt_story()
+        await text_generator.get_gpt_story()
+
+    assert text_generator.tokens_used == 3000
+    assert text_generator.estimated_tokens == 1500
+    assert text_generator.token_budget.tokens == pytest.approx(3000, abs=10)
+    await text_generator.close()
+
+
+@pytest.mark.asyncio
+async def test_token_budget_waits_for_refill():
+    budget = TokenBudget(tokens_per_minute=60_000)
+    budget.settle(0, 60_000)
+
+    started = time.monotonic()
+    await budget.acquire(50)
+
+    assert time.monotonic() - started >= 0.04
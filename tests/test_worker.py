@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 from unittest import mock
 
 import pytest
@@ -7,7 +8,11 @@ import pytest
 from src.abstract.publisher import Publisher
 from src.abstract.storage import Storage
 from src.abstract.text_generator import TextGenerator
-from src.api.models import CheckPoint, PublisherPost, Story, StoryManager
+from src.api.exceptions import DeadlineExceeded, QuotaExceeded, StorageConflict
+from src.api.models import CheckPoint, GenerationResult, PublisherPost, Story, StoryManager, StoryPool, StoryStep
+from src.implementation.deadline import Deadline, remaining
+from src.implementation.storage.archive import StoryArchive
+from src.implementation.storage.memory import Storage as MemoryStorage
 from src.implementation.worker.azure import Worker
 
 
@@ -44,15 +49,103 @@ def setup_logging():
 
 
 @pytest.mark.asyncio
-async def test_exec_with_checkpoint(worker, storage):
+async def test_exec_with_checkpoint(worker, publisher, storage):
     checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="", text="")))
+    post = PublisherPost(post_id=1, text="", title="")
     storage.get_checkpoint = mock.AsyncMock(return_value=checkpoint)
+    publisher.get_posts = mock.AsyncMock(return_value={1: post})
+    worker.continue_story = mock.AsyncMock(return_value=CheckPoint(post_id=2, story_manager=checkpoint.story_manager,
+                                                                   due=1000.0))
+
+    worker.lease_seconds = 60
+
+    results = await worker.exec()
+
+    # checkpoint is claimed by saving it with due time pushed forward, not with lease and second read
+    storage.get_checkpoint.assert_awaited_once_with("")
+    storage.save_checkpoint.assert_awaited_once_with(checkpoint, "")
+    storage.acquire_lease.assert_not_called()
+    worker.continue_story.assert_called_once_with(checkpoint, "", post)
+    assert results[0].due == 1000.0
+
+
+@pytest.mark.asyncio
+async def test_exec_skips_checkpoint_claimed_by_another_worker(worker, storage):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="", text="")))
+    storage.save_checkpoint = mock.AsyncMock(side_effect=StorageConflict("checkpoint.json"))
     worker.continue_story = mock.AsyncMock()
+    worker.lease_seconds = 60
 
-    await worker.exec()
+    assert await worker.process_channel("", checkpoint) is None
 
-    storage.get_checkpoint.assert_awaited_once()
-    worker.continue_story.assert_called_once_with(checkpoint)
+    worker.continue_story.assert_not_called()
+    assert storage.save_checkpoint.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_exec_releases_claimed_checkpoint_on_failure(worker, storage):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="", text="")),
+                            etag="etag1")
+
+    async def save_checkpoint(saved, channel):
+        saved.etag = "etag2"
+
+    storage.save_checkpoint = mock.AsyncMock(side_effect=save_checkpoint)
+    worker.continue_story = mock.AsyncMock(side_effect=QuotaExceeded(2, 0.5, 1234.0))
+    worker.lease_seconds = 60
+
+    assert await worker.process_channel("", checkpoint) == 1234.0
+
+    claimed, released = [call.args[0] for call in storage.save_checkpoint.await_args_list]
+    assert claimed.due > time.time()
+    # claimed version is put back as it was read, due when quota frees up
+    assert released.post_id == 1 and released.due == 1234.0
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_is_claimed_by_one_worker(text_generator, publisher):
+    storage = MemoryStorage()
+    story = Story(tag="story", text="Some text")
+    await storage.save_checkpoint(CheckPoint(post_id=1, story_manager=StoryManager(stories=[story],
+                                                                                   active_story=story)))
+    workers = [Worker(text_generator, publisher, storage) for _ in range(2)]
+    for worker in workers:
+        worker.lease_seconds = 60
+        worker.continue_story = mock.AsyncMock(return_value=None)
+    read = [await storage.get_checkpoint() for _ in workers]
+
+    results = [await worker.process_channel("", checkpoint) for worker, checkpoint in zip(workers, read)]
+
+    assert results[1] is None
+    workers[0].continue_story.assert_awaited_once()
+    workers[1].continue_story.assert_not_called()
+    assert not workers[0].is_due(await storage.get_checkpoint())
+
+
+@pytest.mark.asyncio
+async def test_exec_looks_up_posts_of_due_channels_in_one_batch(worker, publisher, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text=""))
+    checkpoints = {
+        "a": CheckPoint(post_id=1, story_manager=manager),
+        "b": CheckPoint(post_id=2, story_manager=manager, due=time.time() + 600),
+        "c": CheckPoint(post_id=3, story_manager=manager, due=time.time() - 1),
+        "d": None
+    }
+    posts = {1: PublisherPost(post_id=1, text="", title=""), 3: ValueError("lookup failed")}
+    storage.get_checkpoint = mock.AsyncMock(side_effect=lambda channel: checkpoints[channel])
+    publisher.get_posts = mock.AsyncMock(return_value=posts)
+    worker.continue_story = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock(return_value=None)
+    worker.channels = ["a", "b", "c", "d"]
+    worker.lease_seconds = 0
+
+    results = await worker.exec()
+
+    assert sorted(publisher.get_posts.await_args.args[0]) == [1, 3]
+    publisher.get_post.assert_not_called()
+    worker.continue_story.assert_awaited_once_with(checkpoints["a"], "a", posts[1])
+    worker.start_new_story.assert_awaited_once_with("d")
+    assert [result.error is None for result in results] == [True, True, False, True]
 
 
 @pytest.mark.asyncio
@@ -62,10 +155,109 @@ async def test_exec_without_checkpoint(worker, storage):
 
     await worker.exec()
 
-    storage.get_checkpoint.assert_awaited_once()
+    storage.get_checkpoint.assert_awaited_with("")
     worker.start_new_story.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_exec_skips_channel_before_poll_closes(worker, storage):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[], active_story=Story(tag="", text="")),
+                            due=time.time() + 600)
+    storage.get_checkpoint = mock.AsyncMock(return_value=checkpoint)
+    worker.continue_story = mock.AsyncMock()
+
+    results = await worker.exec()
+
+    storage.get_checkpoint.assert_awaited_once_with("")
+    storage.acquire_lease.assert_not_called()
+    worker.continue_story.assert_not_called()
+    assert results[0].due == checkpoint.due
+
+
+@pytest.mark.asyncio
+async def test_process_channel_returns_retry_time_when_quota_exceeded(worker, storage):
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock(side_effect=QuotaExceeded(2, 0.5, 1234.0))
+
+    assert await worker.process_channel("", None) == 1234.0
+
+
+@pytest.mark.asyncio
+async def test_exec_runs_channels_concurrently(worker):
+    running = []
+    peak = []
+
+    async def process_channel(channel, checkpoint, posts):
+        running.append(channel)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(channel)
+        if channel == "broken":
+            raise ValueError("broken channel")
+
+    worker.storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.process_channel = mock.AsyncMock(side_effect=process_channel)
+    worker.channels = ["a", "broken", "b", "c"]
+    worker.channel_concurrency = 2
+
+    results = await worker.exec()
+
+    assert [result.channel for result in results] == ["a", "broken", "b", "c"]
+    assert [result.error is None for result in results] == [True, False, True, True]
+    assert all(result.seconds > 0 for result in results)
+    assert max(peak) == 2
+
+
+@pytest.mark.asyncio
+async def test_exec_fails_when_all_channels_fail(worker):
+    worker.storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.process_channel = mock.AsyncMock(side_effect=ValueError("broken channel"))
+    worker.channels = ["a", "b"]
+
+    with pytest.raises(RuntimeError):
+        await worker.exec()
+
+
+@pytest.mark.asyncio
+async def test_process_channel_uses_namespaced_checkpoint(worker, storage):
+    storage.acquire_lease = mock.AsyncMock(return_value="lease")
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock()
+    worker.lease_seconds = 60
+
+    await worker.process_channel("fantasy", None)
+
+    storage.acquire_lease.assert_awaited_once_with("channels/fantasy/checkpoint.json", 60)
+    storage.get_checkpoint.assert_awaited_with("fantasy")
+    worker.start_new_story.assert_awaited_once_with("fantasy")
+
+
+@pytest.mark.asyncio
+async def test_exec_skips_when_leased(worker, storage):
+    storage.acquire_lease = mock.AsyncMock(side_effect=StorageConflict("checkpoint.json.lease"))
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock()
+    worker.lease_seconds = 60
+
+    await worker.exec()
+
+    storage.get_checkpoint.assert_awaited_once()
+    worker.start_new_story.assert_not_called()
+    storage.release_lease.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_exec_backs_off_on_conflict(worker, storage):
+    storage.acquire_lease = mock.AsyncMock(return_value="lease")
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock(side_effect=StorageConflict("checkpoint.json"))
+    worker.lease_seconds = 60
+
+    await worker.exec()
+
+    storage.release_lease.assert_awaited_once_with("checkpoint.json", "lease")
+
+
 @pytest.mark.asyncio
 async def test_publish_new_post(worker, publisher):
     story = Story(tag="", text="Some story", option_1="Option 1", option_2="Option 2", end=False)
@@ -81,7 +273,8 @@ async def test_publish_new_post(worker, publisher):
             title="#ai #generated #story #CHOICEISYOURS",
             poll_option_1_name="Option 1",
             poll_option_2_name="Option 2",
-            end=False
+            end=False,
+            priority=1
         )
     )
 
@@ -89,19 +282,152 @@ async def test_publish_new_post(worker, publisher):
 @pytest.mark.asyncio
 async def test_start_new_story(worker, text_generator, publisher, storage):
     manager = StoryManager(stories=[], active_story=Story(tag="", text="Some story", option_1="Option 1", option_2="Option 2", end=False))
-    text_generator.generate_story = mock.AsyncMock(return_value=manager)
+    order = []
+
+    async def generate_story_streaming(on_active_story, promt=None):
+        on_active_story(manager.active_story)
+        await asyncio.sleep(0)
+        order.append("generated")
+        return manager
+
+    async def publish_new_post(story, previous_post=-1):
+        order.append("published")
+        return 2
+
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=generate_story_streaming)
+    worker.publish_new_post = mock.AsyncMock(side_effect=publish_new_post)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    storage.save_checkpoint = mock.AsyncMock()
+    worker.poll_due = mock.Mock(return_value=1000.0)
+
+    checkpoint = await worker.start_new_story()
+
+    text_generator.generate_story_streaming.assert_awaited_once()
+    assert order == ["published", "generated"]
+    worker.publish_new_post.assert_awaited_once_with(manager.active_story)
+    assert checkpoint == CheckPoint(post_id=2, story_manager=manager, due=1000.0)
+    storage.save_checkpoint.assert_awaited_once_with(checkpoint, "")
+
+
+@pytest.mark.asyncio
+async def test_start_new_story_generation_fails_after_publish(worker, text_generator, publisher, storage):
+    story = Story(tag="story", text="Some story", option_1="Option 1", option_2="Option 2")
+
+    async def generate_story_streaming(on_active_story, promt=None):
+        on_active_story(story)
+        raise ValueError("broken story")
+
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=generate_story_streaming)
+    worker.publish_new_post = mock.AsyncMock(return_value=2)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    storage.save_checkpoint = mock.AsyncMock()
+
+    with pytest.raises(ValueError):
+        await worker.start_new_story()
+
+    worker.publish_new_post.assert_awaited_once_with(story)
+    storage.save_checkpoint.assert_not_awaited()
+    # published opening has no story behind it
+    publisher.delete_post.assert_awaited_once_with(2)
+
+
+@pytest.mark.asyncio
+async def test_start_new_story_from_pool(worker, text_generator, publisher, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Pooled story", option_1="Option 1", option_2="Option 2", end=False))
+    text_generator.generate_story = mock.AsyncMock()
     worker.publish_new_post = mock.AsyncMock(return_value=2)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=manager)
     storage.save_checkpoint = mock.AsyncMock()
+    worker.poll_due = mock.Mock(return_value=1000.0)
 
     await worker.start_new_story()
 
-    text_generator.generate_story.assert_awaited_once()
+    text_generator.generate_story.assert_not_awaited()
     worker.publish_new_post.assert_awaited_once_with(manager.active_story)
     storage.save_checkpoint.assert_awaited_once_with(
-        CheckPoint(post_id=2, story_manager=manager)
+        CheckPoint(post_id=2, story_manager=manager, due=1000.0), ""
     )
 
 
+@pytest.mark.asyncio
+async def test_start_new_story_from_pool_quota_exceeded(worker, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Pooled story", option_1="Option 1", option_2="Option 2", end=False))
+    worker.publish_new_post = mock.AsyncMock(side_effect=QuotaExceeded(2, 0.5, 100))
+    storage.pop_pooled_story = mock.AsyncMock(return_value=manager)
+    storage.push_pooled_story = mock.AsyncMock()
+    storage.save_checkpoint = mock.AsyncMock()
+
+    with pytest.raises(QuotaExceeded):
+        await worker.start_new_story()
+
+    storage.push_pooled_story.assert_awaited_once_with(manager)
+    storage.save_checkpoint.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_generated_story_is_pooled_when_quota_exceeded(worker, text_generator, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Some story", option_1="Option 1", option_2="Option 2", end=False))
+
+    async def generate_story_streaming(on_active_story, promt=None):
+        on_active_story(manager.active_story)
+        return manager
+
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=generate_story_streaming)
+    worker.publish_new_post = mock.AsyncMock(side_effect=QuotaExceeded(2, 0.5, 100))
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    storage.push_pooled_story = mock.AsyncMock()
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    storage.save_checkpoint = mock.AsyncMock()
+
+    await worker.exec()
+
+    storage.push_pooled_story.assert_awaited_once_with(manager)
+    text_generator.commit.assert_awaited_once()
+    # commit applies to this story's reservation only
+    text_generator.reservation.assert_called_once()
+    storage.save_checkpoint.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_refill_story_pool(worker, text_generator, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Some story"))
+    pool = StoryPool(stories=[manager])
+    requested = []
+
+    async def generate_stories(n=None, prompts=None, concurrency=None, stats=None):
+        requested.append((n, concurrency))
+        for index in range(n):
+            if index == 1:
+                yield GenerationResult(index=index, error="broken")
+            else:
+                yield GenerationResult(index=index, story_manager=manager)
+
+    text_generator.generate_stories = generate_stories
+    storage.get_story_pool = mock.AsyncMock(return_value=pool)
+    worker.pool_size = 5
+    worker.pool_low_water_mark = 1
+    worker.pool_refill_concurrency = 3
+
+    added = await worker.refill_story_pool()
+
+    assert added == 3
+    assert requested == [(4, 3)]
+    storage.extend_story_pool.assert_awaited_once_with([manager] * 3)
+
+
+@pytest.mark.asyncio
+async def test_refill_story_pool_above_low_water_mark(worker, text_generator, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Some story"))
+    text_generator.generate_story = mock.AsyncMock()
+    storage.get_story_pool = mock.AsyncMock(return_value=StoryPool(stories=[manager] * 3))
+    worker.pool_low_water_mark = 2
+
+    added = await worker.refill_story_pool()
+
+    assert added == 0
+    text_generator.generate_story.assert_not_awaited()
+
+
 @pytest.mark.asyncio
 async def test_continue_story(worker, publisher, storage):
     story_option = "1"  # Replace with the desired story option
@@ -126,6 +452,214 @@ async def test_continue_story(worker, publisher, storage):
     storage.remove_checkpoint.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_continue_story_uses_prefetched_post(worker, publisher, storage):
+    story = Story(tag="story", text="Some text")
+    story2 = Story(tag="story-2", text="Some text")
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[story, story2], active_story=story))
+    post = PublisherPost(post_id=1, text="", title="", poll_option_1_votes=0, poll_option_2_votes=3)
+    worker.publish_new_post = mock.AsyncMock(return_value=3)
+
+    saved = await worker.continue_story(checkpoint, post=post)
+
+    publisher.get_post.assert_not_called()
+    assert saved.story_manager.active_story == story2
+    assert saved.post_id == 3
+
+
+
+@pytest.mark.asyncio
+async def test_continue_story_archives_finished_story(text_generator, publisher, storage):
+    story = Story(tag="story", text="Some text", option_1="1", option_2="2")
+    ending = Story(tag="story-2", text="Ending", end=True)
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[story, ending], active_story=story))
+    archive = mock.MagicMock(spec=StoryArchive)
+    worker = Worker(text_generator, publisher, storage, archive=archive)
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=1, poll_option_2_votes=4))
+    worker.publish_new_post = mock.AsyncMock(return_value=3)
+
+    await worker.continue_story(checkpoint)
+
+    archived = archive.add.await_args.args[0]
+    assert archived.story_id == 1
+    assert archived.ending == "story-2"
+    assert archived.path == [StoryStep(tag="story", post_id=1, poll_option_1_votes=1, poll_option_2_votes=4)]
+    storage.remove_checkpoint.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_continue_story_archive_failure_does_not_stop_ending(text_generator, publisher, storage):
+    story = Story(tag="story", text="Some text", option_1="1", option_2="2")
+    ending = Story(tag="story-1", text="Ending", end=True)
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(stories=[story, ending], active_story=story))
+    archive = mock.MagicMock(spec=StoryArchive)
+    archive.add.side_effect = OSError("storage is down")
+    worker = Worker(text_generator, publisher, storage, archive=archive)
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    worker.publish_new_post = mock.AsyncMock(return_value=3)
+
+    await worker.continue_story(checkpoint)
+
+    worker.publish_new_post.assert_awaited_once_with(ending, 1)
+    storage.remove_checkpoint.assert_awaited_once()
+
+
+def ending_checkpoint() -> CheckPoint:
+    story = Story(tag="story", text="Some text", option_1="1", option_2="2")
+    ending = Story(tag="story-1", text="Ending", end=True)
+    return CheckPoint(post_id=1, story_manager=StoryManager(stories=[story, ending], active_story=story), etag="etag1")
+
+
+@pytest.mark.asyncio
+async def test_pipelined_ending_starts_next_story(worker, text_generator, publisher, storage):
+    checkpoint = ending_checkpoint()
+    manager = StoryManager(stories=[], active_story=Story(tag="story", text="Next story", option_1="1", option_2="2"))
+    order = []
+
+    async def generate_story_streaming(on_active_story, promt=None):
+        order.append("generating")
+        on_active_story(manager.active_story)
+        return manager
+
+    async def publish_new_post(story, previous_post=-1):
+        await asyncio.sleep(0.01)
+        order.append(story.text)
+        return 2 if story.end else 3
+
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=generate_story_streaming)
+    worker.publish_new_post = mock.AsyncMock(side_effect=publish_new_post)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    worker.pipeline = True
+    worker.poll_due = mock.Mock(return_value=1000.0)
+
+    saved = await worker.continue_story(checkpoint, "fantasy")
+
+    assert order == ["generating", "Ending", "Next story"]
+    assert saved == CheckPoint(post_id=3, story_manager=manager, due=1000.0, etag="etag1")
+    storage.save_checkpoint.assert_awaited_once_with(saved, "fantasy")
+    storage.remove_checkpoint.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_ending_failure_returns_next_story_to_pool(worker, publisher, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="story", text="Next story", option_1="1", option_2="2"))
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    worker.publish_new_post = mock.AsyncMock(side_effect=QuotaExceeded(1, 0, 100))
+    storage.pop_pooled_story = mock.AsyncMock(return_value=manager)
+    worker.pipeline = True
+
+    with pytest.raises(QuotaExceeded):
+        await worker.continue_story(ending_checkpoint())
+
+    worker.publish_new_post.assert_awaited_once()
+    storage.push_pooled_story.assert_awaited_once_with(manager)
+    storage.save_checkpoint.assert_not_awaited()
+    storage.remove_checkpoint.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_next_story_failure_removes_checkpoint(worker, text_generator, publisher, storage):
+    checkpoint = ending_checkpoint()
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=ValueError("broken story"))
+    worker.publish_new_post = mock.AsyncMock(return_value=2)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    worker.pipeline = True
+
+    with pytest.raises(ValueError):
+        await worker.continue_story(checkpoint)
+
+    storage.remove_checkpoint.assert_awaited_once_with(checkpoint, "")
+
+
+@pytest.mark.asyncio
+async def test_publish_is_refused_without_critical_budget(worker, publisher, storage):
+    manager = StoryManager(stories=[], active_story=Story(tag="", text="Pooled story", option_1="1", option_2="2"))
+    storage.pop_pooled_story = mock.AsyncMock(return_value=manager)
+    worker.critical_seconds = 30
+
+    with Deadline(10).activate():
+        with pytest.raises(DeadlineExceeded):
+            await worker.start_new_story()
+
+    publisher.push_post.assert_not_called()
+    storage.push_pooled_story.assert_awaited_once_with(manager)
+    storage.save_checkpoint.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_hung_generation_is_cancelled_before_publish(worker, text_generator, storage):
+    async def generate_story_streaming(on_active_story, promt=None):
+        await asyncio.sleep(10)
+
+    text_generator.generate_story_streaming = mock.AsyncMock(side_effect=generate_story_streaming)
+    storage.pop_pooled_story = mock.AsyncMock(return_value=None)
+    worker.publish_new_post = mock.AsyncMock()
+    worker.critical_seconds = 0.1
+
+    with Deadline(0.15).activate():
+        with pytest.raises(DeadlineExceeded):
+            await worker.start_new_story()
+
+    worker.publish_new_post.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_is_saved_past_deadline(worker, publisher, storage):
+    checkpoint = CheckPoint(post_id=1, story_manager=StoryManager(
+        stories=[Story(tag="story", text="1", option_1="1", option_2="2"),
+                 Story(tag="story-1", text="2", option_1="1", option_2="2")],
+        active_story=Story(tag="story", text="1", option_1="1", option_2="2")))
+    deadline = Deadline(1)
+
+    async def push_post(post):
+        # publish takes whole budget
+        deadline.expires = 0
+        return 2
+
+    async def save_checkpoint(checkpoint, channel=""):
+        assert remaining() is None
+
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    publisher.push_post = mock.AsyncMock(side_effect=push_post)
+    storage.save_checkpoint = mock.AsyncMock(side_effect=save_checkpoint)
+    worker.critical_seconds = 0.5
+
+    with deadline.activate():
+        await worker.continue_story(checkpoint)
+
+    storage.save_checkpoint.assert_awaited_once_with(checkpoint, "")
+
+
+@pytest.mark.asyncio
+async def test_pipeline_is_skipped_without_budget(worker, text_generator, publisher, storage):
+    checkpoint = ending_checkpoint()
+    publisher.get_post = mock.AsyncMock(return_value=PublisherPost(post_id=1, text="", title="", poll_option_1_votes=4))
+    worker.publish_new_post = mock.AsyncMock(return_value=2)
+    worker.pipeline = True
+    worker.critical_seconds = 30
+
+    with Deadline(45).activate():
+        assert await worker.continue_story(checkpoint) is None
+
+    worker.publish_new_post.assert_awaited_once()
+    storage.pop_pooled_story.assert_not_called()
+    storage.remove_checkpoint.assert_awaited_once_with(checkpoint, "")
+
+
+@pytest.mark.asyncio
+async def test_process_channel_leaves_channel_for_next_run_on_deadline(worker, storage):
+    storage.acquire_lease = mock.AsyncMock(return_value="lease")
+    storage.get_checkpoint = mock.AsyncMock(return_value=None)
+    worker.start_new_story = mock.AsyncMock(side_effect=DeadlineExceeded("publishing post", 5))
+    worker.lease_seconds = 60
+
+    with Deadline(0).activate():
+        due = await worker.process_channel("", None)
+
+    assert due <= time.time()
+    storage.release_lease.assert_awaited_once_with("checkpoint.json", "lease")
 
 
 @pytest.mark.asyncio